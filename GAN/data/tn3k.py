@@ -1,7 +1,9 @@
+import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
 import os
 from . utils.mytransforms import *
+from . utils.cache import build_cache, load_cache
 import json
 
 
@@ -16,11 +18,17 @@ class tn3kDataSet(Dataset):
         ratio (int): (Unused parameter, possibly for future use).
         sign (str): Whether data is 'label' (labeled) or 'unlabel' (unlabeled).
         transform (callable, optional): Data transformation pipeline (default is None).
+        cache_dir (str, optional): Directory of decoded uint8 memmaps; the split is decoded
+            once into it if missing (default is None, decode every sample).
+        uint8 (bool): Training samples are only resized to 320x320 and returned as uint8
+            CHW tensors (the batch_aug format); ``transform`` must then do just that, it is
+            skipped when the cache is enabled and the memmap rows are returned directly.
     """
-    def __init__(self, root, expID, mode='train', ratio=10, sign='label', transform=None):
+    def __init__(self, root, expID, mode='train', ratio=10, sign='label', transform=None, cache_dir=None, uint8=False):
         super(tn3kDataSet, self).__init__()
         self.mode = mode
         self.sign = sign
+        self.uint8 = uint8
         if mode == 'train':
             if sign =='label':
                 if(expID == 1):
@@ -79,6 +87,16 @@ class tn3kDataSet(Dataset):
                 ])
         self.transform = transform
 
+        # Optional decoded-image cache: images and masks are read from memmaps
+        self.cache = None
+        if cache_dir:
+            key = self.cache_key(expID)
+            self.cache = load_cache(cache_dir, key, self.imglist)
+            if self.cache is None:
+                gtlist = None if (mode == 'train' and sign == 'unlabel') else [self.gt_path(p) for p in self.imglist]
+                build_cache(self.imglist, gtlist, cache_dir, key)
+                self.cache = load_cache(cache_dir, key, self.imglist)
+
     def __getitem__(self, index):
         """
         Loads and returns a sample from the dataset at the given index.
@@ -89,16 +107,15 @@ class tn3kDataSet(Dataset):
         Returns:
             dict: Contains 'image', 'label' (if available), and 'name'.
         """
+        if self.uint8 and self.cache is not None and self.mode == 'train':
+            return self.cached_uint8(index)
         if self.mode == 'train' and self.sign == 'unlabel':
-            img_path = self.imglist[index]
-            img = Image.open(img_path).convert('RGB')
+            img = self.load_image(index)
             if self.transform:
                 return self.transform(img)
         elif self.mode == 'test' :
-            img_path = self.imglist[index]
-            gt_path = img_path.replace('test-image', 'test-mask')
-            img = Image.open(img_path).convert('RGB')
-            gt = Image.open(gt_path).convert('L')
+            img = self.load_image(index)
+            gt = self.load_label(index)
             data = {'image': img, 'label': gt}
     
             if self.transform:
@@ -108,10 +125,8 @@ class tn3kDataSet(Dataset):
  
             return data
         else :
-            img_path = self.imglist[index]
-            gt_path = img_path.replace('trainval-image', 'trainval-mask')
-            img = Image.open(img_path).convert('RGB')
-            gt = Image.open(gt_path).convert('L')
+            img = self.load_image(index)
+            gt = self.load_label(index)
             data = {'image': img, 'label': gt}
     
             if self.transform:
@@ -121,6 +136,80 @@ class tn3kDataSet(Dataset):
  
             return data
 
+    def cache_key(self, expID):
+        """
+        Name of this split inside the decoded-image cache.
+
+        Args:
+            expID (int): Experiment ID of the split.
+
+        Returns:
+            str: Cache file prefix.
+        """
+        if self.mode == 'train':
+            return 'train_{}_{}'.format(self.sign, expID)
+        return self.mode
+
+    def gt_path(self, img_path):
+        """
+        Returns the ground-truth mask path of an image path.
+
+        Args:
+            img_path (str): Path of the image.
+
+        Returns:
+            str: Path of the matching mask.
+        """
+        if self.mode == 'test':
+            return img_path.replace('test-image', 'test-mask')
+        return img_path.replace('trainval-image', 'trainval-mask')
+
+    def cached_uint8(self, index):
+        """
+        Returns the sample at the given index as views of the memmap cache, which
+        already holds it at 320x320, instead of rebuilding PIL images to resize them.
+
+        Args:
+            index (int): Index of the sample.
+
+        Returns:
+            torch.Tensor or dict: (3, H, W) uint8 image, or {'image', 'label', 'name'}
+            with a (1, H, W) uint8 label.
+        """
+        img = torch.from_numpy(self.cache[0][index]).permute(2, 0, 1)
+        if self.sign == 'unlabel':
+            return img
+        gt = torch.from_numpy(self.cache[1][index])[None]
+        return {'image': img, 'label': gt, 'name': self.imglist[index].split('/')[-1]}
+
+    def load_image(self, index):
+        """
+        Loads the RGB image at the given index, from the memmap cache when enabled.
+
+        Args:
+            index (int): Index of the sample.
+
+        Returns:
+            PIL.Image: RGB image.
+        """
+        if self.cache is not None:
+            return Image.fromarray(self.cache[0][index], 'RGB')
+        return Image.open(self.imglist[index]).convert('RGB')
+
+    def load_label(self, index):
+        """
+        Loads the L-mode mask at the given index, from the memmap cache when enabled.
+
+        Args:
+            index (int): Index of the sample.
+
+        Returns:
+            PIL.Image: Grayscale mask.
+        """
+        if self.cache is not None:
+            return Image.fromarray(self.cache[1][index], 'L')
+        return Image.open(self.gt_path(self.imglist[index])).convert('L')
+
     def __len__(self):
         """
         Returns the total number of samples in the dataset.
@@ -142,4 +231,83 @@ class tn3kDataSet(Dataset):
             for file in files:
                 file_path = os.path.abspath(os.path.join(root, file))
                 file_paths.append(file_path)
-        return file_paths
\ No newline at end of file
+        return file_paths
+
+class tn3kMaskBank(object):
+    """
+    Device-resident bank of labeled training masks for WGAN shape-prior training.
+
+    Only the masks are decoded, once, and pre-rendered at the working resolution
+    that corresponds to ``imageSize`` (320 / 256 * imageSize, i.e. 80 for 64) into a
+    single uint8 tensor on ``device``. Batches are drawn by index and augmented with
+    one batched flip / rotation / zoom / crop warp, so each batch comes out directly
+    at ``imageSize`` without a DataLoader or per-sample work.
+
+    Iterating yields ``{'label': (B, 1, imageSize, imageSize)}`` float batches in [0, 1],
+    one epoch at a time, and ``len()`` is the number of batches per epoch, so it can
+    replace the DataLoader of the GAN training loop.
+
+    Args:
+        root (str): Root directory containing dataset.
+        expID (int): Experiment ID to choose the labeled subset.
+        batch_size (int): Number of masks per batch.
+        imageSize (int): Output mask size.
+        device (str or torch.device): Where the bank lives and batches are built.
+        cache_dir (str, optional): Decoded-image cache of tn3kDataSet, if any. Only the
+            mask rows of the split are read; without a cached split the mask files are
+            decoded directly, the images are never decoded or cached.
+        generator (torch.Generator, optional): RNG for shuffling and augmentation.
+        rank (int): Rank of this process in distributed training.
+        num_replicas (int): Number of processes; each rank then yields its strided share
+            of every ``batch_size`` batch of one epoch order shared by all ranks.
+        seed (int): Seed of that shared order, used only when ``num_replicas > 1``.
+    """
+    def __init__(self, root, expID, batch_size, imageSize=64, device='cpu', cache_dir=None, generator=None,
+                 rank=0, num_replicas=1, seed=0):
+        # The dataset only lists the split; its label cache is opened without the images
+        dataset = tn3kDataSet(root, expID, mode='train', sign='label')
+        cache = load_cache(cache_dir, dataset.cache_key(expID), dataset.imglist) if cache_dir else None
+        work = int(round(imageSize * 320 / 256))
+
+        masks = torch.empty(len(dataset), 1, work, work, dtype=torch.uint8)
+        for i in range(len(dataset)):
+            if cache is not None:
+                label = Image.fromarray(cache[1][i], 'L')
+            else:
+                label = Image.open(dataset.gt_path(dataset.imglist[i])).convert('L')
+            masks[i, 0] = F.pil_to_tensor(F.resize(label, (work, work)))[0]
+        self.masks = masks.to(device)
+
+        self.batch_size = batch_size
+        self.device = self.masks.device
+        self.generator = generator
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.order_generator = torch.Generator().manual_seed(seed) if num_replicas > 1 else generator
+        # Same chain as the labeled transforms, scaled to the working resolution;
+        # masks go through the bilinear (image) path like the former F.interpolate
+        self.augment = BatchRandomGeometric(size=(work, work), output_size=(imageSize, imageSize),
+                                            generator=generator)
+
+    def sample(self, batch_size=None):
+        """
+        Draws a random batch of augmented masks (with replacement).
+
+        Returns:
+            torch.Tensor: (B, 1, imageSize, imageSize) float masks on the bank's device.
+        """
+        index = torch.randint(len(self.masks), (batch_size or self.batch_size,), generator=self.generator)
+        return self.augment(self.masks[index.to(self.device)])
+
+    def __iter__(self):
+        order = torch.randperm(len(self.masks), generator=self.order_generator).to(self.device)
+        for index in order.split(self.batch_size):
+            if self.num_replicas > 1:
+                if len(index) < self.num_replicas:
+                    # Pad a short last batch so that every rank gets a non-empty share
+                    index = index.repeat(self.num_replicas)[:self.num_replicas]
+                index = index[self.rank::self.num_replicas]
+            yield {'label': self.augment(self.masks[index])}
+
+    def __len__(self):
+        return (len(self.masks) + self.batch_size - 1) // self.batch_size
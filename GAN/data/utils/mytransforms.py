@@ -1,11 +1,13 @@
 import torch
 import torchvision.transforms.functional as F
+from torchvision import transforms as T
 import scipy.ndimage
 import random
 from PIL import Image
 import numpy as np
 import cv2
 import numbers
+import math
 
 
 class ToTensor(object):
@@ -279,3 +281,306 @@ class Normalization(object):
         image = F.normalize(image, self.mean, self.std)
         return {'image': image, 'label': label}
 
+
+class ToUint8Tensor(object):
+    """
+    Converts PIL images to uint8 CHW tensors without rescaling, for batched augmentation.
+
+    Accepts either a single image or a {'image', 'label'} dict.
+    """
+
+    def __call__(self, data):
+        if isinstance(data, dict):
+            image, label = data['image'], data['label']
+            return {'image': F.pil_to_tensor(image), 'label': F.pil_to_tensor(label)}
+        return F.pil_to_tensor(data)
+
+
+class BatchRandomGeometric(object):
+    """
+    Batched joint geometric augmentation on tensors, on CPU or GPU.
+
+    Draws the flip / rotation / zoom / crop parameters of the per-sample chain
+    (RandomHorizontalFlip, RandomVerticalFlip, RandomRotation, RandomZoom, RandomCrop)
+    for every sample, composes them into one affine matrix each and resamples the
+    whole batch with a single grid_sample: bilinear for images, nearest for labels.
+    Inputs are taken at any resolution and treated as if resized to ``size`` first.
+
+    Args:
+        size (tuple): Working resolution (H, W) the crop is taken from.
+        output_size (tuple): Crop size (H, W).
+        hflip (float): Horizontal flip probability.
+        vflip (float): Vertical flip probability.
+        degrees (float): Rotation range (-degrees, degrees).
+        rotation_p (float): Rotation probability (0.5 for RandomRotation, 1 for torchvision's).
+        zoom (tuple, optional): Zoom range, None disables zoom.
+        zoom_p (float): Zoom probability.
+        generator (torch.Generator, optional): RNG for the parameters.
+    """
+
+    def __init__(self, size=(320, 320), output_size=(256, 256), hflip=0.5, vflip=0.5,
+                 degrees=90, rotation_p=0.5, zoom=(0.9, 1.1), zoom_p=0.5, generator=None):
+        self.size = size
+        self.output_size = output_size
+        self.hflip = hflip
+        self.vflip = vflip
+        self.degrees = degrees
+        self.rotation_p = rotation_p
+        self.zoom = zoom
+        self.zoom_p = zoom_p
+        self.generator = generator
+
+    def get_params(self, batch_size):
+        """
+        Draws per-sample augmentation parameters.
+
+        Returns:
+            dict: 'hflip', 'vflip' (bool), 'angle' (degrees), 'zoom', 'top', 'left' (pixels),
+            each a CPU tensor of length ``batch_size``.
+        """
+        def rand():
+            return torch.rand(batch_size, generator=self.generator, dtype=torch.float64)
+
+        h, w = self.size
+        th, tw = self.output_size
+        angle = (rand() * 2 - 1) * self.degrees
+        angle = torch.where(rand() < self.rotation_p, angle, torch.zeros_like(angle))
+        zoom = torch.ones(batch_size, dtype=torch.float64)
+        if self.zoom is not None:
+            zoom_min, zoom_max = self.zoom
+            zoom = torch.where(rand() < self.zoom_p, zoom_min + rand() * (zoom_max - zoom_min), zoom)
+        return {
+            'hflip': rand() < self.hflip,
+            'vflip': rand() < self.vflip,
+            'angle': angle,
+            'zoom': zoom,
+            'top': torch.randint(0, h - th + 1, (batch_size,), generator=self.generator),
+            'left': torch.randint(0, w - tw + 1, (batch_size,), generator=self.generator),
+        }
+
+    def get_matrix(self, params):
+        """
+        Composes the parameters into (B, 2, 3) affine_grid matrices.
+
+        The matrices map normalised output (crop) coordinates to normalised input
+        coordinates: crop -> inverse zoom -> inverse rotation -> flips.
+        """
+        h, w = self.size
+        th, tw = self.output_size
+
+        # crop: output grid covers a th x tw window whose centre is offset from the image centre
+        scale = torch.tensor([tw / w, th / h], dtype=torch.float64)
+        shift = torch.stack([(params['left'] + tw / 2 - w / 2) * 2 / w,
+                             (params['top'] + th / 2 - h / 2) * 2 / h], 1).double()
+        # zoom: a zoom factor z magnifies, so the source is z times closer to the centre
+        scale = scale / params['zoom'][:, None]
+        shift = shift / params['zoom'][:, None]
+        # rotation (counter-clockwise, as F.rotate) about the centre
+        theta = torch.deg2rad(params['angle'])
+        cos, sin = torch.cos(theta), torch.sin(theta)
+        rot = torch.stack([torch.stack([cos, -sin], 1), torch.stack([sin, cos], 1)], 1)
+        # flips negate the source axis
+        flip = torch.stack([torch.where(params['hflip'], -1.0, 1.0),
+                            torch.where(params['vflip'], -1.0, 1.0)], 1).double()
+
+        linear = flip[:, :, None] * rot * scale[:, None, :]
+        offset = flip * torch.einsum('bij,bj->bi', rot, shift)
+        return torch.cat([linear, offset[:, :, None]], 2)
+
+    def __call__(self, data):
+        """
+        Args:
+            data (dict or torch.Tensor): {'image': (B, C, H, W), 'label': (B, 1, H, W)} uint8
+                or float tensors, or an image batch alone.
+
+        Returns:
+            Same structure as the input, float tensors in [0, 1] of size ``output_size``.
+            Image batches given in channels_last come back in channels_last.
+        """
+        image = data['image'] if isinstance(data, dict) else data
+        batch_size = image.size(0)
+        memory_format = torch.channels_last if is_channels_last(image) else torch.contiguous_format
+        matrix = self.get_matrix(self.get_params(batch_size)).to(image.device, torch.float32)
+        grid = torch.nn.functional.affine_grid(matrix, (batch_size, 1) + tuple(self.output_size),
+                                               align_corners=False)
+
+        # grid_sample always writes NCHW, restore the layout of the input once here
+        image = torch.nn.functional.grid_sample(to_float(image), grid, mode='bilinear',
+                                                padding_mode='zeros', align_corners=False)
+        image = image.contiguous(memory_format=memory_format)
+        if not isinstance(data, dict):
+            return image
+        label = torch.nn.functional.grid_sample(to_float(data['label']), grid, mode='nearest',
+                                                padding_mode='zeros', align_corners=False)
+        return {'image': image, 'label': label}
+
+
+def is_channels_last(x):
+    """
+    True for 4D tensors stored NHWC (and not also trivially NCHW-contiguous).
+    """
+    return x.dim() == 4 and not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last)
+
+
+def to_float(x):
+    """
+    Scales uint8 tensors to [0, 1] floats like ToTensor, leaves float tensors unchanged.
+    """
+    if x.dtype == torch.uint8:
+        return x.float().div_(255)
+    return x.float()
+
+
+class FusedGeometric(object):
+    """
+    Applies a run of geometric transforms as a single affine resample.
+
+    Each wrapped transform draws its random parameters exactly as it would on its
+    own (same RNG calls, same order), so the distribution of augmentations is
+    unchanged; the per-step maps are then composed into one matrix and the input
+    is resampled once, straight to the crop size. Labels are resampled with nearest
+    and images with the interpolation of the rotation when one is drawn (nearest
+    by default, like F.rotate), bilinear otherwise. The Resize before the run is
+    not fused: PIL's affine transform does not antialias, so downscaling stays a
+    separate F.resize. Built by ``fuse_geometric``.
+
+    Args:
+        transforms (list): Consecutive transforms supported by ``affine_step``.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, data):
+        image = data['image'] if isinstance(data, dict) else data
+        size = image.size
+        matrix = np.eye(3)
+        resample = Image.BILINEAR
+        for t in self.transforms:
+            step, size = affine_step(t, size)
+            matrix = step @ matrix
+            if isinstance(t, (RandomRotation, T.RandomRotation)) and not np.array_equal(step, np.eye(3)):
+                resample = rotation_resample(t)
+
+        # PIL expects the output -> input map
+        coeffs = tuple(np.linalg.inv(matrix)[:2].ravel())
+        image = image.transform(size, Image.AFFINE, coeffs, resample=resample)
+        if not isinstance(data, dict):
+            return image
+        label = data['label'].transform(size, Image.AFFINE, coeffs, resample=Image.NEAREST)
+        return {'image': image, 'label': label}
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(repr(t) for t in self.transforms))
+
+
+def is_fusable(t):
+    """
+    Returns True if ``affine_step`` can express the transform. Resize is left out,
+    it has to antialias when it downscales.
+    """
+    if isinstance(t, (RandomHorizontalFlip, RandomVerticalFlip, RandomZoom,
+                      T.RandomHorizontalFlip, T.RandomVerticalFlip)):
+        return True
+    if isinstance(t, (RandomRotation, T.RandomRotation)):
+        return not t.expand and t.center is None
+    if isinstance(t, (RandomCrop, T.RandomCrop)):
+        return t.padding is None and not t.pad_if_needed
+    return False
+
+
+def affine_step(t, size):
+    """
+    Draws the random parameters of one transform and returns its forward map.
+
+    Args:
+        t: A transform accepted by ``is_fusable``.
+        size (tuple): (W, H) of the transform's input.
+
+    Returns:
+        tuple: (3x3 matrix mapping input to output pixel coordinates, output (W, H)).
+    """
+    w, h = size
+    if isinstance(t, (RandomHorizontalFlip, T.RandomHorizontalFlip)):
+        flip = random.random() < t.p if isinstance(t, RandomHorizontalFlip) else torch.rand(1) < t.p
+        return (np.array([[-1.0, 0, w], [0, 1, 0], [0, 0, 1]]) if flip else np.eye(3)), size
+
+    if isinstance(t, (RandomVerticalFlip, T.RandomVerticalFlip)):
+        flip = random.random() < t.p if isinstance(t, RandomVerticalFlip) else torch.rand(1) < t.p
+        return (np.array([[1.0, 0, 0], [0, -1, h], [0, 0, 1]]) if flip else np.eye(3)), size
+
+    if isinstance(t, (RandomRotation, T.RandomRotation)):
+        # RandomRotation only rotates half of the time, torchvision's always does
+        if isinstance(t, RandomRotation) and random.random() >= 0.5:
+            return np.eye(3), size
+        theta = math.radians(t.get_params(t.degrees))
+        # counter-clockwise on screen (y axis pointing down), like F.rotate
+        rot = np.array([[math.cos(theta), math.sin(theta), 0],
+                        [-math.sin(theta), math.cos(theta), 0],
+                        [0, 0, 1]])
+        return about_center(rot, w, h), size
+
+    if isinstance(t, RandomZoom):
+        if random.random() >= 0.5:
+            return np.eye(3), size
+        zoom = random.uniform(t.min, t.max)
+        return about_center(np.diag([zoom, zoom, 1.0]), w, h), size
+
+    if isinstance(t, (RandomCrop, T.RandomCrop)):
+        th, tw = t.size
+        if w == tw and h == th:
+            return np.eye(3), size
+        if isinstance(t, RandomCrop):
+            i = random.randint(0, h - th)
+            j = random.randint(0, w - tw)
+        else:
+            i = torch.randint(0, h - th + 1, size=(1,)).item()
+            j = torch.randint(0, w - tw + 1, size=(1,)).item()
+        return np.array([[1.0, 0, -j], [0, 1, -i], [0, 0, 1]]), (tw, th)
+
+    raise TypeError("Cannot fuse transform {}".format(t))
+
+
+def rotation_resample(t):
+    """
+    PIL filter the rotation transform resamples with on its own.
+    """
+    if isinstance(t, RandomRotation):
+        # F.rotate takes ``resample`` as a PIL filter code, False being nearest
+        return int(t.resample)
+    return F.pil_modes_mapping[t.interpolation]
+
+
+def about_center(matrix, w, h):
+    """
+    Conjugates a linear map so that it acts about the image centre.
+    """
+    shift = np.array([[1.0, 0, w / 2], [0, 1, h / 2], [0, 0, 1]])
+    unshift = np.array([[1.0, 0, -w / 2], [0, 1, -h / 2], [0, 0, 1]])
+    return shift @ matrix @ unshift
+
+
+def fuse_geometric(transform):
+    """
+    Compose optimizer: collapses every run of two or more consecutive geometric
+    transforms (flips, rotation, zoom, crop) of a ``transforms.Compose`` into one
+    ``FusedGeometric``.
+
+    Returns:
+        The optimised Compose (or the input unchanged if it is not a Compose).
+    """
+    if not isinstance(transform, T.Compose):
+        return transform
+    fused, run = [], []
+    for t in transform.transforms + [None]:
+        if t is not None and is_fusable(t):
+            run.append(t)
+            continue
+        if len(run) > 1:
+            fused.append(FusedGeometric(run))
+        else:
+            fused.extend(run)
+        run = []
+        if t is not None:
+            fused.append(t)
+    return T.Compose(fused)
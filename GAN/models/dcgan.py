@@ -64,7 +64,7 @@ class DCGAN_D(nn.Module):
         Returns:
             Tensor: Output prediction tensor.
         """
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else: 
             output = self.main(input)
@@ -139,7 +139,7 @@ class DCGAN_G(nn.Module):
         Returns:
             Tensor: Generated image tensor.
         """
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else: 
             output = self.main(input)
@@ -197,7 +197,7 @@ class DCGAN_D_nobn(nn.Module):
 
     def forward(self, input):
         """Forward pass of the discriminator."""
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else: 
             output = self.main(input)
@@ -258,7 +258,7 @@ class DCGAN_G_nobn(nn.Module):
 
     def forward(self, input):
         """Forward pass of the generator."""
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input,  range(self.ngpu))
         else: 
             output = self.main(input)
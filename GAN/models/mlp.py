@@ -46,7 +46,7 @@ class MLP_G(nn.Module):
             Tensor: Generated image of shape (batch_size, nc, isize, isize).
         """
         input = input.view(input.size(0), input.size(1))
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else:
             output = self.main(input)
@@ -95,7 +95,7 @@ class MLP_D(nn.Module):
         """
         input = input.view(input.size(0),
                            input.size(1) * input.size(2) * input.size(3))
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else:
             output = self.main(input)
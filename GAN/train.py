@@ -0,0 +1,364 @@
+"""
+Headless WGAN trainer for the shape prior (the notebook's GAN cells as a module).
+
+Usage (from the repository root):
+    python -m GAN.train --config config_gan.yaml [--compile] [--niter N]
+    python -m GAN.train --config config_gan.yaml --nprocs 4 --backend gloo --device cpu
+    torchrun --nproc_per_node 4 -m GAN.train --config config_gan.yaml --backend nccl --seed 1234
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import socket
+import time
+from types import SimpleNamespace
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+import torch.utils.data
+from torch.utils.data.distributed import DistributedSampler
+import torchvision.utils as vutils
+import yaml
+from torch.nn import functional as F
+
+from GAN.data.tn3k import tn3kDataSet, tn3kMaskBank
+import GAN.models.dcgan as dcgan
+import GAN.models.mlp as mlp
+
+
+def weights_init(m):
+    """
+    Custom weights initialization called on netG and netD.
+    """
+    classname = m.__class__.__name__
+    if classname.find('Conv') != -1:
+        m.weight.data.normal_(0.0, 0.02)
+    elif classname.find('BatchNorm') != -1:
+        m.weight.data.normal_(1.0, 0.02)
+        m.bias.data.fill_(0)
+
+
+def build_networks(opt):
+    """
+    Builds and initializes the generator and critic chosen by the options.
+
+    Returns:
+        tuple: (netG, netD)
+    """
+    nz, ngf, ndf, nc = int(opt.nz), int(opt.ngf), int(opt.ndf), int(opt.nc)
+    ngpu, n_extra_layers = int(opt.ngpu), int(opt.n_extra_layers)
+
+    if opt.noBN:
+        netG = dcgan.DCGAN_G_nobn(opt.imageSize, nz, nc, ngf, ngpu, n_extra_layers)
+    elif opt.mlp_G:
+        netG = mlp.MLP_G(opt.imageSize, nz, nc, ngf, ngpu)
+    else:
+        netG = dcgan.DCGAN_G(opt.imageSize, nz, nc, ngf, ngpu, n_extra_layers)
+    netG.apply(weights_init)
+    if opt.netG != '':
+        netG.load_state_dict(unwrap_state_dict(torch.load(opt.netG, weights_only=True)))
+
+    if opt.mlp_D:
+        netD = mlp.MLP_D(opt.imageSize, nz, nc, ndf, ngpu)
+    else:
+        netD = dcgan.DCGAN_D(opt.imageSize, nz, nc, ndf, ngpu, n_extra_layers)
+        netD.apply(weights_init)
+    if opt.netD != '':
+        netD.load_state_dict(unwrap_state_dict(torch.load(opt.netD, weights_only=True)))
+    return netG, netD
+
+
+def build_loader(opt, device, rank=0, world_size=1, seed=0):
+    """
+    Returns the real-mask source: the device-resident mask bank or the tn3k DataLoader.
+
+    With several processes every rank reads its own shard of each batch (batchSize
+    divided by the world size), so the global batch and the number of critic steps
+    per epoch match a single-process run.
+    """
+    cache_dir = getattr(opt, 'cache_dir', None) or None
+    if getattr(opt, 'mask_bank', False):
+        return tn3kMaskBank(opt.root, opt.expID, opt.batchSize, opt.imageSize, device=device, cache_dir=cache_dir,
+                            rank=rank, num_replicas=world_size, seed=seed)
+    dataset = tn3kDataSet(opt.root, opt.expID, mode='train', cache_dir=cache_dir)
+    if world_size == 1:
+        return torch.utils.data.DataLoader(dataset, batch_size=opt.batchSize, shuffle=True,
+                                           num_workers=int(opt.workers), pin_memory=device.type == 'cuda')
+    if opt.batchSize % world_size:
+        raise ValueError("batchSize {} is not divisible by the world size {}".format(opt.batchSize, world_size))
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+    return torch.utils.data.DataLoader(dataset, batch_size=opt.batchSize // world_size, sampler=sampler,
+                                       num_workers=int(opt.workers), pin_memory=device.type == 'cuda')
+
+
+def unwrap_state_dict(state_dict):
+    """
+    Strips the 'module.' prefix of checkpoints saved from nn.DataParallel.
+    """
+    return {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()}
+
+
+class WGANTrainer(object):
+    """
+    WGAN trainer with a fused critic step.
+
+    Per critic step the weights are clamped with one foreach kernel, gradients are
+    reset with ``set_to_none``, the real and fake scores are backpropagated with a
+    single ``backward`` of ``errD_real - errD_fake`` (same gradients as the
+    ``backward(one)`` / ``backward(mone)`` pair), and the noise buffer is refilled in
+    place. Loss values stay on the device and are only read when logging.
+
+    Inside an initialized process group both networks are wrapped in
+    DistributedDataParallel. Buffers are not broadcast on every forward since the
+    critic runs twice (real, fake) before its backward; the generator step scores
+    with the bare critic, whose frozen parameters must not be awaited by the reducer.
+    Only rank 0 logs and writes samples and checkpoints.
+
+    Args:
+        opt (SimpleNamespace): Options from config_gan.yaml.
+        netG (nn.Module): Generator.
+        netD (nn.Module): Critic.
+        device (torch.device): Training device.
+        compile (bool): Wrap the critic and generator losses in ``torch.compile``.
+    """
+    def __init__(self, opt, netG, netD, device, compile=False):
+        self.opt = opt
+        self.device = device
+        self.netG = netG.to(device)
+        self.netD = netD.to(device)
+        self.netG_module, self.netD_module = self.netG, self.netD
+        self.d_params = list(self.netD.parameters())
+        self.is_main = not dist.is_initialized() or dist.get_rank() == 0
+        if dist.is_initialized():
+            device_ids = [device.index] if device.type == 'cuda' else None
+            self.netG = nn.parallel.DistributedDataParallel(self.netG, device_ids=device_ids, broadcast_buffers=False)
+            self.netD = nn.parallel.DistributedDataParallel(self.netD, device_ids=device_ids, broadcast_buffers=False)
+
+        if opt.adam:
+            self.optimizerD = optim.Adam(self.netD.parameters(), lr=opt.lrD, betas=(opt.beta1, 0.999))
+            self.optimizerG = optim.Adam(self.netG.parameters(), lr=opt.lrG, betas=(opt.beta1, 0.999))
+        else:
+            self.optimizerD = optim.RMSprop(self.netD.parameters(), lr=opt.lrD)
+            self.optimizerG = optim.RMSprop(self.netG.parameters(), lr=opt.lrG)
+
+        # Allocated once and refilled in place every step
+        batch_size = opt.batchSize // dist.get_world_size() if dist.is_initialized() else opt.batchSize
+        self.noise = torch.empty(batch_size, int(opt.nz), 1, 1, device=device)
+        self.fixed_noise = torch.randn(opt.batchSize, int(opt.nz), 1, 1, device=device)
+
+        self.critic_loss = self._critic_loss
+        self.generator_loss = self._generator_loss
+        if compile:
+            self.critic_loss = torch.compile(self._critic_loss)
+            self.generator_loss = torch.compile(self._generator_loss)
+
+    @torch.no_grad()
+    def clamp_critic(self):
+        """
+        Clamps every critic parameter to [clamp_lower, clamp_upper] with foreach kernels.
+        """
+        torch._foreach_clamp_min_(self.d_params, self.opt.clamp_lower)
+        torch._foreach_clamp_max_(self.d_params, self.opt.clamp_upper)
+
+    def _critic_loss(self, real, noise):
+        errD_real = self.netD(real)
+        with torch.no_grad():
+            fake = self.netG(noise)  # totally freeze netG
+        errD_fake = self.netD(fake)
+        return errD_real - errD_fake, errD_real, errD_fake
+
+    def _generator_loss(self, noise):
+        return self.netD_module(self.netG(noise))
+
+    def critic_step(self, real):
+        """
+        One critic update on a batch of real masks.
+
+        Returns:
+            tuple: (errD, errD_real, errD_fake) as device tensors.
+        """
+        self.clamp_critic()
+        self.optimizerD.zero_grad(set_to_none=True)
+        errD, errD_real, errD_fake = self.critic_loss(real, self.noise.normal_(0, 1))
+        errD.backward()
+        self.optimizerD.step()
+        return errD.detach(), errD_real.detach(), errD_fake.detach()
+
+    def generator_step(self):
+        """
+        One generator update against the frozen critic.
+
+        Returns:
+            torch.Tensor: errG as a device tensor.
+        """
+        self.netD_module.requires_grad_(False)  # to avoid computation
+        self.optimizerG.zero_grad(set_to_none=True)
+        errG = self.generator_loss(self.noise.normal_(0, 1))
+        errG.backward()
+        self.optimizerG.step()
+        self.netD_module.requires_grad_(True)
+        return errG.detach()
+
+    def real_batch(self, data):
+        """
+        Moves a batch of real masks to the device at imageSize.
+        """
+        real = data['label'].to(self.device, non_blocking=True)
+        if real.shape[-1] != self.opt.imageSize or real.shape[-2] != self.opt.imageSize:
+            real = F.interpolate(real, size=(self.opt.imageSize, self.opt.imageSize),
+                                 mode='bilinear', align_corners=False)
+        return real
+
+    def train(self, loader, niter, log_every=1):
+        """
+        Runs the WGAN schedule of the notebook: 100 critic steps per generator step for
+        the first 25 generator iterations and every 500th, opt.Diters otherwise.
+        """
+        opt = self.opt
+        gen_iterations = 0
+        critic_steps, start = 0, time.perf_counter()
+        for epoch in range(niter):
+            if isinstance(getattr(loader, 'sampler', None), DistributedSampler):
+                loader.sampler.set_epoch(epoch)
+            data_iter = iter(loader)
+            i = 0
+            while i < len(loader):
+                if gen_iterations < 25 or gen_iterations % 500 == 0:
+                    Diters = 100
+                else:
+                    Diters = opt.Diters
+
+                j = 0
+                while j < Diters and i < len(loader):
+                    j += 1
+                    real = self.real_batch(next(data_iter))
+                    i += 1
+                    errD, errD_real, errD_fake = self.critic_step(real)
+                    critic_steps += 1
+
+                errG = self.generator_step()
+                gen_iterations += 1
+
+                if self.is_main and gen_iterations % log_every == 0:
+                    rate = critic_steps / (time.perf_counter() - start)
+                    print('[%d/%d][%d/%d][%d] Loss_D: %f Loss_G: %f Loss_D_real: %f Loss_D_fake %f critic steps/s: %.1f'
+                          % (epoch, niter, i, len(loader), gen_iterations,
+                             errD.item(), errG.item(), errD_real.item(), errD_fake.item(), rate))
+
+                if self.is_main and gen_iterations % 500 == 0:
+                    self.save_samples(real, gen_iterations)
+
+            if self.is_main and epoch % 1000 == 0:
+                self.save_checkpoint(epoch)
+        return gen_iterations, critic_steps / (time.perf_counter() - start)
+
+    def save_samples(self, real, gen_iterations):
+        """
+        Saves real masks and generator samples from the fixed noise, like the notebook.
+        """
+        vutils.save_image(real.mul(0.5).add(0.5), '{0}/real_samples.png'.format(self.opt.experiment))
+        with torch.no_grad():
+            fake = self.netG_module(self.fixed_noise)
+        fake = F.interpolate(fake, size=(256, 256), mode='bilinear', align_corners=False)
+        vutils.save_image(fake.mul(0.5).add(0.5),
+                          '{0}/fake_samples_{1}.png'.format(self.opt.experiment, gen_iterations))
+
+    def save_checkpoint(self, epoch):
+        """
+        Saves netG/netD in the nn.DataParallel key layout the notebook and train_semi load.
+        """
+        for name, net in (('netG', self.netG_module), ('netD', self.netD_module)):
+            state = {'module.' + k: v for k, v in net.state_dict().items()}
+            torch.save(state, '{0}/{1}_epoch_{2}.pth'.format(self.opt.experiment, name, epoch))
+
+
+def run(opt, args):
+    """
+    Trains in one process; joins the process group first when launched distributed.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    rank, local_rank = 0, 0
+    if world_size > 1:
+        rank, local_rank = int(os.environ['RANK']), int(os.environ.get('LOCAL_RANK', os.environ['RANK']))
+        dist.init_process_group(args.backend, rank=rank, world_size=world_size)
+        opt.ngpu = 1  # one device per process, no nested data_parallel inside the networks
+
+    device = torch.device(args.device)
+    if world_size > 1 and device.type == 'cuda':
+        device = torch.device('cuda', local_rank)
+        torch.cuda.set_device(device)
+
+    # Shared by all ranks: seeds the data order, each rank offsets it for its own noise
+    if opt.manualSeed is None:
+        seed = [random.randint(1, 10000)]
+        if world_size > 1:
+            # Every torchrun process would draw its own, rank 0 decides
+            dist.broadcast_object_list(seed, src=0)
+        opt.manualSeed = seed[0]
+    if rank == 0:
+        print("Random Seed: ", opt.manualSeed)
+    random.seed(opt.manualSeed)
+    torch.manual_seed(opt.manualSeed + rank)  # per-rank noise and augmentation
+
+    netG, netD = build_networks(opt)
+    if rank == 0:
+        generator_config = {"imageSize": opt.imageSize, "nz": int(opt.nz), "nc": int(opt.nc), "ngf": int(opt.ngf),
+                            "ngpu": int(opt.ngpu), "n_extra_layers": int(opt.n_extra_layers),
+                            "noBN": opt.noBN, "mlp_G": opt.mlp_G}
+        with open(os.path.join(opt.experiment, "generator_config.json"), 'w') as gcfg:
+            gcfg.write(json.dumps(generator_config) + "\n")
+
+    try:
+        trainer = WGANTrainer(opt, netG, netD, device, compile=args.compile)
+        loader = build_loader(opt, device, rank, world_size, seed=opt.manualSeed)
+        gen_iterations, rate = trainer.train(loader, args.niter or opt.niter, log_every=args.log_every)
+        if rank == 0:
+            print('Done: %d generator iterations, %.1f critic steps/s per process' % (gen_iterations, rate))
+    finally:
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+
+def spawn_worker(rank, world_size, port, opt, args):
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+                      MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    run(opt, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config_gan.yaml')
+    parser.add_argument('--niter', type=int, default=None, help='override the number of epochs')
+    parser.add_argument('--device', default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--compile', action='store_true', help='torch.compile the critic/generator losses')
+    parser.add_argument('--log-every', type=int, default=1, help='generator iterations between log lines')
+    parser.add_argument('--nprocs', type=int, default=1, help='processes to spawn on this node (ignored under torchrun)')
+    parser.add_argument('--backend', default='gloo', choices=['gloo', 'nccl'])
+    parser.add_argument('--seed', type=int, default=None, help='data-order seed shared by all ranks, overrides manualSeed of the config (random if neither)')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        opt = SimpleNamespace(**yaml.safe_load(f))
+    if opt.experiment is None:
+        opt.experiment = 'samples'
+    os.makedirs(opt.experiment, exist_ok=True)
+
+    opt.manualSeed = args.seed if args.seed is not None else getattr(opt, 'manualSeed', None)
+    torch.backends.cudnn.benchmark = True
+
+    if 'WORLD_SIZE' in os.environ or args.nprocs == 1:
+        run(opt, args)
+    else:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        mp.spawn(spawn_worker, args=(args.nprocs, port, opt, args), nprocs=args.nprocs)
+
+
+if __name__ == '__main__':
+    main()
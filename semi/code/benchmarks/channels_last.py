@@ -0,0 +1,106 @@
+"""
+Layout check and CPU benchmark of MyModel in NCHW (contiguous) vs NHWC (channels_last).
+
+The NHWC run asserts that every convolution and BatchNorm sees a channels_last input,
+i.e. the graph never falls back to NCHW between the loader batch and the losses.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.channels_last --batch-size 4 --size 256 --iters 3
+"""
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+
+from semi.code.models.semi_self import MyModel
+from semi.code.utils.loss import BceDiceLoss
+
+LAYOUTS = (('NCHW', torch.contiguous_format), ('NHWC', torch.channels_last))
+
+
+def find_layout_breaks(model, x):
+    """
+    Runs one forward and returns the names of conv / BatchNorm modules whose input is not
+    channels_last.
+    """
+    breaks = []
+    handles = []
+    for name, module in model.named_modules():
+        if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d, nn.BatchNorm2d)):
+            def hook(module, inputs, name=name):
+                if not inputs[0].is_contiguous(memory_format=torch.channels_last):
+                    breaks.append(name)
+            handles.append(module.register_forward_pre_hook(hook))
+    with torch.no_grad():
+        model(x)
+    for handle in handles:
+        handle.remove()
+    return breaks
+
+
+def train_step(model, x, gt, criterion):
+    mask, preboud = model(x)[:2]
+    loss = criterion(mask, gt) + criterion(preboud, gt)
+    loss.backward()
+
+
+def benchmark(model, x, gt, iters):
+    """
+    Returns (eval img/s, train img/s) for one layout.
+    """
+    criterion = BceDiceLoss()
+    model.eval()
+    with torch.no_grad():
+        model(x)  # warm-up
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+        eval_rate = iters * x.size(0) / (time.perf_counter() - start)
+
+    model.train()
+    train_step(model, x, gt, criterion)  # warm-up
+    start = time.perf_counter()
+    for _ in range(iters):
+        model.zero_grad(set_to_none=True)
+        train_step(model, x, gt, criterion)
+    train_rate = iters * x.size(0) / (time.perf_counter() - start)
+    return eval_rate, train_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', default='cpu')
+    opt = parser.parse_args()
+
+    torch.manual_seed(0)
+    base = MyModel().to(opt.device).eval()
+    x = torch.rand(opt.batch_size, 3, opt.size, opt.size, device=opt.device)
+    gt = (torch.rand(opt.batch_size, 1, opt.size, opt.size, device=opt.device) > 0.5).float()
+
+    models = {name: copy.deepcopy(base).to(memory_format=fmt) for name, fmt in LAYOUTS}
+    inputs = {name: (x.contiguous(memory_format=fmt), gt.contiguous(memory_format=fmt)) for name, fmt in LAYOUTS}
+
+    breaks = find_layout_breaks(models['NHWC'], inputs['NHWC'][0])
+    assert not breaks, 'NCHW inputs reach {}'.format(breaks)
+    with torch.no_grad():
+        ref = models['NCHW'](inputs['NCHW'][0])
+        out = models['NHWC'](inputs['NHWC'][0])
+    diff = max((a - b).abs().max().item() for a, b in zip(ref, out))
+    assert diff < 1e-4, 'NHWC outputs differ from NCHW by {}'.format(diff)
+    print('Every conv / BatchNorm input is channels_last, max|NCHW - NHWC| = %.2e\n' % diff)
+
+    print('%-8s %12s %12s' % ('layout', 'eval img/s', 'train img/s'))
+    rates = {}
+    for name, _ in LAYOUTS:
+        rates[name] = benchmark(models[name], *inputs[name], opt.iters)
+        print('%-8s %12.2f %12.2f' % ((name,) + rates[name]))
+    print('%-8s %11.2fx %11.2fx' % ('speedup', rates['NHWC'][0] / rates['NCHW'][0], rates['NHWC'][1] / rates['NCHW'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Resume exactness and training-thread stall of the checkpoint manager.
+
+Resume: a short supervised run (train()'s loop: shuffled loader with random
+worker-side noise, batched augmentation, SGD with the polynomial LR schedule) is
+trained straight through, then again with a simulated preemption in its second epoch
+and a fresh process state (new weights, optimizer and RNG seeds) resumed from the
+periodic last.pth. The final weights must be bitwise identical.
+
+Stall: time the training thread is blocked saving MyModel with its SGD state, by a
+synchronous torch.save and by CheckpointManager.save_last with the background writer.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.checkpoint --size 80 --crop 64 --steps 4 --save-every 2
+    python -m semi.code.benchmarks.checkpoint --num-workers 2 --runs 5
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from semi.code.models.semi_self import MyModel
+from semi.code.train import adjust_lr_rate, build_optimizer, labeled_loss
+from semi.code.utils.amp import grad_scaler
+from semi.code.utils.checkpoint import CheckpointManager
+from semi.code.utils.mytransforms import BatchRandomGeometric
+
+
+class NoisyImages(Dataset):
+    """
+    Random images with labels; every access adds fresh noise from the (worker's) torch RNG.
+    """
+    def __init__(self, n, size):
+        g = torch.Generator().manual_seed(0)
+        self.images = torch.rand(n, 3, size, size, generator=g)
+        self.labels = (torch.rand(n, 1, size, size, generator=g) > 0.5).float()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        return {'image': self.images[i] + 0.05 * torch.rand(self.images[i].shape), 'label': self.labels[i]}
+
+
+class Preempted(Exception):
+    pass
+
+
+def fit(opt, directory, seed, resume=False, stop=None):
+    """
+    Runs the train() loop for opt.epochs epochs, optionally resuming from last.pth or
+    raising Preempted after ``stop`` = (epoch, steps) without a final save.
+    """
+    torch.manual_seed(seed)
+    args = SimpleNamespace(lr=0.01, mt=0.9, weight_decay=1e-5, power=0.9, nEpoch=opt.epochs)
+    model = torch.nn.DataParallel(MyModel(pretrained=False))
+    optim = build_optimizer(model, args)
+    scaler = grad_scaler('off', 'cpu')
+    loader = DataLoader(NoisyImages(opt.steps * opt.batch_size, opt.size), opt.batch_size, shuffle=True,
+                        num_workers=opt.num_workers)
+    label_aug = BatchRandomGeometric(size=(opt.size, opt.size), output_size=(opt.crop, opt.crop))
+
+    ckpt = CheckpointManager(directory, save_every=opt.save_every)
+    state = ckpt.resume(model, optim, scaler) if resume else None
+    try:
+        for epoch in range(state['epoch'] if state else 0, opt.epochs):
+            model.train()
+            total_batch = len(loader)
+            batches, first, epoch_rng = ckpt.start_epoch(state, lambda: loader)
+            state = None
+            for batch_id, data in enumerate(batches, first):
+                if stop == (epoch, batch_id):
+                    raise Preempted()
+                data = label_aug(data)
+                optim.zero_grad()
+                labeled_loss(model, data['image'], data['label']).backward()
+                scaler.step(optim)
+                scaler.update()
+                adjust_lr_rate(optim, total_batch * epoch + batch_id, total_batch, args)
+                ckpt.periodic(model, optim, scaler, epoch, batch_id + 1, total_batch, epoch_rng)
+            ckpt.save_last(model, optim, scaler, epoch + 1)
+    finally:
+        ckpt.close()
+    return model.state_dict()
+
+
+def check_resume(opt):
+    with tempfile.TemporaryDirectory() as straight, tempfile.TemporaryDirectory() as preempted:
+        ref = fit(opt, straight, seed=0)
+        stop = (opt.epochs - 1, opt.steps - 1)
+        try:
+            fit(opt, preempted, seed=0, stop=stop)
+        except Preempted:
+            pass
+        saved = torch.load(os.path.join(preempted, 'last.pth'), weights_only=True)
+        print('Preempted at epoch %d step %d, resuming from epoch %d step %d'
+              % (stop + (saved['epoch'], saved['step'])))
+        out = fit(opt, preempted, seed=1, resume=True)
+    diff = max((ref[k].double() - out[k].double()).abs().max().item() for k in ref)
+    print('Resumed vs uninterrupted run: max weight difference %g' % diff)
+    assert diff == 0, 'resumed run diverged'
+
+
+def check_stall(opt):
+    model = torch.nn.DataParallel(MyModel(pretrained=False))
+    args = SimpleNamespace(lr=0.01, mt=0.9, weight_decay=1e-5)
+    optim = build_optimizer(model, args)
+    model(torch.rand(1, 3, 64, 64))[0].sum().backward()
+    optim.step()  # momentum buffers
+    scaler = grad_scaler('off', 'cpu')
+    state = {'model': model.state_dict(), 'optimizer': optim.state_dict()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        sync = []
+        for _ in range(opt.runs):
+            start = time.perf_counter()
+            torch.save(state, os.path.join(directory, 'sync.pth'))
+            sync.append(time.perf_counter() - start)
+        size = os.path.getsize(os.path.join(directory, 'sync.pth'))
+
+        ckpt = CheckpointManager(directory)
+        stalls = []
+        start_all = time.perf_counter()
+        for _ in range(opt.runs):
+            start = time.perf_counter()
+            ckpt.save_last(model, optim, scaler, 0)
+            stalls.append(time.perf_counter() - start)
+            ckpt.wait()  # one save per epoch: the write finishes long before the next one
+        ckpt.close()
+        total = time.perf_counter() - start_all
+
+    print('\nCheckpoint of %.0f MB (weights + SGD momentum):' % (size / 2 ** 20))
+    print('  torch.save on the training thread   %7.1f ms' % (1000 * min(sync)))
+    print('  CheckpointManager.save_last stall   %7.1f ms  (write %.1f ms in the background, atomic + fsync)'
+          % (1000 * min(stalls), 1000 * (total - sum(stalls)) / opt.runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=80, help='loader image size')
+    parser.add_argument('--crop', type=int, default=64, help='augmentation crop, a multiple of 32')
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=4, help='steps per epoch')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--save-every', type=int, default=2)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=3)
+    opt = parser.parse_args()
+
+    check_resume(opt)
+    check_stall(opt)
+
+
+if __name__ == '__main__':
+    main()
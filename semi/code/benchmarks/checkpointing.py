@@ -0,0 +1,120 @@
+"""
+Equivalence check and memory / throughput report for MyModel activation-checkpointing policies.
+
+Activation memory is the size of the tensors autograd keeps for backward (parameters
+excluded), measured with saved-tensor hooks, so the report works on CPU as well; on
+CUDA the peak allocated memory of a training step is reported too.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.checkpointing --batch-size 2 --size 256 --iters 3
+"""
+import argparse
+import copy
+import time
+import weakref
+
+import torch
+
+from semi.code.models.semi_self import MyModel, CHECKPOINT_POLICIES
+
+
+def saved_activation_bytes(model, x):
+    """
+    Runs one train-mode forward and returns the bytes of the distinct storages that
+    are still held for backward when it returns (parameters excluded).
+    """
+    params = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    saved = []
+
+    def pack(t):
+        # A detached alias, returning t itself would tie the graph into a reference cycle
+        t = t.detach()
+        saved.append(weakref.ref(t))
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        outputs = model(x)
+    storages = {}
+    for ref in saved:
+        t = ref()
+        if t is not None and t.untyped_storage().data_ptr() not in params:
+            storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+    del outputs
+    return sum(storages.values())
+
+
+def train_step(model, x):
+    """
+    One forward / backward over every output, like the twin-decoder training graph.
+    """
+    loss = sum(out.float().mean() for out in model(x) if out.requires_grad)
+    loss.backward()
+    return loss.detach()
+
+
+def time_train(model, x, iters):
+    """
+    Returns training images per second and, on CUDA, the peak allocated bytes of a step.
+    """
+    peak = None
+    train_step(model, x)  # warm-up
+    if x.is_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(iters):
+        model.zero_grad(set_to_none=True)
+        train_step(model, x)
+    if x.is_cuda:
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated()
+    return iters * x.size(0) / (time.perf_counter() - start), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--policies', default=','.join(CHECKPOINT_POLICIES))
+    opt = parser.parse_args()
+
+    torch.manual_seed(0)
+    base = MyModel().to(opt.device).train()
+    x = torch.rand(opt.batch_size, 3, opt.size, opt.size, device=opt.device)
+    policies = opt.policies.split(',')
+
+    # Same RNG stream and starting weights for every policy
+    reference = None
+    for policy in policies:
+        model = copy.deepcopy(base).set_checkpointing(policy)
+        torch.manual_seed(1)
+        loss = train_step(model, x)
+        grads = [p.grad for p in model.parameters() if p.grad is not None]
+        stats = [b for b in model.buffers()]
+        del model
+        if reference is None:
+            reference = (loss, grads, stats)
+            continue
+        assert torch.equal(loss, reference[0]), '{}: loss differs'.format(policy)
+        assert all(torch.allclose(g, r, rtol=1e-4, atol=1e-6) for g, r in zip(grads, reference[1])), \
+            '{}: gradients differ'.format(policy)
+        assert all(torch.equal(b, r) for b, r in zip(stats, reference[2])), \
+            '{}: BatchNorm statistics differ'.format(policy)
+    print('Loss, gradients and BatchNorm statistics match for every policy\n')
+
+    print('%-10s %14s %10s %14s %10s' % ('policy', 'activations', 'saved', 'img/s', 'cuda peak'))
+    base_bytes = None
+    for policy in policies:
+        model = copy.deepcopy(base).set_checkpointing(policy)
+        nbytes = saved_activation_bytes(model, x)
+        base_bytes = base_bytes or nbytes
+        rate, peak = time_train(model, x, opt.iters)
+        print('%-10s %11.1f MB %9.0f%% %14.2f %10s' % (policy, nbytes / 2 ** 20, 100 * (1 - nbytes / base_bytes),
+                                                     rate, '-' if peak is None else '%.0f MB' % (peak / 2 ** 20)))
+        del model
+
+
+if __name__ == '__main__':
+    main()
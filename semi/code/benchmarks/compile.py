@@ -0,0 +1,112 @@
+"""
+Graph-break check and CPU benchmark of torch.compile for MyModel and DCGAN_D.
+
+Every forward variant (full / head-selective eval, train) is traced with
+torch._dynamo.explain and must produce a single graph with no breaks; the models
+are then compiled with fullgraph=True and timed against eager, for inference
+(with inductor weight freezing unless --no-freezing) and for a training step
+(MyModel forward/backward, critic forward with input gradients as in ShapePriorLoss).
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.compile --batch-size 2 --size 256 --iters 5
+"""
+import argparse
+import copy
+import time
+
+import torch
+import torch._dynamo
+import torch._inductor.config
+
+from semi.code.models.dc_gan import DCGAN_D
+from semi.code.models.semi_self import MyModel
+
+
+def check_graph_breaks(name, model, *args, **kwargs):
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(model)(*args, **kwargs)
+    reasons = [b.reason for b in explanation.break_reasons]
+    assert explanation.graph_break_count == 0, '{}: graph breaks {}'.format(name, reasons)
+    print('%-26s %d graph, %d breaks' % (name, explanation.graph_count, explanation.graph_break_count))
+
+
+def time_inference(fn, x, iters):
+    with torch.no_grad():
+        for _ in range(2):  # warm-up (and compilation)
+            fn(x)
+        start = time.perf_counter()
+        for _ in range(iters):
+            fn(x)
+    return iters * x.size(0) / (time.perf_counter() - start)
+
+
+def time_training(fn, x, iters):
+    """
+    Forward plus backward of the summed outputs, images per second.
+    """
+    def step():
+        out = fn(x)
+        out = out if isinstance(out, tuple) else (out,)
+        sum(o.float().mean() for o in out if o.requires_grad).backward()
+
+    for _ in range(2):  # warm-up (and compilation)
+        step()
+    start = time.perf_counter()
+    for _ in range(iters):
+        step()
+    return iters * x.size(0) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--no-freezing', dest='freezing', action='store_false',
+                        help='do not constant-fold weights into the inference graphs')
+    opt = parser.parse_args()
+    # Only affects no-grad graphs; training graphs keep their parameters
+    torch._inductor.config.freezing = opt.freezing
+
+    torch.manual_seed(0)
+    model = MyModel().to(opt.device).eval()
+    netD = DCGAN_D(64, 100, 1, 64, 1, 0).to(opt.device).eval()
+    x = torch.rand(opt.batch_size, 3, opt.size, opt.size, device=opt.device)
+    masks = torch.rand(opt.batch_size * 5, 1, 64, 64, device=opt.device)
+
+    check_graph_breaks('MyModel eval', model, x)
+    check_graph_breaks('MyModel eval preboud', model, x, outputs=('preboud',))
+    check_graph_breaks('MyModel train', copy.deepcopy(model).train(), x)
+    check_graph_breaks('DCGAN_D', netD, masks)
+    torch._dynamo.reset()
+
+    compiled = copy.deepcopy(model)
+    compiled.compile(fullgraph=True, dynamic=False)
+    compiled_D = copy.deepcopy(netD)
+    compiled_D.compile(fullgraph=True, dynamic=False)
+    with torch.no_grad():
+        diff = max((a - b).abs().max().item() for a, b in zip(model(x), compiled(x)))
+        diff = max(diff, (netD(masks) - compiled_D(masks)).abs().max().item())
+    assert diff < 1e-4, 'compiled outputs differ from eager by {}'.format(diff)
+    print('\nCompiled outputs match eager, max diff %.2e\n' % diff)
+
+    print('%-18s %12s %12s %10s' % ('model', 'eager img/s', 'compiled', 'speedup'))
+    for name, eager, comp, inp in (('MyModel eval', model, compiled, x), ('DCGAN_D eval', netD, compiled_D, masks)):
+        eager_rate = time_inference(eager, inp, opt.iters)
+        compiled_rate = time_inference(comp, inp, opt.iters)
+        print('%-18s %12.2f %12.2f %9.2fx' % (name, eager_rate, compiled_rate, compiled_rate / eager_rate))
+
+    model.train()
+    compiled.train()
+    netD.requires_grad_(False)
+    compiled_D.requires_grad_(False)
+    masks.requires_grad_(True)
+    for name, eager, comp, inp in (('MyModel train', model, compiled, x), ('DCGAN_D input grad', netD, compiled_D, masks)):
+        eager_rate = time_training(eager, inp, opt.iters)
+        compiled_rate = time_training(comp, inp, opt.iters)
+        print('%-18s %12.2f %12.2f %9.2fx' % (name, eager_rate, compiled_rate, compiled_rate / eager_rate))
+
+
+if __name__ == '__main__':
+    main()
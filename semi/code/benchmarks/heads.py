@@ -0,0 +1,63 @@
+"""
+Equivalence check and inference benchmark for head-selective MyModel forwards.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.heads --batch-size 4 --size 256 --iters 5
+"""
+import argparse
+import time
+
+import torch
+
+from semi.code.models.semi_self import MyModel, OUTPUTS
+
+# Output specs timed against the full seven-output graph
+SPECS = (None, ('preboud',), ('mask',), ('mask', 'preboud'))
+
+
+def time_inference(model, x, outputs, iters):
+    """
+    Times eval-mode, no-grad forwards for one output spec.
+
+    Returns:
+        float: Images per second.
+    """
+    with torch.no_grad():
+        for _ in range(2):  # warm-up
+            model(x, outputs=outputs)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x, outputs=outputs)
+        elapsed = time.perf_counter() - start
+    return iters * x.size(0) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = MyModel().to(opt.device).eval()
+    x = torch.rand(opt.batch_size, 3, opt.size, opt.size, device=opt.device)
+
+    with torch.no_grad():
+        full = dict(zip(OUTPUTS, model(x)))
+        for name in OUTPUTS:
+            out, = model(x, outputs=(name,))
+            assert torch.equal(out, full[name]), 'head-selective {} differs from full forward'.format(name)
+    print('Every head matches the full forward\n')
+
+    print('%-22s %12s %10s' % ('outputs', 'img/s', 'speedup'))
+    base = None
+    for spec in SPECS:
+        rate = time_inference(model, x, spec, opt.iters)
+        base = base or rate
+        print('%-22s %12.2f %9.2fx' % ('all' if spec is None else ','.join(spec), rate, rate / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Import-time benchmark of the entry modules, based on ``python -X importtime``.
+
+Every module is imported in fresh interpreters (--runs, the fastest is kept) and its
+cumulative import time is reported together with what it adds over the torch baseline
+(the self time of every module plain ``import torch`` does not load) and the heaviest
+of those imports. For semi.code.infer it also checks that the
+training-only dependencies stay unimported, both after the import and after a
+checkpoint-first load_model() of a random-weight checkpoint, and times that cold start.
+(tqdm is absent from the list on purpose: ``import torch`` itself imports it through
+torch.hub.)
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.importtime --runs 3
+    python -m semi.code.benchmarks.importtime --budget-ms 500   # fail if infer adds more than 500 ms over torch
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+MODULES = ('torch', 'semi.code.infer', 'semi.code.models.build_model', 'semi.code.serve', 'semi.code.stream',
+           'semi.code.train')
+# Must not be imported by the inference entry point
+TRAINING_ONLY = ('torchvision', 'cv2', 'scipy', 'yaml', 'torch._dynamo', 'semi.code.utils.mytransforms',
+                 'semi.code.utils.evaluate')
+
+COLD_START = """
+import sys, time
+start = time.perf_counter()
+import semi.code.infer as infer
+imported = time.perf_counter()
+infer.load_model(sys.argv[1])
+loaded = time.perf_counter()
+print('%f %f' % (imported - start, loaded - imported))
+print(','.join(m for m in sys.argv[2].split(',') if m in sys.modules))
+"""
+
+
+def env():
+    path = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')]))
+    return dict(os.environ, PYTHONPATH=path)
+
+
+def importtime(module):
+    """
+    Returns {imported module: (self us, cumulative us)} for one fresh ``import module``.
+    """
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env=env(),
+                         check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def fastest(module, runs):
+    results = [importtime(module) for _ in range(runs)]
+    return min(results, key=lambda t: t[module][1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help='heaviest imports listed per module')
+    parser.add_argument('--modules', default=','.join(MODULES))
+    parser.add_argument('--budget-ms', type=float, default=0, help='max ms semi.code.infer may add over torch')
+    opt = parser.parse_args()
+
+    baseline = fastest('torch', opt.runs)
+    print('%-30s %10s %12s' % ('module', 'import ms', 'over torch'))
+    added = {}
+    for module in opt.modules.split(','):
+        times = baseline if module == 'torch' else fastest(module, opt.runs)
+        # Self time of the modules plain `import torch` does not load, steadier than total - torch_ms
+        extra = sorted(((own, name) for name, (own, _) in times.items() if name not in baseline), reverse=True)
+        added[module] = sum(own for own, _ in extra) / 1000
+        print('%-30s %10.1f %12.1f' % (module, times[module][1] / 1000, added[module]))
+        if extra:
+            print('    ' + ', '.join('%s %.1f' % (name, own / 1000) for own, name in extra[:opt.top]))
+
+    infer_times = fastest('semi.code.infer', 1)
+    leaked = [m for m in TRAINING_ONLY if m in infer_times]
+    assert not leaked, 'semi.code.infer imports {}'.format(leaked)
+
+    import torch
+    from semi.code.models.semi_self import MyModel
+    with tempfile.TemporaryDirectory() as tmp:
+        ckpt = os.path.join(tmp, 'best.pth')
+        torch.save(MyModel(pretrained=False).state_dict(), ckpt)
+        out = subprocess.run([sys.executable, '-c', COLD_START, ckpt, ','.join(TRAINING_ONLY)], env=env(),
+                             check=True, capture_output=True, text=True).stdout.splitlines()
+    imported, loaded = (float(v) for v in out[0].split())
+    leaked = [m for m in out[1].split(',') if m]
+    assert not leaked, 'load_model imports {}'.format(leaked)
+    print('\nsemi.code.infer cold start: import %.2f s + load_model %.2f s, none of %s imported'
+          % (imported, loaded, ', '.join(TRAINING_ONLY)))
+
+    if opt.budget_ms:
+        over = sum(own for name, (own, _) in infer_times.items() if name not in baseline) / 1000
+        assert over <= opt.budget_ms, 'semi.code.infer adds {:.1f} ms over torch, budget {} ms'.format(over, opt.budget_ms)
+
+
+if __name__ == '__main__':
+    main()
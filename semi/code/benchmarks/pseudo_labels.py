@@ -0,0 +1,138 @@
+"""
+Correctness check and cost report of the offline pseudo-label bank of train_semi.
+
+Checks that a refreshed bank, in shared memory and on disk, holds exactly the binary
+eval-mode masks of the model, that DataLoader workers read them (a disk bank through
+their own memory map), and that the banked pseudo-labels follow their images through
+BatchRandomGeometric. Then times the unlabeled part of a train_semi step
+(unlabeled_loss forward + backward, random shape-prior critic) with per-step
+pseudo-labels and with banked ones, and the refresh sweep that replaces them, whose
+cost is spread over pseudo_label_bank epochs.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.pseudo_labels --pool 16 --batch-size 4 --iters 3
+    python -m semi.code.benchmarks.pseudo_labels --pool 64 --refresh-every 5
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from semi.code.models.dc_gan import DCGAN_D
+from semi.code.models.semi_self import MyModel
+from semi.code.train import unlabeled_loss
+from semi.code.utils.loss import ShapePriorLoss
+from semi.code.utils.mytransforms import BatchRandomGeometric, to_float
+from semi.code.utils.pseudo_labels import PseudoLabelBank, PseudoLabeled
+
+
+class Pool(Dataset):
+    """
+    Random uint8 images at the loader resolution, like the batch_aug unlabeled split.
+    """
+    def __init__(self, n, size):
+        self.images = torch.randint(0, 256, (n, 3, size, size), dtype=torch.uint8,
+                                    generator=torch.Generator().manual_seed(0))
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        return self.images[i]
+
+
+@torch.no_grad()
+def balance(model, pool):
+    """
+    Shifts the seg-head bias to the median logit of the pool: with random weights the
+    model would otherwise predict background everywhere and the bank checks would
+    only compare zeros.
+    """
+    model.eval()
+    logits = torch.logit(model(to_float(pool.images[:4]), outputs=('mask',))[0].double(), eps=1e-12)
+    model.segconv[-1].bias -= logits.median().float()
+
+
+@torch.no_grad()
+def eval_masks(model, pool):
+    model.eval()
+    masks = torch.cat([model(to_float(x), outputs=('mask',))[0] > 0.5
+                       for x in DataLoader(pool, batch_size=8)])
+    return masks.to(torch.uint8) * 255
+
+
+def check_bank(model, pool, expected, path):
+    bank = PseudoLabelBank(len(pool), size=pool.images.shape[-2:], path=path)
+    start = time.perf_counter()
+    bank.refresh(model, pool, epoch=0, batch_size=8)
+    elapsed = time.perf_counter() - start
+    assert torch.equal(torch.stack([bank[i] for i in range(len(pool))]), expected), 'bank differs from the model'
+
+    # Workers: a shared-memory bank is inherited, a file bank is mapped by each worker
+    loader = DataLoader(PseudoLabeled(pool, bank), batch_size=8, num_workers=1)
+    labels = torch.cat([batch['label'] for batch in loader])
+    assert torch.equal(labels, expected), 'workers read stale pseudo-labels'
+    print('%-7s bank: %6.1f KB for %d masks, refresh sweep %.2f s, identical to the eval masks'
+          % ('disk' if path else 'memory', bank.rows().numel() / 1024, len(pool), elapsed))
+    return bank, elapsed
+
+
+def time_unlabeled(model, shape_prior, x, mask, iters):
+    model.train()
+    for _ in range(2):  # warm-up
+        unlabeled_loss(model, shape_prior, x, mask).backward()
+    start = time.perf_counter()
+    for _ in range(iters):
+        model.zero_grad()
+        unlabeled_loss(model, shape_prior, x, mask).backward()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pool', type=int, default=16, help='unlabeled images')
+    parser.add_argument('--size', type=int, default=320, help='loader resolution')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--refresh-every', type=int, default=5, help='pseudo_label_bank epochs')
+    opt = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = MyModel(pretrained=False)
+    pool = Pool(opt.pool, opt.size)
+    balance(model, pool)
+    expected = eval_masks(model, pool)
+    print('Foreground fraction of the pseudo-labels: %.3f' % (expected.float().mean() / 255))
+
+    bank, sweep = check_bank(model, pool, expected, None)
+    with tempfile.TemporaryDirectory() as tmp:
+        check_bank(model, pool, expected, tmp + '/pseudo_labels.npy')
+
+    # Image and pseudo-label share one affine resample per sample
+    batch = next(iter(DataLoader(PseudoLabeled(pool, bank), batch_size=opt.batch_size)))
+    aug = BatchRandomGeometric(rotation_p=1.0, zoom=None, generator=torch.Generator().manual_seed(1))
+    out = aug(batch)
+    aug.generator.manual_seed(1)
+    image_only = aug(batch['image'])
+    assert torch.equal(out['image'], image_only), 'augmentation parameters differ'
+    print('Banked pseudo-labels augmented together with their images: %s -> %s'
+          % (tuple(batch['label'].shape), tuple(out['label'].shape)))
+
+    netD = DCGAN_D(64, 100, 1, 64, 1, 0)
+    shape_prior = ShapePriorLoss(netD)
+    x, mask = out['image'], out['label']
+    per_step = time_unlabeled(model, shape_prior, x, None, opt.iters)
+    banked = time_unlabeled(model, shape_prior, x, mask, opt.iters)
+    steps = opt.pool / opt.batch_size * opt.refresh_every
+    amortised = banked + sweep / steps
+    print('\nUnlabeled forward + backward, batch %d at %dx%d:' % (opt.batch_size, x.size(2), x.size(3)))
+    print('  per-step pseudo-labels  %7.1f ms' % (1000 * per_step))
+    print('  banked pseudo-labels    %7.1f ms  (+%.1f ms refresh per step, every %d epochs of %d images)'
+          % (1000 * banked, 1000 * sweep / steps, opt.refresh_every, opt.pool))
+    print('  speedup                 %7.2fx' % (per_step / amortised))
+
+
+if __name__ == '__main__':
+    main()
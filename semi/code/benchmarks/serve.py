@@ -0,0 +1,125 @@
+"""
+Load generator for the local inference server (semi.code.serve).
+
+Concurrent clients POST the same image until --requests have been answered, then
+the client-side throughput and latency and the server's /stats are reported. Without
+--url, two in-process servers around a random-weight MyModel are started, one serving
+batch size 1 and one with dynamic batching, and compared under the same load.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.serve --concurrency 16 --requests 96 --size 128
+    python -m semi.code.benchmarks.serve --url http://127.0.0.1:8000 --concurrency 32 --requests 512
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from semi.code.models.semi_self import MyModel
+from semi.code.serve import DynamicBatcher, InferenceServer, rle_decode
+
+
+def post(url, data):
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def load(url, image, concurrency, requests):
+    """
+    Sends requests POSTs from concurrency clients, returns (requests/s, latencies in ms).
+    """
+    latencies = []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            post(url + '/predict?format=rle', image)
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return requests / (time.perf_counter() - start), np.asarray(latencies)
+
+
+def check_formats(url, image):
+    """
+    The PNG and RLE answers for one image must describe the same mask.
+    """
+    png = np.asarray(Image.open(io.BytesIO(post(url + '/predict?format=png', image)))) > 0
+    rle = json.loads(post(url + '/predict?format=rle', image))
+    assert np.array_equal(rle_decode(rle['counts'], rle['size']).astype(bool), png), 'PNG and RLE masks differ'
+
+
+def report(name, url, image, opt):
+    load(url, image, opt.concurrency, opt.concurrency)  # warm-up
+    rate, lat = load(url, image, opt.concurrency, opt.requests)
+    stats = get_json(url + '/stats')
+    print('%-16s %8.2f req/s   latency p50 %7.1f / p99 %7.1f ms   mean batch %.2f   batches %s'
+          % (name, rate, np.percentile(lat, 50), np.percentile(lat, 99), stats['mean_batch'], stats['batch_sizes']))
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='', help='running server to load, in-process servers when empty')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=96)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--size', type=int, default=128, help='model input side of the in-process servers')
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    opt = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 255, (opt.height, opt.width, 3), dtype=np.uint8)).save(buf, format='JPEG')
+    image = buf.getvalue()
+
+    if opt.url:
+        check_formats(opt.url, image)
+        report('server', opt.url, image, opt)
+        return
+
+    torch.manual_seed(0)
+    model = MyModel().eval()
+    rates = {}
+    for name, max_batch in (('batch size 1', 1), ('dynamic', opt.max_batch)):
+        batcher = DynamicBatcher(model, max_batch, opt.max_wait_ms / 1000).start()
+        server = InferenceServer(('127.0.0.1', 0), batcher, size=(opt.size, opt.size))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            check_formats(url, image)
+            rates[name] = report(name, url, image, opt)
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.stop()
+    print('\nDynamic batching: %.2fx the throughput of batch-size-1 serving' % (rates['dynamic'] / rates['batch size 1']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Equivalence check and throughput benchmark for the single-pass MyModel forward.
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.single_pass --batch-size 4 --size 256 --iters 5
+"""
+import argparse
+import time
+
+import torch
+
+from semi.code.models.semi_self import MyModel, OUTPUTS
+
+
+def check_equivalence(model, x):
+    """
+    Compares every output of the two-pass and single-pass forwards in eval mode.
+
+    Returns:
+        dict: Maximum absolute difference per output name.
+    """
+    model.eval()
+    with torch.no_grad():
+        model.single_pass = False
+        ref = model(x)
+        model.single_pass = True
+        out = model(x)
+    return {name: (a - b).abs().max().item() for name, a, b in zip(OUTPUTS, ref, out)}
+
+
+def time_forward(model, x, iters, train):
+    """
+    Times forward (eval, no grad) or forward + backward (train) passes.
+
+    Returns:
+        float: Images per second.
+    """
+    model.train(train)
+    for _ in range(2):  # warm-up
+        run_step(model, x, train)
+    start = time.perf_counter()
+    for _ in range(iters):
+        run_step(model, x, train)
+    elapsed = time.perf_counter() - start
+    return iters * x.size(0) / elapsed
+
+
+def run_step(model, x, train):
+    if train:
+        model.zero_grad(set_to_none=True)
+        out = model(x)
+        sum(o.float().mean() for o in out[:6]).backward()
+    else:
+        with torch.no_grad():
+            model(x)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--atol', type=float, default=1e-5)
+    opt = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = MyModel().to(opt.device)
+    x = torch.rand(opt.batch_size, 3, opt.size, opt.size, device=opt.device)
+
+    diffs = check_equivalence(model, x)
+    for name, diff in diffs.items():
+        print('%-12s max|diff| = %.3e' % (name, diff))
+    assert all(d <= opt.atol for d in diffs.values()), 'single-pass forward diverges from two-pass forward'
+    print('Eval-mode outputs match (atol=%g)\n' % opt.atol)
+
+    print('%-8s %-12s %12s' % ('mode', 'forward', 'img/s'))
+    for train in (False, True):
+        rates = {}
+        for single_pass in (False, True):
+            model.single_pass = single_pass
+            rates[single_pass] = time_forward(model, x, opt.iters, train)
+            print('%-8s %-12s %12.2f' % ('train' if train else 'eval',
+                                         'single-pass' if single_pass else 'two-pass', rates[single_pass]))
+        print('%-8s %-12s %11.2fx' % ('', 'speedup', rates[True] / rates[False]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Cold-start time of building MyModel from a checkpoint: legacy vs checkpoint-first build_model.
+
+A random-weight checkpoint is saved like the training code does (nn.DataParallel keys).
+Each measurement runs in a fresh interpreter and reports the import time, the model
+build time and the peak resident memory:
+
+    legacy      MyModel() with ImageNet encoder weights, eager torch.load, key filtering
+                and load_state_dict (the build_model of before, 'module.' prefix stripped)
+    build_model meta-device construction, mmap / weights_only load assigned in place;
+                run with an empty TORCH_HOME to show that no ImageNet weights are needed
+
+Usage (from the repository root):
+    python -m semi.code.benchmarks.startup --runs 3
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child(mode, root):
+    start = time.perf_counter()
+    import torch
+    from types import SimpleNamespace
+    from semi.code.models.build_model import build_model
+    from semi.code.models.semi_self import MyModel
+    imported = time.perf_counter()
+
+    path = os.path.join(root, 'semi/checkpoint/startup/best.pth')
+    if mode == 'legacy':
+        model = MyModel(1, 3)
+        model_dict = model.state_dict()
+        checkpoint = torch.load(path)
+        checkpoint = {k[len('module.'):]: v for k, v in checkpoint.items()}
+        model_dict.update({k: v for k, v in checkpoint.items() if k in model_dict})
+        model.load_state_dict(model_dict)
+    else:
+        args = SimpleNamespace(model='MyModel', nclasses=1, band=3, GPUs='', load_ckpt='best', root=root,
+                               ckpt_name='startup')
+        model = build_model(args)
+    built = time.perf_counter()
+
+    checksum = sum(t.double().sum().item() for t in model.state_dict().values())
+    print(json.dumps({'import': imported - start, 'build': built - imported, 'checksum': checksum,
+                      'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run_child(mode, root, env):
+    out = subprocess.run([sys.executable, '-m', 'semi.code.benchmarks.startup', '--child', mode, '--root', root],
+                         env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--root', default='', help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+    if opt.child:
+        child(opt.child, opt.root)
+        return
+
+    import torch
+    from semi.code.models.semi_self import MyModel
+
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as empty_home:
+        os.makedirs(os.path.join(root, 'semi/checkpoint/startup'))
+        torch.manual_seed(0)
+        state = MyModel(1, 3, pretrained=False).state_dict()
+        torch.save({'module.' + k: v for k, v in state.items()}, os.path.join(root, 'semi/checkpoint/startup/best.pth'))
+        expected = sum(t.double().sum().item() for t in state.values())
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+        offline = dict(env, TORCH_HOME=empty_home)
+        print('%-12s %10s %10s %10s' % ('path', 'import s', 'build s', 'peak RSS'))
+        builds = {}
+        for mode, mode_env in (('legacy', env), ('build_model', offline)):
+            results = [run_child(mode, root, mode_env) for _ in range(opt.runs)]
+            for r in results:
+                assert abs(r['checksum'] - expected) < 1e-6 * max(1.0, abs(expected)), '{}: wrong weights'.format(mode)
+            best = min(results, key=lambda r: r['build'])
+            builds[mode] = best['build']
+            print('%-12s %10.2f %10.2f %7.0f MB' % (mode, best['import'], best['build'], best['rss_mb']))
+        assert not os.listdir(empty_home), 'build_model touched TORCH_HOME'
+    print('\nCheckpoint-first build: %.1fx faster, weights identical, no ImageNet access'
+          % (builds['legacy'] / builds['build_model']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,8 @@
+import torch
+from torch.utils.data import default_collate
+from torchvision import transforms
 from .tn3k import tn3kDataSet
+from ..utils.mytransforms import Resize, ToTensor, ToUint8Tensor, fuse_geometric
 
 def build_dataset(args):
     """
@@ -7,20 +11,57 @@ def build_dataset(args):
     Returns:
     If 'manner' is 'test': Returns a test dataset object.
     Otherwise: Returns a tuple of dataset objects ('train_data', 'train_u_data', 'valid_data').
+    If 'cache_dir' is set, samples are read from decoded uint8 memmaps built there on first use.
+    If 'batch_aug' is set, training samples are only resized and returned as uint8 tensors
+    (with a cache, straight from the memmaps); the geometric augmentation is then applied
+    per batch with BatchRandomGeometric.
+    If 'fuse_transforms' is set, the training geometric chains resample each sample only once.
+    If 'tile_size' is set, test images and masks keep their native resolution (tiled inference).
     """
+    cache_dir = getattr(args, 'cache_dir', None) or None
+    label_transform, unlabel_transform = None, None
+    uint8 = getattr(args, 'batch_aug', False)
+    if uint8:
+        label_transform = transforms.Compose([Resize((320, 320)), ToUint8Tensor()])
+        unlabel_transform = transforms.Compose([transforms.Resize((320, 320)), ToUint8Tensor()])
 
     if args.manner == 'test':
         if args.dataset == 'tn3k':
-            test_data = tn3kDataSet(args.root, args.expID, mode='test')
+            if getattr(args, 'tile_size', 0):
+                # The memmap cache holds resized frames, native-resolution samples bypass it
+                test_data = tn3kDataSet(args.root, args.expID, mode='test', transform=ToTensor())
+            else:
+                test_data = tn3kDataSet(args.root, args.expID, mode='test', cache_dir=cache_dir)
         return test_data
     else:
         if args.dataset == 'tn3k':
-            train_data = tn3kDataSet(args.root, args.expID, mode='train', ratio=args.ratio, sign='label')
-            valid_data = tn3kDataSet(args.root, args.expID, mode='valid')
-            test_data = tn3kDataSet(args.root, args.expID, mode='test')
+            train_data = tn3kDataSet(args.root, args.expID, mode='train', ratio=args.ratio, sign='label', transform=label_transform, cache_dir=cache_dir, uint8=uint8)
+            valid_data = tn3kDataSet(args.root, args.expID, mode='valid', cache_dir=cache_dir)
+            test_data = tn3kDataSet(args.root, args.expID, mode='test', cache_dir=cache_dir)
             train_u_data = None
             if args.manner == 'semi' or args.manner == 'self':
-                train_u_data = tn3kDataSet(args.root, args.expID, mode='train', ratio=args.ratio, sign='unlabel')
+                train_u_data = tn3kDataSet(args.root, args.expID, mode='train', ratio=args.ratio, sign='unlabel', transform=unlabel_transform, cache_dir=cache_dir, uint8=uint8)
+            if getattr(args, 'fuse_transforms', False):
+                train_data.transform = fuse_geometric(train_data.transform)
+                if train_u_data is not None:
+                    train_u_data.transform = fuse_geometric(train_u_data.transform)
         return train_data, train_u_data, valid_data
 
 
+def channels_last_collate(batch):
+    """
+    default_collate that stores every 4D batch (images, masks) in channels_last, so the
+    layout is set once in the loader workers and kept by the pinned copy to the device.
+    """
+    batch = default_collate(batch)
+    if isinstance(batch, dict):
+        return {k: v.contiguous(memory_format=torch.channels_last) if torch.is_tensor(v) and v.dim() == 4 else v
+                for k, v in batch.items()}
+    return batch.contiguous(memory_format=torch.channels_last)
+
+
+def build_collate(args):
+    """
+    Returns the DataLoader collate_fn for the 'channels_last' option (None is the default collate).
+    """
+    return channels_last_collate if getattr(args, 'channels_last', False) else None
@@ -0,0 +1,109 @@
+"""
+Decoded-image cache of the tn3k splits: uint8 memmaps at the 320x320 working resolution.
+
+GAN/data/utils/cache.py holds a copy of this module for the standalone GAN tree, which does not
+import semi; the two differ only in the tn3kDataSet import and are kept in sync.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torchvision.transforms.functional as F
+from PIL import Image
+from tqdm import tqdm
+
+# Working resolution every tn3k pipeline resizes to before augmentation
+CACHE_SIZE = (320, 320)
+
+
+def cache_paths(cache_dir, key):
+    """
+    Returns the index, image and mask file paths of one cached split.
+    """
+    base = os.path.join(cache_dir, key)
+    return base + '.json', base + '_images.npy', base + '_masks.npy'
+
+
+def build_cache(imglist, gtlist, cache_dir, key, size=CACHE_SIZE):
+    """
+    Decodes a split once and stores it as contiguous uint8 memmaps.
+
+    Images are converted to RGB and masks to L, then resized with the same
+    ``Resize`` the transforms use, so cached samples are pixel-identical to
+    freshly decoded ones at the working resolution.
+
+    Args:
+        imglist (list of str): Image paths of the split.
+        gtlist (list of str, optional): Matching mask paths, None for unlabeled splits.
+        cache_dir (str): Directory holding the cache files.
+        key (str): Split name, used as file prefix.
+        size (tuple): (H, W) working resolution.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path, images_path, masks_path = cache_paths(cache_dir, key)
+    h, w = size
+
+    # Write under temporary names so an interrupted build is never picked up
+    images = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                       shape=(len(imglist), h, w, 3))
+    masks = None
+    if gtlist is not None:
+        masks = np.lib.format.open_memmap(masks_path + '.tmp', mode='w+', dtype=np.uint8,
+                                          shape=(len(imglist), h, w))
+
+    for i in tqdm(range(len(imglist)), desc='caching ' + key):
+        images[i] = np.asarray(F.resize(Image.open(imglist[i]).convert('RGB'), size))
+        if masks is not None:
+            masks[i] = np.asarray(F.resize(Image.open(gtlist[i]).convert('L'), size))
+
+    images.flush()
+    del images
+    os.replace(images_path + '.tmp', images_path)
+    if masks is not None:
+        masks.flush()
+        del masks
+        os.replace(masks_path + '.tmp', masks_path)
+
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'imglist': imglist, 'size': list(size), 'masks': gtlist is not None}, f)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def load_cache(cache_dir, key, imglist, size=CACHE_SIZE):
+    """
+    Opens a cached split as memmaps.
+
+    Returns:
+        tuple: (images, masks) memmaps, masks is None for unlabeled splits.
+        None if the split is not cached or the cache was built from a different image list.
+    """
+    index_path, images_path, masks_path = cache_paths(cache_dir, key)
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    if index['imglist'] != imglist or tuple(index['size']) != tuple(size):
+        return None
+
+    # Copy-on-write: rows can be wrapped by torch.from_numpy without a copy, and the
+    # files are never modified through them
+    images = np.load(images_path, mmap_mode='c')
+    masks = np.load(masks_path, mmap_mode='c') if index['masks'] else None
+    return images, masks
+
+
+if __name__ == '__main__':
+    from .tn3k import tn3kDataSet
+
+    parser = argparse.ArgumentParser(description='Decode the tn3k splits once into uint8 memmaps.')
+    parser.add_argument('--root', default='')
+    parser.add_argument('--expID', type=int, default=3)
+    parser.add_argument('--cache_dir', default='data/cache/tn3k')
+    opt = parser.parse_args()
+
+    # Constructing a dataset with cache_dir builds any missing split
+    tn3kDataSet(opt.root, opt.expID, mode='train', sign='label', cache_dir=opt.cache_dir)
+    tn3kDataSet(opt.root, opt.expID, mode='train', sign='unlabel', cache_dir=opt.cache_dir)
+    tn3kDataSet(opt.root, opt.expID, mode='valid', cache_dir=opt.cache_dir)
+    tn3kDataSet(opt.root, opt.expID, mode='test', cache_dir=opt.cache_dir)
@@ -1,15 +1,18 @@
+import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
 import os
 from ..utils.mytransforms import *
+from .cache import build_cache, load_cache
 import json
 
 
 class tn3kDataSet(Dataset):
-    def __init__(self, root, expID, mode='train', ratio=10, sign='label', transform=None):
+    def __init__(self, root, expID, mode='train', ratio=10, sign='label', transform=None, cache_dir=None, uint8=False):
         super(tn3kDataSet, self).__init__()
         self.mode = mode
         self.sign = sign
+        self.uint8 = uint8
 
         # Loading image file paths based on mode and experiment ID
         if mode == 'train':
@@ -71,20 +74,31 @@ class tn3kDataSet(Dataset):
                 ])
         self.transform = transform
 
+        # Optional decoded-image cache: images and masks are read from memmaps
+        self.cache = None
+        if cache_dir:
+            key = self.cache_key(expID)
+            self.cache = load_cache(cache_dir, key, self.imglist)
+            if self.cache is None:
+                gtlist = None if (mode == 'train' and sign == 'unlabel') else [self.gt_path(p) for p in self.imglist]
+                build_cache(self.imglist, gtlist, cache_dir, key)
+                self.cache = load_cache(cache_dir, key, self.imglist)
+
     def __getitem__(self, index):
+        # Resized uint8 samples are the cached rows themselves, no PIL round trip
+        if self.uint8 and self.cache is not None and self.mode == 'train':
+            return self.cached_uint8(index)
+
         # Handling unlabeled training images
         if self.mode == 'train' and self.sign == 'unlabel':
-            img_path = self.imglist[index]
-            img = Image.open(img_path).convert('RGB')
+            img = self.load_image(index)
             if self.transform:
                 return self.transform(img)
 
         # Handling test images with ground truth masks
         elif self.mode == 'test' :
-            img_path = self.imglist[index]
-            gt_path = img_path.replace('test-image', 'test-mask')
-            img = Image.open(img_path).convert('RGB')
-            gt = Image.open(gt_path).convert('L')
+            img = self.load_image(index)
+            gt = self.load_label(index)
             data = {'image': img, 'label': gt}
     
             if self.transform:
@@ -96,10 +110,8 @@ class tn3kDataSet(Dataset):
         
         # Handling labeled training and validation images with ground truth masks
         else:
-            img_path = self.imglist[index]
-            gt_path = img_path.replace('trainval-image', 'trainval-mask')
-            img = Image.open(img_path).convert('RGB')
-            gt = Image.open(gt_path).convert('L')
+            img = self.load_image(index)
+            gt = self.load_label(index)
             data = {'image': img, 'label': gt}
             if self.transform:
                 data = self.transform(data)
@@ -108,6 +120,49 @@ class tn3kDataSet(Dataset):
  
             return data
 
+    def cache_key(self, expID):
+        """
+        Name of this split inside the decoded-image cache.
+        """
+        if self.mode == 'train':
+            return 'train_{}_{}'.format(self.sign, expID)
+        return self.mode
+
+    def gt_path(self, img_path):
+        """
+        Returns the ground-truth mask path of an image path.
+        """
+        if self.mode == 'test':
+            return img_path.replace('test-image', 'test-mask')
+        return img_path.replace('trainval-image', 'trainval-mask')
+
+    def cached_uint8(self, index):
+        """
+        Returns the resized uint8 sample as views of the memmap cache (the batch_aug
+        format) instead of rebuilding PIL images to resize them to the size they have.
+        """
+        img = torch.from_numpy(self.cache[0][index]).permute(2, 0, 1)
+        if self.sign == 'unlabel':
+            return img
+        gt = torch.from_numpy(self.cache[1][index])[None]
+        return {'image': img, 'label': gt, 'name': self.imglist[index].split('/')[-1]}
+
+    def load_image(self, index):
+        """
+        Returns the RGB image at index, from the memmap cache when enabled.
+        """
+        if self.cache is not None:
+            return Image.fromarray(self.cache[0][index], 'RGB')
+        return Image.open(self.imglist[index]).convert('RGB')
+
+    def load_label(self, index):
+        """
+        Returns the L-mode mask at index, from the memmap cache when enabled.
+        """
+        if self.cache is not None:
+            return Image.fromarray(self.cache[1][index], 'L')
+        return Image.open(self.gt_path(self.imglist[index])).convert('L')
+
     def __len__(self):
         #  Return the total number of images
         return len(self.imglist)
@@ -0,0 +1,179 @@
+"""
+Lightweight inference entry point: checkpoint in, masks out.
+
+Only torch, numpy and PIL are imported with this module; the model code is imported
+on the first load_model() and, built checkpoint-first, never touches torchvision. The
+training-only dependencies (torchvision, cv2, scipy, tqdm, yaml, the perturbation
+decoders of aug_function) stay unimported, which benchmarks/importtime.py checks.
+
+Usage (from the repository root):
+    python -m semi.code.infer --ckpt semi/checkpoint/tn3k_1/best.pth --out result/ image.jpg frames/
+"""
+import argparse
+import functools
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from semi.code.models.build_model import model_from_checkpoint, read_checkpoint
+from semi.code.utils.amp import autocast
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+def preprocess(img, size=(320, 320)):
+    """
+    Test-time preprocessing without torchvision: the values of ToTensor()(Resize(size)(img)).
+
+    Args:
+        img (PIL.Image.Image): Input image, converted to RGB.
+        size (tuple): (H, W) model input size.
+
+    Returns:
+        torch.Tensor: (3, H, W) float32 tensor in [0, 1].
+    """
+    img = img.convert('RGB').resize((size[1], size[0]), Image.BILINEAR)
+    return torch.from_numpy(np.array(img)).permute(2, 0, 1).contiguous().float().div(255)
+
+
+def load_model(ckpt, nclasses=1, band=3, device='cpu'):
+    """
+    Builds MyModel checkpoint-first (see build_model.model_from_checkpoint) in eval mode.
+    """
+    from semi.code.models.semi_self import MyModel
+
+    model = model_from_checkpoint(functools.partial(MyModel, nclasses, band), read_checkpoint(ckpt))
+    if model is None:
+        raise ValueError("Checkpoint '{}' does not hold every MyModel weight".format(ckpt))
+    return model.to(device).eval()
+
+
+def model_from_config(config, device='cpu'):
+    """
+    Builds the model of a config_model.yaml with build_model, for the serving entry points.
+
+    Returns:
+        tuple: (model in eval mode on ``device``, the config as a SimpleNamespace)
+    """
+    from types import SimpleNamespace
+
+    import yaml
+
+    from semi.code.models.build_model import build_model
+
+    with open(config, 'r') as f:
+        args = SimpleNamespace(**yaml.safe_load(f))
+    if torch.device(device).type == 'cpu':
+        args.GPUs = ""  # build_model moves the model to CUDA when GPUs are listed
+    return build_model(args).to(device).eval(), args
+
+
+def input_memory_format(args):
+    """
+    Layout of the input batches for the 'channels_last' config option.
+    """
+    return torch.channels_last if getattr(args, 'channels_last', False) else torch.contiguous_format
+
+
+@torch.no_grad()
+def predict_batch(model, images, sizes, output='preboud', threshold=0.5, amp='off',
+                  memory_format=torch.contiguous_format):
+    """
+    Segments one batch of preprocessed images and brings each mask back to its image's size.
+
+    Args:
+        model (torch.nn.Module): Segmentation model accepting ``outputs=(output,)``.
+        images (sequence of torch.Tensor): (3, h, w) model inputs, see preprocess.
+        sizes (sequence of tuple): Original (H, W) of each image.
+        output (str): Head to predict, a name from semi_self.OUTPUTS.
+        threshold (float): Mask binarisation threshold.
+        amp (str): Mixed precision mode, see utils.amp.
+        memory_format (torch.memory_format): Layout of the input batch.
+
+    Returns:
+        list of torch.Tensor: (1, H, W) uint8 {0, 1} mask of each image, on the host.
+    """
+    device = next(model.parameters()).device
+    x = torch.stack(list(images)).to(device, non_blocking=True).contiguous(memory_format=memory_format)
+    with autocast(amp, device.type):
+        out = model(x, outputs=(output,))[0]
+    out = out.float()
+
+    sizes = [tuple(hw) for hw in sizes]
+    if len(set(sizes)) == 1:
+        # Frames of one stream share their size: one resize for the whole batch
+        masks = F.interpolate(out, size=sizes[0], mode='bilinear', align_corners=False)
+        return list((masks > threshold).to(torch.uint8).cpu())
+    return [(F.interpolate(o[None], size=hw, mode='bilinear', align_corners=False)[0] > threshold)
+            .to(torch.uint8).cpu() for o, hw in zip(out, sizes)]
+
+
+@torch.no_grad()
+def predict(model, images, size=(320, 320), output='preboud', threshold=0.5, batch_size=8):
+    """
+    Segments PIL images in batches.
+
+    Args:
+        model (torch.nn.Module): Segmentation model accepting ``outputs=(output,)``.
+        images (iterable of PIL.Image.Image): Images of any size.
+        size (tuple): (H, W) model input size.
+        output (str): Head to predict, a name from semi_self.OUTPUTS.
+        threshold (float): Mask binarisation threshold.
+        batch_size (int): Images per forward.
+
+    Yields:
+        numpy.ndarray: (H, W) uint8 {0, 1} mask of each image at its own resolution.
+    """
+    batch, sizes = [], []
+    for img in images:
+        batch.append(preprocess(img, size))
+        sizes.append((img.height, img.width))
+        if len(batch) == batch_size:
+            yield from (mask[0].numpy() for mask in predict_batch(model, batch, sizes, output, threshold))
+            batch, sizes = [], []
+    if batch:
+        yield from (mask[0].numpy() for mask in predict_batch(model, batch, sizes, output, threshold))
+
+
+def image_paths(inputs):
+    """
+    Expands files and directories (sorted, image extensions only) into image paths.
+    """
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='image files or directories')
+    parser.add_argument('--ckpt', required=True)
+    parser.add_argument('--out', default='./result', help='directory for the PNG masks')
+    parser.add_argument('--size', type=int, default=320)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--output', default='preboud', help='model head to segment with')
+    parser.add_argument('--nclasses', type=int, default=1)
+    parser.add_argument('--band', type=int, default=3)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+
+    model = load_model(opt.ckpt, opt.nclasses, opt.band, opt.device)
+    paths = list(image_paths(opt.inputs))
+    os.makedirs(opt.out, exist_ok=True)
+    masks = predict(model, (Image.open(p) for p in paths), (opt.size, opt.size), opt.output,
+                    batch_size=opt.batch_size)
+    for path, mask in zip(paths, masks):
+        name = os.path.splitext(os.path.basename(path))[0] + '.png'
+        Image.fromarray(mask * 255, 'L').save(os.path.join(opt.out, name))
+    print('Wrote {} masks to {}'.format(len(paths), opt.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,6 @@
-from . semi_self import MyModel
\ No newline at end of file
+def __getattr__(name):
+    # Resolved on first use, so importing a submodule (e.g. build_model) does not build the model graph
+    if name == 'MyModel':
+        from .semi_self import MyModel
+        return MyModel
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
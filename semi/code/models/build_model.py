@@ -1,28 +1,86 @@
-import torch
-import semi.code.models 
+import functools
 import os
 
+import torch
+
+
+def read_checkpoint(path):
+    """
+    Memory-maps a checkpoint's state dict (weights_only, no unpickling of code).
+
+    Tensors are paged in from the file when first used instead of being read up front;
+    the 'module.' prefix of checkpoints saved from nn.DataParallel / DDP is stripped.
+    A resumable last.pth yields its model weights.
+    """
+    state = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    if isinstance(state.get('model'), dict):
+        # Resumable last.pth of CheckpointManager
+        state = state['model']
+    return {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state.items()}
+
+
+def model_from_checkpoint(model_fn, state):
+    """
+    Checkpoint-first construction: builds the model on the meta device (no weight
+    allocation or initialisation, no ImageNet weights) and assigns the checkpoint
+    tensors directly as its parameters and buffers.
+
+    Args:
+        model_fn (callable): Model constructor accepting ``pretrained``.
+        state (dict): State dict, e.g. from read_checkpoint.
+
+    Returns:
+        torch.nn.Module or None: None when the checkpoint does not cover every
+        parameter and buffer of the model.
+    """
+    with torch.device('meta'):
+        model = model_fn(pretrained=False)
+    keys = model.state_dict().keys()
+    if not all(k in state for k in keys):
+        return None
+    model.load_state_dict({k: state[k] for k in keys}, assign=True)
+    return model
+
+
 def build_model(args):
     """
     Function to build and initialize a model based on given arguments.
+
+    With a checkpoint (args.load_ckpt) the model is built checkpoint-first, see
+    model_from_checkpoint; a checkpoint missing some weights is loaded into a regular
+    ImageNet-initialised model instead.
     Returns:
         torch.nn.Module: The initialized model.
     """
-    model = getattr(models, args.model)(args.nclasses, args.band)
-    if args.GPUs:
-        model.cuda()
-        torch.backends.cudnn.benchmark = True
+    import semi.code.models as models
+    model_fn = functools.partial(getattr(models, args.model), args.nclasses, args.band,
+                                 single_pass=getattr(args, 'single_pass', False),
+                                 checkpointing=getattr(args, 'checkpointing', 'none'))
     if args.load_ckpt is not None:
-
-        model_dict = model.state_dict()
         load_ckpt_path = os.path.join(args.root, "semi/checkpoint/" + str(args.ckpt_name), args.load_ckpt + '.pth')
         print(load_ckpt_path)
         assert os.path.isfile(load_ckpt_path), 'No checkpoint found.'
         print('Loading checkpoint......')
-        checkpoint = torch.load(load_ckpt_path)
-        new_dict = {k: v for k, v in checkpoint.items() if k in model_dict.keys()}
-        model_dict.update(new_dict)
-        model.load_state_dict(model_dict)
+        checkpoint = read_checkpoint(load_ckpt_path)
+        model = model_from_checkpoint(model_fn, checkpoint)
+        if model is None:
+            # Partial checkpoint: the weights it lacks keep their ImageNet / random init
+            model = model_fn()
+            model_dict = model.state_dict()
+            model_dict.update({k: v for k, v in checkpoint.items() if k in model_dict})
+            model.load_state_dict(model_dict)
         print('Done')
+    else:
+        model = model_fn()
+
+    if getattr(args, 'channels_last', False):
+        model = model.to(memory_format=torch.channels_last)
+    if args.GPUs:
+        model.cuda()
+        torch.backends.cudnn.benchmark = True
+
+    if getattr(args, 'compile', False):
+        # In place, so state_dict keys and checkpoints are unchanged
+        model.compile(fullgraph=True, dynamic=False)
 
     return model
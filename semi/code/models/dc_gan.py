@@ -57,7 +57,7 @@ class DCGAN_D(nn.Module):
         Returns:
             torch.Tensor: Scalar output representing the probability of input being real.
         """
-        if isinstance(input.data, torch.cuda.FloatTensor) and self.ngpu > 1:
+        if input.is_cuda and self.ngpu > 1:
             output = nn.parallel.data_parallel(self.main, input, range(self.ngpu))
         else: 
             output = self.main(input)
@@ -0,0 +1,194 @@
+"""
+Inference export for MyModel: BatchNorm folding, dropout stripping and a frozen
+TorchScript or torch.export artifact, verified against the eager model.
+
+Usage (from the repository root):
+    python -m semi.code.models.export --ckpt semi/checkpoint/tn3k_1/best.pth --out model_infer.pt
+"""
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from semi.code.models.build_model import read_checkpoint
+from semi.code.models.semi_self import MyModel, ConvBlock, Encoder
+from semi.code.utils.aug_function import DropOutDecoder
+
+
+class InferenceHead(nn.Module):
+    """
+    Fixes the requested outputs of MyModel so the graph can be traced or exported.
+    """
+    def __init__(self, model, outputs=('preboud',)):
+        super(InferenceHead, self).__init__()
+        self.model = model
+        self.outputs = tuple(outputs)
+
+    def forward(self, x):
+        out = self.model(x, outputs=self.outputs)
+        return out[0] if len(out) == 1 else out
+
+
+def fold_bn(model):
+    """
+    Returns an eval-mode copy of the model with every BatchNorm2d folded into the
+    preceding Conv2d / ConvTranspose2d and every dropout replaced by nn.Identity.
+
+    Covers ConvBlock, the Encoder stem, the ResNet BasicBlocks and their downsample
+    branch, and the ConvTranspose2d + BatchNorm2d upsample of transpose DecoderBlocks.
+    """
+    model = copy.deepcopy(model).eval()
+    for module in list(model.modules()):
+        if isinstance(module, ConvBlock):
+            module.conv = fuse_conv_bn_eval(module.conv, module.bn)
+            module.bn = nn.Identity()
+        elif isinstance(module, Encoder):
+            module.encoder1_conv = fuse_conv_bn_eval(module.encoder1_conv, module.encoder1_bn)
+            module.encoder1_bn = nn.Identity()
+        elif hasattr(module, 'conv1') and isinstance(getattr(module, 'bn1', None), nn.BatchNorm2d):
+            # torchvision BasicBlock
+            module.conv1 = fuse_conv_bn_eval(module.conv1, module.bn1)
+            module.bn1 = nn.Identity()
+            module.conv2 = fuse_conv_bn_eval(module.conv2, module.bn2)
+            module.bn2 = nn.Identity()
+        elif isinstance(module, nn.Sequential):
+            fold_sequential(module)
+    strip_dropout(model)
+    return model
+
+
+def fold_sequential(seq):
+    """
+    Folds every (Conv2d | ConvTranspose2d, BatchNorm2d) pair of an nn.Sequential in place.
+    """
+    names = list(seq._modules.keys())
+    for conv_name, bn_name in zip(names, names[1:]):
+        conv, bn = seq._modules[conv_name], seq._modules[bn_name]
+        if isinstance(bn, nn.BatchNorm2d) and isinstance(conv, (nn.Conv2d, nn.ConvTranspose2d)):
+            seq._modules[conv_name] = fuse_conv_bn_eval(conv, bn, transpose=isinstance(conv, nn.ConvTranspose2d))
+            seq._modules[bn_name] = nn.Identity()
+
+
+def strip_dropout(model):
+    """
+    Replaces Dropout / Dropout2d / DropOutDecoder (no-ops at inference) with nn.Identity.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, (nn.Dropout, nn.Dropout2d, DropOutDecoder)):
+                setattr(module, name, nn.Identity())
+
+
+def export_model(model, example, outputs=('preboud',), method='torchscript'):
+    """
+    Folds the model and builds a frozen inference artifact for the requested outputs.
+
+    Args:
+        model (MyModel): Eager model (weights loaded).
+        example (torch.Tensor): Example input batch, fixes the traced shape.
+        outputs (sequence of str): Heads to export, see semi_self.OUTPUTS.
+        method (str): 'torchscript' (trace + freeze) or 'export' (torch.export).
+
+    Returns:
+        torch.jit.ScriptModule or torch.export.ExportedProgram
+    """
+    head = InferenceHead(fold_bn(model), outputs).eval()
+    with torch.no_grad():
+        if method == 'torchscript':
+            return torch.jit.freeze(torch.jit.trace(head, example))
+        elif method == 'export':
+            return torch.export.export(head, (example,))
+    raise ValueError("Unknown export method '{}', expected 'torchscript' or 'export'".format(method))
+
+
+def save_artifact(artifact, path):
+    if isinstance(artifact, torch.export.ExportedProgram):
+        torch.export.save(artifact, path)
+    else:
+        torch.jit.save(artifact, path)
+
+
+def runnable(artifact):
+    """
+    Callable module of an artifact. ExportedProgram.module() unlifts a new GraphModule
+    on every call, so it is done once here and the result is reused for every batch.
+    """
+    if isinstance(artifact, torch.export.ExportedProgram):
+        return artifact.module()
+    return artifact
+
+
+def verify(model, artifact, x, outputs=('preboud',)):
+    """
+    Compares the artifact (or its runnable module) with the eager model in eval mode.
+
+    Returns:
+        float: Maximum absolute difference over all exported outputs.
+    """
+    model.eval()
+    with torch.no_grad():
+        ref = model(x, outputs=tuple(outputs))
+        out = runnable(artifact)(x)
+    out = out if isinstance(out, (tuple, list)) else (out,)
+    return max((a - b).abs().max().item() for a, b in zip(ref, out))
+
+
+def latency(fn, x, iters=10):
+    """
+    Mean latency of fn(x) in milliseconds, after two warm-up calls.
+    """
+    with torch.no_grad():
+        for _ in range(2):
+            fn(x)
+        start = time.perf_counter()
+        for _ in range(iters):
+            fn(x)
+    return (time.perf_counter() - start) / iters * 1000
+
+
+def load_checkpoint(model, path):
+    """
+    Loads model weights, accepting checkpoints saved from nn.DataParallel.
+    """
+    model.load_state_dict(read_checkpoint(path))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ckpt', default='', help='MyModel checkpoint (random weights if empty)')
+    parser.add_argument('--out', default='model_infer.pt')
+    parser.add_argument('--method', default='torchscript', choices=['torchscript', 'export'])
+    parser.add_argument('--outputs', default='preboud', help='comma-separated heads to export')
+    parser.add_argument('--size', type=int, default=320)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--nclasses', type=int, default=1)
+    parser.add_argument('--band', type=int, default=3)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    opt = parser.parse_args()
+
+    outputs = tuple(opt.outputs.split(','))
+    # The checkpoint overwrites every weight: no ImageNet download for it
+    model = MyModel(opt.nclasses, opt.band, pretrained=not opt.ckpt).eval()
+    if opt.ckpt:
+        load_checkpoint(model, opt.ckpt)
+    x = torch.rand(opt.batch_size, opt.band, opt.size, opt.size)
+
+    artifact = export_model(model, x, outputs, opt.method)
+    module = runnable(artifact)
+    diff = verify(model, module, x, outputs)
+    print('max|eager - exported| = %.3e' % diff)
+    assert diff <= opt.atol, 'exported model diverges from the eager model'
+    save_artifact(artifact, opt.out)
+    print('Saved %s artifact to %s' % (opt.method, opt.out))
+
+    eager_ms = latency(lambda t: model(t, outputs=outputs), x)
+    export_ms = latency(module, x)
+    print('latency eager: %.1f ms, exported: %.1f ms (%.2fx)' % (eager_ms, export_ms, eager_ms / export_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Int8 post-training static quantization of MyModel for CPU inference (PT2E, x86 / oneDNN).
+
+The inference head (encoder and the decoder path of the requested outputs, BatchNorm
+folded) is captured with torch.export, annotated with the X86InductorQuantizer
+(per-channel int8 weights, per-tensor activations), calibrated on a random sample of
+tn3kDataSet('valid') and converted. The quantized program is saved as a torch.export
+artifact; load_quantized() reloads it and lowers it to int8 kernels with inductor.
+
+An accuracy / latency table compares fp32 eager, fp32 compiled and int8 compiled on
+an evaluation split (default 'test', disjoint from the calibration images): dice,
+IoU_mean and IoU_poly from evaluate_batch, the dice of the int8 masks against the fp32
+masks (drift), and the per-frame latency.
+
+Usage (from the repository root):
+    python -m semi.code.models.quantize --config config_model.yaml --ckpt semi/checkpoint/tn3k_1/best.pth \
+        --calib 64 --out model_int8.pt2
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import torch._inductor.config
+import yaml
+from torch.ao.quantization.quantize_pt2e import prepare_pt2e, convert_pt2e
+from torch.ao.quantization.quantizer.x86_inductor_quantizer import (X86InductorQuantizer,
+                                                                    get_default_x86_inductor_quantization_config)
+from torch.utils.data import DataLoader, Subset
+
+from semi.code.data.tn3k import tn3kDataSet
+from semi.code.models.export import InferenceHead, fold_bn, latency, load_checkpoint
+from semi.code.models.semi_self import MyModel
+from semi.code.utils.evaluate import evaluate_batch
+
+
+def quantize_model(model, example, calibration, outputs=('preboud',), keep_fp32=()):
+    """
+    Quantizes the inference head of MyModel to int8 with PT2E static quantization.
+
+    Args:
+        model (MyModel): Eager model (weights loaded).
+        example (torch.Tensor): Example input batch, fixes the captured shape.
+        calibration (iterable of torch.Tensor): Input batches of the same shape, observed
+            to set the activation ranges.
+        outputs (sequence of str): Heads to quantize, see semi_self.OUTPUTS.
+        keep_fp32 (sequence of str): Submodule names of MyModel left in fp32
+            (e.g. 'inpDecoder1' for accuracy-sensitive output layers).
+
+    Returns:
+        torch.fx.GraphModule: The converted (quantize / dequantize annotated) model.
+    """
+    head = InferenceHead(fold_bn(model), outputs).eval()
+    captured = torch.export.export_for_training(head, (example,)).module()
+
+    quantizer = X86InductorQuantizer().set_global(get_default_x86_inductor_quantization_config())
+    for name in keep_fp32:
+        quantizer.set_module_name_qconfig('model.' + name, None)
+    prepared = prepare_pt2e(captured, quantizer)
+    with torch.no_grad():
+        for x in calibration:
+            prepared(x)
+    return convert_pt2e(prepared)
+
+
+def save_quantized(quantized, example, path):
+    """
+    Saves the converted model as a torch.export artifact (.pt2).
+    """
+    torch.export.save(torch.export.export(quantized, (example,)), path)
+
+
+def load_quantized(path, compile=True):
+    """
+    Loads an artifact saved by save_quantized.
+
+    With compile, the program is lowered by inductor with weight freezing (set globally,
+    it only affects no-grad graphs), which is what turns the quantize / dequantize
+    pairs into int8 oneDNN kernels; without it the ops run as fp32 reference code.
+    """
+    model = torch.export.load(path).module()
+    if compile:
+        torch._inductor.config.freezing = True
+        model = torch.compile(model)
+    return model
+
+
+def predict(fn, loader):
+    """
+    Runs fn over the loader, returns (binary masks of the first output, ground truths)
+    as lists of tensors.
+    """
+    masks, gts = [], []
+    with torch.no_grad():
+        for data in loader:
+            out = fn(data['image'])
+            out = out[0] if isinstance(out, (tuple, list)) else out
+            masks.append((out > 0.5).float())
+            gts.append(data['label'])
+    return masks, gts
+
+
+def accuracy(masks, targets):
+    """
+    Per-image mean of the evaluate_batch dice, IoU_mean and IoU_poly.
+    """
+    scores = []
+    for mask, target in zip(masks, targets):
+        for m, t in zip(mask, target):
+            metrics = evaluate_batch(m, t)
+            scores.append([metrics[9].item(), metrics[8].item(), metrics[6].item()])
+    return np.mean(scores, 0) if scores else np.zeros(3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config_model.yaml', help='dataset root / expID / nclasses / band')
+    parser.add_argument('--ckpt', default='', help='MyModel checkpoint (random weights if empty)')
+    parser.add_argument('--out', default='model_int8.pt2')
+    parser.add_argument('--outputs', default='preboud', help='comma-separated heads to quantize')
+    parser.add_argument('--calib', type=int, default=64, help='calibration images sampled from the valid split')
+    parser.add_argument('--eval-split', default='test', choices=['valid', 'test'])
+    parser.add_argument('--eval', type=int, default=0, help='evaluation images (0 = whole split)')
+    parser.add_argument('--keep-fp32', default='', help='comma-separated MyModel submodules left in fp32')
+    parser.add_argument('--size', type=int, default=320)
+    parser.add_argument('--iters', type=int, default=10, help='latency iterations')
+    parser.add_argument('--seed', type=int, default=0)
+    opt = parser.parse_args()
+
+    with open(opt.config, 'r') as f:
+        args = SimpleNamespace(**yaml.safe_load(f))
+    torch.manual_seed(opt.seed)
+    outputs = tuple(opt.outputs.split(','))
+    # The checkpoint overwrites every weight: no ImageNet download for it
+    model = MyModel(args.nclasses, args.band, pretrained=not opt.ckpt).eval()
+    if opt.ckpt:
+        load_checkpoint(model, opt.ckpt)
+
+    # Frame-by-frame: the captured graphs are specialised to batch size 1
+    valid = tn3kDataSet(args.root, args.expID, mode='valid')
+    calib = torch.randperm(len(valid))[:opt.calib].tolist()
+    calib_loader = DataLoader(Subset(valid, calib), batch_size=1, num_workers=args.num_workers)
+    example = torch.rand(1, args.band, opt.size, opt.size)
+
+    start = time.perf_counter()
+    quantized = quantize_model(model, example, (data['image'] for data in calib_loader), outputs,
+                               [name for name in opt.keep_fp32.split(',') if name])
+    save_quantized(quantized, example, opt.out)
+    print('Calibrated on %d valid images and saved the int8 artifact to %s (%.1f s)'
+          % (len(calib), opt.out, time.perf_counter() - start))
+
+    split = tn3kDataSet(args.root, args.expID, mode=opt.eval_split)
+    if opt.eval:
+        split = Subset(split, range(min(opt.eval, len(split))))
+    eval_loader = DataLoader(split, batch_size=1, num_workers=args.num_workers)
+
+    torch._inductor.config.freezing = True
+    head = InferenceHead(model, outputs).eval()
+    variants = (('fp32 eager', head), ('fp32 compiled', torch.compile(head)), ('int8 compiled', load_quantized(opt.out)))
+
+    rows, reference = [], None
+    for name, fn in variants:
+        masks, gts = predict(fn, eval_loader)
+        reference = masks if reference is None else reference
+        drift = accuracy(masks, reference)[0]
+        rows.append((name,) + tuple(accuracy(masks, gts)) + (drift, latency(fn, example, opt.iters)))
+
+    print('\n%d %s images, batch size 1, %dx%d\n' % (len(split), opt.eval_split, opt.size, opt.size))
+    print('%-14s %8s %9s %9s %12s %12s %8s' % ('model', 'dice', 'IoU_mean', 'IoU_poly', 'dice vs fp32', 'latency ms', 'speedup'))
+    for name, dice, iou_mean, iou_poly, drift, ms in rows:
+        print('%-14s %8.4f %9.4f %9.4f %12.4f %12.1f %7.2fx' % (name, dice, iou_mean, iou_poly, drift, ms, rows[0][-1] / ms))
+
+
+if __name__ == '__main__':
+    main()
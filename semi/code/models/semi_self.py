@@ -1,35 +1,101 @@
+import contextlib
+
 import torch
 import torch.nn as nn
-import torchvision.models as models
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
-from semi.code.utils.aug_function import FeatureNoiseDecoder, DropOutDecoder
+from semi.code.models.resnet import ResNet34Trunk
+from semi.code.utils.aug_function import DropOutDecoder
 
 
-def cat(x1, x2, x3=None, dim=1):
-    if x3 == None:
-        diffY = torch.tensor([x2.size()[2] - x1.size()[2]])
-        diffX = torch.tensor([x2.size()[3] - x1.size()[3]])
+def pad_to(x, ref):
+    """
+    Center-pads (or crops) x spatially to the size of ref with plain integer amounts;
+    returns x itself when the sizes already match, which keeps its memory format.
+    """
+    diffY = ref.size(2) - x.size(2)
+    diffX = ref.size(3) - x.size(3)
+    if diffY == 0 and diffX == 0:
+        return x
+    return F.pad(x, [diffX // 2, diffX - diffX // 2,
+                     diffY // 2, diffY - diffY // 2])
 
-        x1 = F.pad(x1, [diffX // 2, diffX - diffX // 2,
-                        diffY // 2, diffY - diffY // 2])
 
-        x = torch.cat([x1, x2], dim)
-        return x
-    else:
-        diffY = torch.tensor([x2.size()[2] - x1.size()[2]])
-        diffX = torch.tensor([x2.size()[3] - x1.size()[3]])
-
-        x1 = F.pad(x1, [diffX // 2, diffX - diffX // 2,
-                        diffY // 2, diffY - diffY // 2])
-
-        x = torch.cat([x1, x2], dim)
-        diffY = torch.tensor([x.size()[2] - x3.size()[2]])
-        diffX = torch.tensor([x.size()[3] - x3.size()[3]])
-        x3 = F.pad(x3, [diffX // 2, diffX - diffX // 2,
-                        diffY // 2, diffY - diffY // 2])
-        x = torch.cat([x, x3], dim=1)
+def cat(x1, x2, x3=None, dim=1):
+    x = torch.cat([pad_to(x1, x2), x2], dim)
+    if x3 is None:
         return x
+    return torch.cat([x, pad_to(x3, x)], dim=1)
+
+
+# Names of the tensors returned by MyModel.forward, in order
+OUTPUTS = ('mask', 'preboud', 'inpimg2', 'inpimg3', 'inpimg4', 'inpimg5', 'mask_binary')
+# Inpaint-decoder heads and the decoder level each one is read from
+INP_HEADS = ('preboud', 'inpimg2', 'inpimg3', 'inpimg4', 'inpimg5')
+INP_LEVELS = {'preboud': 1, 'inpimg2': 2, 'inpimg3': 3, 'inpimg4': 4, 'inpimg5': 5}
+
+# Segments whose activations can be recomputed in backward instead of being stored
+ENCODER_SEGMENTS = ('stem', 'encoder2', 'encoder3', 'encoder4', 'encoder5')
+DECODER_SEGMENTS = tuple('segDecoder%d' % i for i in range(5, 0, -1)) + tuple('inpDecoder%d' % i for i in range(5, 0, -1))
+CHECKPOINT_SEGMENTS = ENCODER_SEGMENTS + DECODER_SEGMENTS
+# Named activation-checkpointing policies (the `checkpointing` key in config_model.yaml);
+# a comma-separated list of segment names is accepted as well
+CHECKPOINT_POLICIES = {
+    'none': (),
+    'full_res': ('segDecoder1', 'inpDecoder1'),  # the two full-resolution decoder blocks
+    'decoders': DECODER_SEGMENTS,
+    'encoder': ENCODER_SEGMENTS,
+    'early': ('stem', 'encoder2', 'encoder3', 'segDecoder2', 'segDecoder1', 'inpDecoder2', 'inpDecoder1'),
+    'all': CHECKPOINT_SEGMENTS,
+}
+
+
+def checkpoint_segments(policy):
+    """
+    Resolves a policy name or a comma-separated list of segment names.
+
+    Returns:
+        frozenset: Names from ``CHECKPOINT_SEGMENTS``.
+    """
+    if not policy:
+        return frozenset()
+    if policy in CHECKPOINT_POLICIES:
+        return frozenset(CHECKPOINT_POLICIES[policy])
+    names = [name.strip() for name in policy.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CHECKPOINT_SEGMENTS]
+    if unknown:
+        raise ValueError("Unknown checkpointing policy or segments {}, expected one of {} or names from {}".format(
+            unknown, tuple(CHECKPOINT_POLICIES), CHECKPOINT_SEGMENTS))
+    return frozenset(names)
+
+
+@contextlib.contextmanager
+def preserve_bn_stats(modules):
+    """
+    Restores BatchNorm running statistics after the block, so that the recomputed
+    forward of a checkpointed segment does not update them a second time.
+    """
+    bns = [m for module in modules for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    saved = [[b.clone() for b in bn.buffers()] for bn in bns]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for bn, buffers in zip(bns, saved):
+                for b, v in zip(bn.buffers(), buffers):
+                    b.copy_(v)
+
+
+def run_segment(owner, name, modules, fn, *inputs):
+    """
+    Runs ``fn(*inputs)``, recomputing its activations in backward when ``name`` is one
+    of ``owner.checkpointed`` and gradients are being recorded in train mode.
+    """
+    if name not in owner.checkpointed or not (owner.training and torch.is_grad_enabled()):
+        return fn(*inputs)
+    context_fn = lambda: (contextlib.nullcontext(), preserve_bn_stats(modules))
+    return checkpoint(fn, *inputs, use_reentrant=False, context_fn=context_fn)
 
 
 class ConvBlock(nn.Module):
@@ -120,10 +186,18 @@ class Encoder(nn.Module):
     """
     ResNet34-based feature extractor that encodes input 
     images into deep feature maps.
+
+    With pretrained=False the ImageNet weights are neither downloaded nor read, for
+    models whose weights all come from a checkpoint, and the same layers are built
+    without importing torchvision (ResNet34Trunk).
     """
-    def __init__(self, in_channels):
+    def __init__(self, in_channels, pretrained=True):
         super(Encoder, self).__init__()
-        resnet = models.resnet34(weights=models.ResNet34_Weights.IMAGENET1K_V1)
+        if pretrained:
+            import torchvision.models as models
+            resnet = models.resnet34(weights=models.ResNet34_Weights.IMAGENET1K_V1)
+        else:
+            resnet = ResNet34Trunk()
 
         if in_channels == 3:
             self.encoder1_conv = resnet.conv1
@@ -137,17 +211,22 @@ class Encoder(nn.Module):
         self.encoder3 = resnet.layer2
         self.encoder4 = resnet.layer3
         self.encoder5 = resnet.layer4
+        # Stages recomputed in backward, set by MyModel.set_checkpointing
+        self.checkpointed = frozenset()
 
-    def forward(self, x):
+    def stem(self, x):
         e1 = self.encoder1_conv(x)
         e1 = self.encoder1_bn(e1)
         e1 = self.encoder1_relu(e1)
-        e1_maxpool = self.maxpool(e1)
+        return e1, self.maxpool(e1)
+
+    def forward(self, x):
+        e1, e1_maxpool = run_segment(self, 'stem', (self.encoder1_conv, self.encoder1_bn), self.stem, x)
 
-        e2 = self.encoder2(e1_maxpool)
-        e3 = self.encoder3(e2)
-        e4 = self.encoder4(e3)
-        e5 = self.encoder5(e4)
+        e2 = run_segment(self, 'encoder2', (self.encoder2,), self.encoder2, e1_maxpool)
+        e3 = run_segment(self, 'encoder3', (self.encoder3,), self.encoder3, e2)
+        e4 = run_segment(self, 'encoder4', (self.encoder4,), self.encoder4, e3)
+        e5 = run_segment(self, 'encoder5', (self.encoder5,), self.encoder5, e4)
         return e1, e2, e3, e4, e5
 
 
@@ -158,6 +237,16 @@ class MyModel(nn.Module):
     Args:
         num_classes (int, optional): Number of output classes. Default is 1.
         in_channels (int, optional): Number of input channels. Default is 3.
+        single_pass (bool, optional): Run the encoder and seg-decoder once per call and
+            derive both the binary pseudo-label and the inpaint branch from that pass.
+            Default is False (original two-pass forward).
+        checkpointing (str, optional): Activation-checkpointing policy, a key of
+            ``CHECKPOINT_POLICIES`` or comma-separated names from ``CHECKPOINT_SEGMENTS``.
+            Default is 'none'.
+        pretrained (bool, optional): Initialise the encoder from ImageNet. Default is True;
+            build_model passes False when a checkpoint provides every weight.
+    Forward accepts an optional ``outputs`` spec (names from ``OUTPUTS``) to compute
+    only the requested heads, e.g. ``model(x, outputs=('preboud',))``.
     Returns:
         Tuple: 
         - Segmentation mask.
@@ -167,11 +256,15 @@ class MyModel(nn.Module):
     """
     def __init__(self,
                  num_classes=1,
-                 in_channels=3
+                 in_channels=3,
+                 single_pass=False,
+                 checkpointing='none',
+                 pretrained=True
                  ):
         super().__init__()
+        self.single_pass = single_pass
 
-        self.encoder = Encoder(in_channels=in_channels)
+        self.encoder = Encoder(in_channels=in_channels, pretrained=pretrained)
         
         # seg-Decoder
         self.segDecoder5 = DecoderBlock(512, 512)
@@ -203,21 +296,71 @@ class MyModel(nn.Module):
 
         self.dropout = DropOutDecoder()      
 
-    def forward(self, x):
+        self.checkpointed = frozenset()
+        self.set_checkpointing(checkpointing)
+
+    def set_checkpointing(self, policy):
+        """
+        Selects the encoder stages and decoder blocks whose activations are recomputed
+        in backward (train mode only). Outputs, gradients and BatchNorm statistics are
+        unchanged; only activation memory is traded for recompute time.
+        """
+        segments = checkpoint_segments(policy)
+        self.encoder.checkpointed = segments & frozenset(ENCODER_SEGMENTS)
+        self.checkpointed = segments & frozenset(DECODER_SEGMENTS)
+        return self
+
+    def decoder(self, name, x):
+        """Runs the DecoderBlock ``name``, checkpointed if the policy selects it."""
+        block = getattr(self, name)
+        return run_segment(self, name, (block,), block, x)
+
+    def seg_branch(self, e1, e2, e3, e4, e5):
+        """Seg-decoder: encoder pyramid -> sigmoid segmentation mask."""
+        d5 = self.decoder('segDecoder5', e5)
+        d4 = self.decoder('segDecoder4', cat(d5, e4))
+        d3 = self.decoder('segDecoder3', cat(d4, e3))
+        d2 = self.decoder('segDecoder2', cat(d3, e2))
+        d1 = self.decoder('segDecoder1', cat(d2, e1))
+
+        mask = self.segconv(d1)
+        mask = torch.sigmoid(mask)
+        return mask
+
+    def inp_branch(self, inpe1, inpe2, inpe3, inpe4, inpe5, heads=INP_HEADS):
+        """
+        Inpaint-decoder: encoder pyramid -> boundary prediction and side outputs.
+
+        Only the decoder levels and side-out blocks needed for ``heads`` are run;
+        heads that were not requested are returned as None.
+        """
+        skips = (inpe1, inpe2, inpe3, inpe4)
+        stop = min(INP_LEVELS[head] for head in heads)
+        out = {}
+
+        inpd = self.decoder('inpDecoder5', inpe5)
+        for level in range(5, stop - 1, -1):
+            if level < 5:
+                inpd = self.decoder('inpDecoder%d' % level, cat(inpd, skips[level - 1]))
+            name = 'inpimg%d' % level
+            if name in heads:
+                out[name] = torch.sigmoid(getattr(self, 'inpSideout%d' % level)(inpd))
+        if 'preboud' in heads:
+            out['preboud'] = torch.sigmoid(self.inpconv(inpd))
+        return tuple(out.get(head) for head in INP_HEADS)
+
+    def forward(self, x, outputs=None):
+        if outputs is not None:
+            return self.forward_heads(x, outputs)
+        if self.single_pass:
+            return self.forward_single_pass(x)
 
         ori = x
         bs, C, H, W = x.shape[0], x.shape[1], x.shape[2], x.shape[3]
         """Seg-branch"""
         e1, e2, e3, e4, e5 = self.encoder(x)
 
-        d5 = self.segDecoder5(e5)
-        d4 = self.segDecoder4(cat(d5, e4))
-        d3 = self.segDecoder3(cat(d4, e3))
-        d2 = self.segDecoder2(cat(d3, e2))
-        d1 = self.segDecoder1(cat(d2, e1))
-        
-        mask = self.segconv(d1)
-        mask = torch.sigmoid(mask)
+        mask = self.seg_branch(e1, e2, e3, e4, e5)
         mask_binary = (mask > 0.5)
         mask_binary = mask_binary.float()
 
@@ -228,31 +371,44 @@ class MyModel(nn.Module):
         # inpe1, inpe2, inpe3, inpe4, inpe5 = self.encoder(x)
         inpe1, inpe2, inpe3, inpe4, inpe5 = e1, e2, e3, e4, self.dropout(e5)
         
-        d5 = self.segDecoder5(e5)
-        d4 = self.segDecoder4(cat(d5, e4))
-        d3 = self.segDecoder3(cat(d4, e3))
-        d2 = self.segDecoder2(cat(d3, e2))
-        d1 = self.segDecoder1(cat(d2, e1))
-        
-        mask = self.segconv(d1)
-        mask = torch.sigmoid(mask)
+        mask = self.seg_branch(e1, e2, e3, e4, e5)
 
-        inpd5 = self.inpDecoder5(inpe5)
-        inpimg5 = self.inpSideout5(inpd5)
-        inpimg5 = torch.sigmoid(inpimg5)
-        inpd4 = self.inpDecoder4(cat(inpd5, inpe4))
-        inpimg4 = self.inpSideout4(inpd4)
-        inpimg4 = torch.sigmoid(inpimg4)
-        inpd3 = self.inpDecoder3(cat(inpd4, inpe3))
-        inpimg3 = self.inpSideout3(inpd3)
-        inpimg3 = torch.sigmoid(inpimg3)
-        inpd2 = self.inpDecoder2(cat(inpd3, inpe2))
-        inpimg2 = self.inpSideout2(inpd2)
-        inpimg2 = torch.sigmoid(inpimg2)
-        inpd1 = self.inpDecoder1(cat(inpd2, inpe1))
-        preboud = self.inpconv(inpd1)
-        preboud = torch.sigmoid(preboud)
+        preboud, inpimg2, inpimg3, inpimg4, inpimg5 = self.inp_branch(inpe1, inpe2, inpe3, inpe4, inpe5)
         return mask, preboud, inpimg2, inpimg3, inpimg4, inpimg5, mask_binary
         # return mask, preboud, mask_binary
 
+    def forward_single_pass(self, x):
+        """
+        Shared-encoder forward: the encoder pyramid and the seg-decoder run once and
+        feed both the binary pseudo-label and the inpaint branch. Matches the two-pass
+        forward exactly in eval mode; in train mode the pseudo-label comes from the same
+        dropout sample as the returned mask and BatchNorm statistics are updated once.
+        """
+        return self.forward_heads(x, OUTPUTS)
+
+    def forward_heads(self, x, outputs):
+        """
+        Head-selective forward that only runs the submodules needed for ``outputs``.
+
+        Args:
+            x (torch.Tensor): Input batch.
+            outputs (str or sequence of str): Names from ``OUTPUTS``, e.g. ('preboud',).
+        Returns:
+            Tuple: The requested outputs, in the requested order.
+        """
+        if isinstance(outputs, str):
+            outputs = (outputs,)
+        unknown = [name for name in outputs if name not in OUTPUTS]
+        if unknown:
+            raise ValueError("Unknown MyModel outputs {}, expected a subset of {}".format(unknown, OUTPUTS))
 
+        e1, e2, e3, e4, e5 = self.encoder(x)
+        out = {}
+        if 'mask' in outputs or 'mask_binary' in outputs:
+            out['mask'] = self.seg_branch(e1, e2, e3, e4, e5)
+            out['mask_binary'] = (out['mask'] > 0.5).float()
+
+        heads = [name for name in outputs if name in INP_HEADS]
+        if heads:
+            out.update(zip(INP_HEADS, self.inp_branch(e1, e2, e3, e4, self.dropout(e5), heads=heads)))
+        return tuple(out[name] for name in outputs)
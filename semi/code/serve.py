@@ -0,0 +1,279 @@
+"""
+Local HTTP inference server for MyModel with dynamic batching.
+
+The checkpoint is loaded once with build_model. Handler threads decode and resize the
+uploaded images; a single model thread drains the request queue into batches of up to
+--max-batch, waiting at most --max-wait-ms after the oldest request for more to arrive.
+
+Endpoints:
+    POST /predict[?format=png|rle]  body: PNG/JPEG bytes. Returns the mask at the image's
+                                    resolution, as a PNG (0/255) or as JSON
+                                    {"size": [H, W], "counts": [...]}: row-major run
+                                    lengths, starting with a run of zeros.
+    GET  /stats                     queue depth, batch-size histogram, latency percentiles.
+    GET  /health
+
+Usage (from the repository root):
+    python -m semi.code.serve --config config_model.yaml --port 8000 --max-batch 16 --max-wait-ms 10
+    curl --data-binary @image.jpg 'http://127.0.0.1:8000/predict?format=rle'
+"""
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import torch
+from PIL import Image
+
+from semi.code.infer import input_memory_format, model_from_config, predict_batch, preprocess
+from semi.code.utils.save_img import encode_png
+
+MASK_FORMATS = ('png', 'rle')
+
+
+def rle_encode(mask):
+    """
+    Run lengths of a binary (H, W) mask in row-major order, starting with a run of zeros.
+    """
+    flat = np.asarray(mask, dtype=bool).ravel()
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], change, [flat.size]])
+    counts = np.diff(bounds).tolist()
+    if flat.size and flat[0]:
+        counts = [0] + counts
+    return counts
+
+
+def rle_decode(counts, size):
+    """
+    Inverse of rle_encode, returns a (H, W) uint8 {0, 1} mask.
+    """
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values, counts).astype(np.uint8).reshape(size)
+
+
+class ServerStats(object):
+    """
+    Thread-safe serving counters: requests, batch-size histogram and a window of latencies.
+
+    Latency is measured from the request entering the queue to its mask leaving the model.
+    """
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = Counter()
+        self.latencies = deque(maxlen=window)
+
+    def record(self, batch_size, latencies):
+        with self.lock:
+            self.requests += batch_size
+            self.batches[batch_size] += 1
+            self.latencies.extend(latencies)
+
+    def summary(self, queue_depth):
+        with self.lock:
+            lat = np.asarray(self.latencies) * 1000
+            batches = sum(self.batches.values())
+            return {
+                'queue_depth': queue_depth,
+                'requests': self.requests,
+                'batches': batches,
+                'mean_batch': self.requests / batches if batches else 0.0,
+                'batch_sizes': {str(k): v for k, v in sorted(self.batches.items())},
+                'latency_ms': {
+                    'mean': float(lat.mean()) if lat.size else None,
+                    'p50': float(np.percentile(lat, 50)) if lat.size else None,
+                    'p99': float(np.percentile(lat, 99)) if lat.size else None,
+                },
+            }
+
+
+class DynamicBatcher(object):
+    """
+    Model thread that serves queued requests in dynamic batches.
+
+    A batch opens with the oldest request, takes every request already queued and
+    waits up to max_wait after that request's arrival for more, up to max_batch.
+
+    Args:
+        model (torch.nn.Module): Segmentation model accepting ``outputs=(output,)``.
+        max_batch (int): Largest batch.
+        max_wait (float): Seconds the oldest request may wait for the batch to fill.
+        output (str): Head to predict, a name from semi_self.OUTPUTS.
+        threshold (float): Mask binarisation threshold.
+        amp (str): Mixed precision mode, see utils.amp.
+        memory_format (torch.memory_format): Layout of the input batches.
+    """
+    def __init__(self, model, max_batch=16, max_wait=0.01, output='preboud', threshold=0.5, amp='off',
+                 memory_format=torch.contiguous_format):
+        self.model = model.eval()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.output = output
+        self.threshold = threshold
+        self.amp = amp
+        self.memory_format = memory_format
+        self.queue = queue.Queue()
+        self.stats = ServerStats()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def submit(self, image, size):
+        """
+        Queues a preprocessed (3, h, w) image, returns a Future of its (H, W) uint8 mask.
+        """
+        future = Future()
+        self.queue.put((image, size, time.perf_counter(), future))
+        return future
+
+    def next_batch(self):
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stopped.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+            try:
+                masks = self.infer(batch)
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            self.stats.record(len(batch), [done - arrived for _, _, arrived, _ in batch])
+            for (*_, future), mask in zip(batch, masks):
+                future.set_result(mask)
+
+    def infer(self, batch):
+        masks = predict_batch(self.model, [image for image, *_ in batch], [size for _, size, _, _ in batch],
+                              self.output, self.threshold, self.amp, self.memory_format)
+        return [mask[0].numpy() for mask in masks]
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer exposing a DynamicBatcher.
+
+    Args:
+        address (tuple): (host, port) to bind, port 0 picks a free one.
+        batcher (DynamicBatcher): Started model thread.
+        size (tuple): (H, W) model input size; uploads are resized like the test transform.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, batcher, size=(320, 320)):
+        super(InferenceServer, self).__init__(address, RequestHandler)
+        self.batcher = batcher
+        self.size = tuple(size)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            batcher = self.server.batcher
+            self.send_json(200, batcher.stats.summary(batcher.queue.qsize()))
+        elif path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        # Always consume the body so a keep-alive connection stays in sync after an error
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            self.send_json(404, {'error': 'not found'})
+            return
+        fmt = parse_qs(url.query).get('format', ['png'])[0]
+        if fmt not in MASK_FORMATS:
+            self.send_json(400, {'error': 'format must be one of {}'.format(MASK_FORMATS)})
+            return
+        try:
+            img = Image.open(io.BytesIO(body)).convert('RGB')
+        except Exception as e:
+            self.send_json(400, {'error': 'cannot decode image: {}'.format(e)})
+            return
+
+        size = (img.height, img.width)
+        image = preprocess(img, self.server.size)
+        try:
+            mask = self.server.batcher.submit(image, size).result()
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        if fmt == 'png':
+            self.send_bytes(200, encode_png(mask * 255), 'image/png')
+        else:
+            self.send_json(200, {'size': list(size), 'counts': rle_encode(mask)})
+
+    def send_json(self, status, obj):
+        self.send_bytes(status, json.dumps(obj).encode(), 'application/json')
+
+    def send_bytes(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the console under load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config_model.yaml')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--output', default='preboud', help='model head to segment with')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=['cuda', 'cpu'])
+    opt = parser.parse_args()
+
+    model, args = model_from_config(opt.config, opt.device)
+    batcher = DynamicBatcher(model, opt.max_batch, opt.max_wait_ms / 1000, output=opt.output,
+                             amp=getattr(args, 'amp', 'off'), memory_format=input_memory_format(args)).start()
+    server = InferenceServer((opt.host, opt.port), batcher)
+    print('Serving on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+if __name__ == '__main__':
+    main()
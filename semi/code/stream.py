@@ -0,0 +1,295 @@
+"""
+Streaming segmentation of ultrasound cine loops (a directory of frames or a video file).
+
+Frames are decoded and resized in a background thread, grouped into dynamic batches
+that close when max_batch frames are queued or when waiting longer would push the
+oldest frame past the latency budget, and run through the head-selective MyModel
+forward. Masks come out in frame order at the frame's own resolution, together with
+per-frame latency (capture to mask on the host) and sustained frames per second.
+
+Usage (from the repository root):
+    python -m semi.code.stream --config config_model.yaml --source loop.mp4 --budget-ms 100 --max-batch 8
+    python -m semi.code.stream --config config_model.yaml --source frames/ --fps 30 --out result/loop.zip
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+from semi.code.infer import input_memory_format, model_from_config, predict_batch, preprocess
+from semi.code.utils.save_img import PredictionWriter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# A decoded frame: (3, H, W) model input, original (H, W) and capture time (perf_counter)
+Frame = namedtuple('Frame', ['index', 'name', 'image', 'size', 'captured'])
+# A prediction: (1, H, W) uint8 {0, 1} mask on the host, latency in seconds, size of its batch
+FrameResult = namedtuple('FrameResult', ['index', 'name', 'mask', 'latency', 'batch_size'])
+
+
+def read_frames(source):
+    """
+    Yields (name, RGB uint8 array) for every frame of a cine loop, in acquisition order.
+
+    Args:
+        source (str): Directory of image files (sorted by name) or a video file readable by OpenCV.
+    """
+    if os.path.isdir(source):
+        for name in sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS)):
+            yield name, np.asarray(Image.open(os.path.join(source, name)).convert('RGB'))
+        return
+
+    import cv2
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError("Cannot open video '{}'".format(source))
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield 'frame_%06d.png' % index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+
+class FrameReader(object):
+    """
+    Decodes and preprocesses frames in a background thread into a bounded queue.
+
+    Preprocessing matches the test transform of tn3kDataSet (Resize, then ToTensor).
+
+    Args:
+        frames (iterable): (name, RGB uint8 array) pairs, e.g. read_frames(source).
+        size (tuple): (H, W) model input size.
+        fps (float, optional): Release frames at this rate, like a live probe; as fast as
+            they decode when None.
+        max_queue (int): Frames decoded ahead of the model at most.
+    """
+    _END = object()
+
+    def __init__(self, frames, size=(320, 320), fps=None, max_queue=32):
+        self.size = tuple(size)
+        self.fps = fps
+        self.queue = queue.Queue(max_queue)
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._run, args=(frames,), daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self, frames):
+        start = time.perf_counter()
+        try:
+            for index, (name, rgb) in enumerate(frames):
+                if self.fps:
+                    delay = start + index / self.fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                captured = time.perf_counter()
+                image = preprocess(Image.fromarray(rgb), self.size)
+                if not self._put(Frame(index, name, image, tuple(rgb.shape[:2]), captured)):
+                    return
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(self._END)
+
+    def _put(self, item):
+        # Gives up when the consumer has closed the reader, so the thread never blocks forever
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, timeout=None):
+        """
+        Returns the next Frame, or None at the end of the stream or when timeout expires.
+        """
+        if self.finished:
+            return None
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is self._END:
+            self.finished = True
+            return None
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class LatencyStats(object):
+    """
+    Per-frame latency and sustained throughput of a stream.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.batch_sizes = []
+        self.first_capture = None
+        self.last_done = None
+
+    def update(self, result, captured, done):
+        self.latencies.append(result.latency)
+        self.batch_sizes.append(result.batch_size)
+        self.first_capture = captured if self.first_capture is None else min(self.first_capture, captured)
+        self.last_done = done
+
+    def summary(self):
+        """
+        Returns a dict with frames, fps (frames over first capture to last mask), mean
+        batch size and mean/p50/p95/p99/max latency in milliseconds.
+        """
+        if not self.latencies:
+            return {'frames': 0}
+        lat = np.asarray(self.latencies) * 1000
+        return {
+            'frames': len(lat),
+            'fps': len(lat) / max(self.last_done - self.first_capture, 1e-9),
+            'batch': float(np.mean(self.batch_sizes)),
+            'mean_ms': float(lat.mean()),
+            'p50_ms': float(np.percentile(lat, 50)),
+            'p95_ms': float(np.percentile(lat, 95)),
+            'p99_ms': float(np.percentile(lat, 99)),
+            'max_ms': float(lat.max()),
+        }
+
+    def __str__(self):
+        s = self.summary()
+        if not s['frames']:
+            return 'no frames'
+        return ('%d frames, %.2f fps, mean batch %.2f, latency mean %.1f / p50 %.1f / p95 %.1f / p99 %.1f / max %.1f ms'
+                % (s['frames'], s['fps'], s['batch'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['p99_ms'], s['max_ms']))
+
+
+class CinePipeline(object):
+    """
+    Dynamic-batching frame segmentation around a MyModel head.
+
+    A batch opens with the oldest queued frame and takes every frame already queued, up
+    to max_batch; it waits for more only while ``captured + budget`` of the oldest frame
+    still leaves room for the estimated forward time of the larger batch (a running
+    per-frame cost). With a budget of 0 it never waits, so an idle pipeline runs frame by
+    frame and a backlog is drained in full batches.
+
+    Args:
+        model (torch.nn.Module): Segmentation model accepting ``outputs=(output,)``.
+        size (tuple): (H, W) model input size.
+        max_batch (int): Largest batch.
+        budget (float): Latency budget per frame in seconds.
+        output (str): Head to predict, a name from semi_self.OUTPUTS.
+        threshold (float): Mask binarisation threshold.
+        amp (str): Mixed precision mode, see utils.amp.
+        memory_format (torch.memory_format): Layout of the input batches.
+    """
+    def __init__(self, model, size=(320, 320), max_batch=8, budget=0.1, output='preboud', threshold=0.5,
+                 amp='off', memory_format=torch.contiguous_format):
+        self.model = model.eval()
+        self.size = tuple(size)
+        self.max_batch = max_batch
+        self.budget = budget
+        self.output = output
+        self.threshold = threshold
+        self.amp = amp
+        self.memory_format = memory_format
+        self.frame_cost = 0.0  # running estimate of forward seconds per frame
+        self.stats = LatencyStats()
+
+    def run(self, frames, fps=None, max_queue=32):
+        """
+        Segments a frame stream.
+
+        Args:
+            frames (iterable): (name, RGB uint8 array) pairs, e.g. read_frames(source).
+            fps (float, optional): Source frame rate to emulate, see FrameReader.
+
+        Yields:
+            FrameResult: One per frame, in frame order.
+        """
+        self.stats = LatencyStats()
+        reader = FrameReader(frames, self.size, fps, max_queue).start()
+        try:
+            while True:
+                batch = self.next_batch(reader)
+                if not batch:
+                    break
+                yield from self.infer(batch)
+        finally:
+            reader.close()
+
+    def next_batch(self, reader):
+        """
+        Collects the next dynamic batch, [] at the end of the stream.
+        """
+        first = reader.get()
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < self.max_batch:
+            # Frames already queued always join; new ones are only awaited within the budget
+            wait = first.captured + self.budget - self.frame_cost * (len(batch) + 1) - time.perf_counter()
+            frame = reader.get(timeout=max(wait, 0))
+            if frame is None:
+                break
+            batch.append(frame)
+        return batch
+
+    def infer(self, batch):
+        start = time.perf_counter()
+        masks = predict_batch(self.model, [frame.image for frame in batch], [frame.size for frame in batch],
+                              self.output, self.threshold, self.amp, self.memory_format)
+        done = time.perf_counter()
+
+        cost = (done - start) / len(batch)
+        self.frame_cost = cost if self.frame_cost == 0 else 0.8 * self.frame_cost + 0.2 * cost
+        for frame, mask in zip(batch, masks):
+            result = FrameResult(frame.index, frame.name, mask, done - frame.captured, len(batch))
+            self.stats.update(result, frame.captured, done)
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config_model.yaml')
+    parser.add_argument('--source', required=True, help='directory of frames or a video file')
+    parser.add_argument('--out', default='', help='mask output: a directory (png) or a .zip file, none when empty')
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--budget-ms', type=float, default=100.0, help='latency budget per frame')
+    parser.add_argument('--fps', type=float, default=None, help='emulate a live source at this frame rate')
+    parser.add_argument('--output', default='preboud', help='model head to segment with')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=['cuda', 'cpu'])
+    opt = parser.parse_args()
+
+    model, args = model_from_config(opt.config, opt.device)
+    pipeline = CinePipeline(model, max_batch=opt.max_batch, budget=opt.budget_ms / 1000, output=opt.output,
+                            amp=getattr(args, 'amp', 'off'), memory_format=input_memory_format(args))
+
+    target = 'none' if not opt.out else ('zip' if opt.out.endswith('.zip') else 'png')
+    with PredictionWriter(target, path=opt.out or None) as writer:
+        for result in pipeline.run(read_frames(opt.source), fps=opt.fps):
+            writer.write(result.mask[None], [result.name])
+    print(pipeline.stats)
+
+
+if __name__ == '__main__':
+    main()
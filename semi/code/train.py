@@ -0,0 +1,468 @@
+"""
+Headless segmentation training (the notebook's train / train_semi / test cells as a
+module) with single-process or multi-process DistributedDataParallel execution.
+
+Usage (from the repository root):
+    python -m semi.code.train --config config_model.yaml
+    python -m semi.code.train --config config_model.yaml --nprocs 4 --backend gloo --device cpu
+    torchrun --nproc_per_node 4 -m semi.code.train --config config_model.yaml --backend nccl
+"""
+import argparse
+import contextlib
+import math
+import os
+import socket
+from itertools import cycle
+from types import SimpleNamespace
+
+import torch
+import torch.multiprocessing as mp
+import yaml
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from semi.code.data.build_dataset import build_dataset, build_collate
+from semi.code.models.build_model import build_model
+from semi.code.models.dc_gan import DCGAN_D
+from semi.code.models.semi_self import INP_HEADS
+from semi.code.utils import distributed as dist_utils
+from semi.code.utils.amp import autocast, grad_scaler
+from semi.code.utils.checkpoint import CheckpointManager
+from semi.code.utils.evaluate import evaluate, evaluate_tiled
+from semi.code.utils.loss import BceDiceLoss, ShapePriorLoss
+from semi.code.utils.mytransforms import BatchRandomGeometric
+from semi.code.utils.pseudo_labels import PseudoLabelBank, PseudoLabeled
+from semi.code.utils.tiled import TiledPredictor
+
+# Default location of the pre-trained WGAN critic used as shape prior
+NETD_PATH = "GAN/result/netD_epoch_5000.pth"
+
+
+def DeepSupSeg(pred, gt):
+    """
+    Deep supervised segmentation loss (BCE + Dice).
+    """
+    criterion = BceDiceLoss()
+    loss = criterion(pred, gt)
+    return loss
+
+
+def lr_poly(base_lr, iter, max_iter, power):
+    return base_lr * ((1 - float(iter) / max_iter) ** power)
+
+
+def adjust_lr_rate(optim, iter, total_batch, args):
+    """
+    Polynomial learning-rate decay over args.nEpoch * total_batch steps.
+    """
+    lr = lr_poly(args.lr, iter, args.nEpoch * total_batch, args.power)
+    optim.param_groups[0]['lr'] = lr
+    return lr
+
+
+def build_optimizer(model, args):
+    """
+    SGD optimizer of the notebook. YAML reads exponent literals such as 1e-5 as strings,
+    hence the float casts.
+    """
+    return torch.optim.SGD(model.parameters(), lr=float(args.lr), momentum=float(args.mt),
+                           weight_decay=float(args.weight_decay))
+
+
+# The first ten values returned by evaluate, ckpt_metric is one of them
+METRICS = ('recall', 'specificity', 'precision', 'F1', 'F2', 'ACC_overall', 'IoU_poly', 'IoU_bg', 'IoU_mean', 'dice')
+
+
+def print_metrics(title, metrics):
+    recall, specificity, precision, F1, F2, ACC_overall, IoU_poly, IoU_bg, IoU_mean, dice = metrics
+    print(title)
+    print('recall: %.4f, specificity: %.4f, precision: %.4f, F1: %.4f, F2: %.4f, ACC_overall: %.4f, IoU_poly: %.4f, IoU_bg: %.4f, IoU_mean: %.4f, dice: %.4f'
+          % (recall, specificity, precision, F1, F2, ACC_overall, IoU_poly, IoU_bg, IoU_mean, dice))
+
+
+def build_checkpoint_manager(args):
+    """
+    Top-k / resumable checkpoints of semi/checkpoint/<ckpt_name>, see CheckpointManager.
+    """
+    return CheckpointManager(os.path.join(args.root, "semi/checkpoint", args.ckpt_name),
+                             k=int(getattr(args, 'keep_top_k', 3)), metric=getattr(args, 'ckpt_metric', 'F1'),
+                             save_every=int(getattr(args, 'save_every', 0)),
+                             async_save=getattr(args, 'async_ckpt', True))
+
+
+def resume_state(ckpt, model, optim, scaler, args):
+    return ckpt.resume(model, optim, scaler) if getattr(args, 'resume', False) else None
+
+
+def validate(model, valid_dataloader, val_total_batch, ckpt, epoch, args):
+    """
+    Evaluates on rank 0 only and updates the checkpoints; the other ranks wait.
+    """
+    dist_utils.sync_buffers(model)
+    if dist_utils.is_main_process():
+        metrics = evaluate(dist_utils.unwrap(model), valid_dataloader, val_total_batch,
+                           save_target=args.valid_pred_target)
+        print_metrics("Valid Result:", metrics[:10])
+        ckpt.update(model, dict(zip(METRICS, metrics[:10])), epoch)
+    dist_utils.barrier()
+
+
+def build_valid_loader(valid_data, args):
+    if valid_data is None or not dist_utils.is_main_process():
+        return None, 0
+    valid_dataloader = DataLoader(valid_data, batch_size=args.eval_batch_size, shuffle=False, num_workers=args.num_workers,
+                                  collate_fn=build_collate(args))
+    return valid_dataloader, math.ceil(len(valid_data) / args.eval_batch_size)
+
+
+def train(args, device):
+    """
+    Supervised training on the labeled split.
+    """
+    train_l_data, _, valid_data = build_dataset(args)
+    pin = device.type == 'cuda'
+    train_l_dataloader, train_l_sampler = dist_utils.build_loader(train_l_data, args.batch_size, shuffle=True,
+                                                                  num_workers=args.num_workers, pin_memory=pin,
+                                                                  collate_fn=build_collate(args))
+    valid_dataloader, val_total_batch = build_valid_loader(valid_data, args)
+
+    model = build_model(args).to(device)
+    # Only the seg head is supervised here, the inpaint branch receives no gradient
+    model = dist_utils.wrap_model(model, device, find_unused_parameters=True,
+                                  sync_bn=getattr(args, 'sync_bn', False))
+
+    label_aug = BatchRandomGeometric()
+    optim = build_optimizer(model, args)
+    scaler = grad_scaler(args.amp, device.type)
+
+    if dist_utils.is_main_process():
+        print('\n---------------------------------')
+        print('Start training')
+        print("World size :", dist_utils.get_world_size())
+        print('---------------------------------\n')
+
+    ckpt = build_checkpoint_manager(args)
+    resume = resume_state(ckpt, model, optim, scaler, args)
+    try:
+        for epoch in range(resume['epoch'] if resume else 0, args.nEpoch):
+            model.train()
+            if train_l_sampler is not None:
+                train_l_sampler.set_epoch(epoch)
+
+            total_batch = len(train_l_dataloader)
+            batches, first, epoch_rng = ckpt.start_epoch(resume, lambda: train_l_dataloader)
+            resume = None
+            bar = tqdm(enumerate(batches, first), total=total_batch, initial=first,
+                       disable=not dist_utils.is_main_process())
+            for batch_id, data_l in bar:
+                itr = total_batch * epoch + batch_id
+                img = data_l['image'].to(device, non_blocking=True)
+                gt = data_l['label'].to(device, non_blocking=True)
+                if args.batch_aug:
+                    data_l = label_aug({'image': img, 'label': gt})
+                    img, gt = data_l['image'], data_l['label']
+                optim.zero_grad()
+                with autocast(args.amp, device.type):
+                    mask = model(img)
+                    loss = DeepSupSeg(mask, gt)
+                scaler.scale(loss).backward()
+                scaler.step(optim)
+                scaler.update()
+                adjust_lr_rate(optim, itr, total_batch, args)
+                ckpt.periodic(model, optim, scaler, epoch, batch_id + 1, total_batch, epoch_rng)
+
+            if valid_data is not None:
+                validate(model, valid_dataloader, val_total_batch, ckpt, epoch, args)
+            ckpt.save_last(model, optim, scaler, epoch + 1)
+    finally:
+        ckpt.close()
+
+
+def load_shape_prior(args, device):
+    """
+    Loads the frozen WGAN critic. It takes no gradient, so it is never wrapped for
+    data parallelism and runs with ngpu=1 (no nested data_parallel).
+    """
+    netD = DCGAN_D(64, 100, 1, 64, 1, 0)
+    state = torch.load(getattr(args, 'netD', None) or NETD_PATH, map_location='cpu', weights_only=True)
+    netD.load_state_dict({k[len('module.'):] if k.startswith('module.') else k: v for k, v in state.items()})
+    if getattr(args, 'compile', False):
+        netD.compile(fullgraph=True, dynamic=False)
+    return ShapePriorLoss(netD.to(device))
+
+
+def labeled_loss(model, img_l, gt):
+    """
+    Weighted supervised loss of a labeled (micro-)batch.
+    """
+    mask = model(img_l)[0]
+    return 2 * DeepSupSeg(mask, gt)
+
+
+def unlabeled_loss(model, shape_prior, img_u, mask_u=None):
+    """
+    Pseudo-label segmentation loss plus GAN shape prior of an unlabeled (micro-)batch.
+
+    The pseudo-label is the model's own binary mask, unless banked pseudo-labels
+    ``mask_u`` are given; then only the encoder and the inpaint decoder run.
+    """
+    if mask_u is None:
+        _, predboud, inpimg2, inpimg3, inpimg4, inpimg5, mask_boud = model(img_u)
+    else:
+        predboud, inpimg2, inpimg3, inpimg4, inpimg5 = model(img_u, outputs=INP_HEADS)
+        mask_boud = mask_u
+    loss_u_seg = DeepSupSeg(predboud, mask_boud)
+    loss_u_shape = shape_prior(predboud, inpimg2, inpimg3, inpimg4, inpimg5)
+    return loss_u_seg + 0.1 * loss_u_shape
+
+
+def semi_step(model, shape_prior, img_l, gt, img_u, scaler, args, device_type, mask_u=None):
+    """
+    Accumulates the gradients of one train_semi step.
+
+    By default the labeled and unlabeled graphs are both kept alive until one
+    backward of ``2 * loss_l + loss_u``. With ``split_streams`` the labeled loss is
+    backpropagated before the unlabeled forward, and with ``micro_batches = N`` each
+    stream is additionally split into N chunks, each backpropagated on its own, so
+    only one chunk graph is alive at a time. Chunk losses are weighted by their share
+    of the batch, which keeps the gradient of the per-image mean losses, and hence
+    the effective batch and the LR schedule, unchanged; only BatchNorm sees the
+    smaller chunks. Under DDP the gradients are reduced once, on the last backward.
+    ``mask_u`` are the banked pseudo-labels of img_u, see unlabeled_loss.
+
+    Returns:
+        torch.Tensor: The detached step loss.
+    """
+    micro_batches = int(getattr(args, 'micro_batches', 1))
+    if micro_batches == 1 and not getattr(args, 'split_streams', False):
+        with autocast(args.amp, device_type):
+            loss = labeled_loss(model, img_l, gt) + unlabeled_loss(model, shape_prior, img_u, mask_u)
+        scaler.scale(loss.sum()).backward()
+        return loss.detach()
+
+    passes = []
+    for x, y in zip(img_l.tensor_split(micro_batches), gt.tensor_split(micro_batches)):
+        if len(x):
+            passes.append((lambda x=x, y=y: labeled_loss(model, x, y), len(x) / len(img_l)))
+    masks_u = mask_u.tensor_split(micro_batches) if mask_u is not None else [None] * micro_batches
+    for x, m in zip(img_u.tensor_split(micro_batches), masks_u):
+        if len(x):
+            passes.append((lambda x=x, m=m: unlabeled_loss(model, shape_prior, x, m), len(x) / len(img_u)))
+
+    total = 0
+    for i, (loss_fn, weight) in enumerate(passes):
+        last = i == len(passes) - 1
+        sync = contextlib.nullcontext() if last or not hasattr(model, 'no_sync') else model.no_sync()
+        with sync:
+            with autocast(args.amp, device_type):
+                loss = loss_fn() * weight
+            scaler.scale(loss.sum()).backward()
+        total = total + loss.detach()
+    return total
+
+
+def build_pseudo_label_bank(train_u_data, args):
+    """
+    Pseudo-label bank of the unlabeled split for ``pseudo_label_bank: K`` (refreshed
+    every K epochs), kept in shared memory or, with ``pseudo_label_store: disk``, next to
+    the checkpoints. Needs batch_aug: the unlabeled samples are then only resized, and
+    BatchRandomGeometric augments image and pseudo-label together.
+
+    Returns:
+        tuple: (unlabeled dataset, PseudoLabelBank or None); with a bank the dataset
+        yields {'image', 'label'} samples.
+    """
+    if not int(getattr(args, 'pseudo_label_bank', 0)):
+        return train_u_data, None
+    if not args.batch_aug:
+        raise ValueError("pseudo_label_bank needs batch_aug, pseudo-labels are stored at the loader resolution")
+    store = getattr(args, 'pseudo_label_store', 'memory')
+    if store not in ('memory', 'disk'):
+        raise ValueError("Unknown pseudo_label_store '{}', expected 'memory' or 'disk'".format(store))
+    path = None
+    if store == 'disk':
+        path = os.path.join(args.root, "semi/checkpoint", args.ckpt_name, "pseudo_labels.npy")
+    bank = PseudoLabelBank(len(train_u_data), size=train_u_data[0].shape[-2:], path=path)
+    return PseudoLabeled(train_u_data, bank), bank
+
+
+def train_semi(args, device):
+    """
+    Semi-supervised training with labeled and unlabeled streams and the GAN shape prior.
+
+    Both streams are sharded with their own DistributedSampler; the step count of an
+    epoch is the length of the unlabeled shard, identical on every rank.
+    """
+    train_l_data, unlabeled_data, valid_data = build_dataset(args)
+    train_u_data, bank = build_pseudo_label_bank(unlabeled_data, args)
+    pin = device.type == 'cuda'
+    train_l_dataloader, train_l_sampler = dist_utils.build_loader(train_l_data, args.batch_size, shuffle=True,
+                                                                  num_workers=args.num_workers, pin_memory=pin,
+                                                                  collate_fn=build_collate(args))
+    train_u_dataloader, train_u_sampler = dist_utils.build_loader(train_u_data, args.batch_size, shuffle=True,
+                                                                  num_workers=args.num_workers, pin_memory=pin,
+                                                                  collate_fn=build_collate(args))
+    valid_dataloader, val_total_batch = build_valid_loader(valid_data, args)
+
+    model = build_model(args).to(device)
+    # A chunked step's last backward does not reach every parameter
+    accumulate = int(getattr(args, 'micro_batches', 1)) > 1 or getattr(args, 'split_streams', False)
+    model = dist_utils.wrap_model(model, device, find_unused_parameters=accumulate,
+                                  sync_bn=getattr(args, 'sync_bn', False))
+    shape_prior = load_shape_prior(args, device)
+
+    label_aug = BatchRandomGeometric()
+    unlabel_aug = BatchRandomGeometric(rotation_p=1.0, zoom=None)
+    optim = build_optimizer(model, args)
+    scaler = grad_scaler(args.amp, device.type)
+
+    if dist_utils.is_main_process():
+        print('\n---------------------------------')
+        print('Start training_semi')
+        print("World size :", dist_utils.get_world_size())
+        print('---------------------------------\n')
+
+    ckpt = build_checkpoint_manager(args)
+    resume = resume_state(ckpt, model, optim, scaler, args)
+    try:
+        for epoch in range(resume['epoch'] if resume else 0, args.nEpoch):
+            model.train()
+            for sampler in (train_l_sampler, train_u_sampler):
+                if sampler is not None:
+                    sampler.set_epoch(epoch)
+            if bank is not None and bank.due(epoch, int(args.pseudo_label_bank)):
+                bank.refresh(dist_utils.unwrap(model), unlabeled_data, epoch, batch_size=args.eval_batch_size,
+                             num_workers=args.num_workers, collate_fn=build_collate(args), amp=args.amp,
+                             device=device)
+            total_batch = len(train_u_dataloader)
+            loader, first, epoch_rng = ckpt.start_epoch(resume, lambda: zip(cycle(train_l_dataloader),
+                                                                             train_u_dataloader))
+            resume = None
+            bar = tqdm(range(first, total_batch), total=total_batch, initial=first,
+                       disable=not dist_utils.is_main_process())
+
+            for batch_id in bar:
+                data_l, data_u = next(loader)
+                itr = total_batch * epoch + batch_id
+                img_l = data_l['image'].to(device, non_blocking=True)
+                gt = data_l['label'].to(device, non_blocking=True)
+                mask_u = None
+                if bank is None:
+                    img_u = data_u.to(device, non_blocking=True)
+                else:
+                    img_u = data_u['image'].to(device, non_blocking=True)
+                    mask_u = data_u['label'].to(device, non_blocking=True)
+                if args.batch_aug:
+                    data_l = label_aug({'image': img_l, 'label': gt})
+                    img_l, gt = data_l['image'], data_l['label']
+                    if mask_u is None:
+                        img_u = unlabel_aug(img_u)
+                    else:
+                        data_u = unlabel_aug({'image': img_u, 'label': mask_u})
+                        img_u, mask_u = data_u['image'], data_u['label']
+                optim.zero_grad()
+                semi_step(model, shape_prior, img_l, gt, img_u, scaler, args, device.type, mask_u)
+                scaler.step(optim)
+                scaler.update()
+                adjust_lr_rate(optim, itr, total_batch, args)
+                ckpt.periodic(model, optim, scaler, epoch, batch_id + 1, total_batch, epoch_rng)
+            model.eval()
+
+            if valid_data is not None:
+                validate(model, valid_dataloader, val_total_batch, ckpt, epoch, args)
+            ckpt.save_last(model, optim, scaler, epoch + 1)
+    finally:
+        ckpt.close()
+
+
+def test(args, device):
+    """
+    Evaluates a checkpoint on the test split (single process).
+    """
+    print('loading data......')
+    test_data = build_dataset(args)
+    model = build_model(args).to(device)
+    model.eval()
+
+    if getattr(args, 'tile_size', 0):
+        # Native resolution: unbatched variable-size samples, tiles are batched by the predictor
+        test_dataloader = DataLoader(test_data, batch_size=None, shuffle=False, num_workers=args.num_workers)
+        fmt = torch.channels_last if getattr(args, 'channels_last', False) else torch.contiguous_format
+        predictor = TiledPredictor(model, args.tile_size, overlap=float(getattr(args, 'tile_overlap', 0.5)),
+                                   batch_size=args.eval_batch_size, memory_format=fmt)
+        metrics = evaluate_tiled(predictor, test_dataloader, len(test_data), save_target=args.pred_target)
+        print_metrics("Test Result:", metrics[:10])
+        return
+
+    test_dataloader = DataLoader(test_data, batch_size=args.eval_batch_size, shuffle=False, num_workers=args.num_workers,
+                                 collate_fn=build_collate(args))
+    total_batch = math.ceil(len(test_data) / args.eval_batch_size)
+    metrics = evaluate(model, test_dataloader, total_batch, save_target=args.pred_target)
+    print_metrics("Test Result:", metrics[:10])
+
+
+def run(args, opt):
+    """
+    Entry point of one process: joins the process group, picks the device and runs args.manner.
+    """
+    rank, world_size, local_rank = dist_utils.init_distributed(opt.backend)
+    if opt.device == 'cuda':
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        device = torch.device('cpu')
+        args.GPUs = ""  # build_model moves the model to CUDA when GPUs are listed
+    torch.manual_seed(opt.seed + rank)  # per-rank augmentation / masking streams
+
+    if rank == 0:
+        os.makedirs(os.path.join(args.root, 'semi/checkpoint/' + args.ckpt_name), exist_ok=True)
+    dist_utils.barrier()
+    try:
+        if args.manner == 'full':
+            train(args, device)
+        elif args.manner == 'semi':
+            train_semi(args, device)
+        elif args.manner == 'test':
+            test(args, device)
+    finally:
+        dist_utils.cleanup()
+
+
+def spawn_worker(rank, world_size, port, args, opt):
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+                      MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    run(args, opt)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config_model.yaml')
+    parser.add_argument('--nprocs', type=int, default=1, help='processes to spawn on this node (ignored under torchrun)')
+    parser.add_argument('--backend', default='gloo', choices=['gloo', 'nccl'])
+    parser.add_argument('--device', default=None, choices=['cuda', 'cpu'], help='default: cuda when available')
+    parser.add_argument('--seed', type=int, default=0)
+    opt = parser.parse_args()
+
+    with open(opt.config, 'r') as f:
+        args = SimpleNamespace(**yaml.safe_load(f))
+    if opt.device != 'cpu' and args.GPUs and 'WORLD_SIZE' not in os.environ and opt.nprocs == 1:
+        # Before the first CUDA query: the variable is only read when CUDA initialises
+        os.environ['CUDA_VISIBLE_DEVICES'] = args.GPUs
+    if opt.device is None:
+        opt.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    if 'WORLD_SIZE' in os.environ or opt.nprocs == 1:
+        run(args, opt)
+    else:
+        mp.spawn(spawn_worker, args=(opt.nprocs, free_port(), args, opt), nprocs=opt.nprocs)
+    print('Done')
+
+
+if __name__ == '__main__':
+    main()
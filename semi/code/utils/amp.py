@@ -0,0 +1,50 @@
+import contextlib
+
+import torch
+
+# Values of the `amp` key in config_model.yaml
+AMP_MODES = ('off', 'auto', 'bf16', 'fp16')
+
+
+def autocast_dtype(mode, device_type):
+    """
+    Resolves an `amp` mode to the autocast dtype for a device.
+
+    'auto' picks bf16 on CPU, and on CUDA bf16 where supported, fp16 otherwise.
+
+    Returns:
+        torch.dtype or None: None when mixed precision is off.
+    """
+    if mode not in AMP_MODES:
+        raise ValueError("Unknown amp mode '{}', expected one of {}".format(mode, AMP_MODES))
+    if mode == 'off':
+        return None
+    if mode == 'bf16':
+        return torch.bfloat16
+    if mode == 'fp16':
+        if device_type == 'cpu':
+            raise ValueError("amp mode 'fp16' is not supported on CPU, use 'bf16' or 'auto'")
+        return torch.float16
+    if device_type == 'cuda' and not torch.cuda.is_bf16_supported():
+        return torch.float16
+    return torch.bfloat16
+
+
+def autocast(mode, device_type):
+    """
+    Returns the autocast context for training forwards, a no-op when `mode` is 'off'.
+    """
+    dtype = autocast_dtype(mode, device_type)
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device_type, dtype=dtype)
+
+
+def grad_scaler(mode, device_type):
+    """
+    Returns a GradScaler, enabled only for fp16 where gradients can underflow.
+
+    bf16 keeps the fp32 exponent range, so it runs with a disabled (pass-through) scaler.
+    """
+    enabled = autocast_dtype(mode, device_type) == torch.float16
+    return torch.amp.GradScaler(device_type, enabled=enabled)
@@ -6,8 +6,6 @@ from itertools import chain
 import contextlib
 import random
 import numpy as np
-import cv2
-from torch.distributions.uniform import Uniform
 
 
 def icnr(x, scale=2, init=nn.init.kaiming_normal_):
@@ -109,6 +107,7 @@ class FeatureNoiseDecoder(nn.Module):
     def __init__(self, uniform_range=0.3):
         super(FeatureNoiseDecoder, self).__init__()
         # self.upsample = upsample(conv_in_ch, num_classes, upscale=upscale)
+        from torch.distributions.uniform import Uniform
         self.uni_dist = Uniform(-uniform_range, uniform_range)
 
     def feature_based_noise(self, x):
@@ -172,6 +171,8 @@ class VATDecoder(nn.Module):
 
 
 def guided_cutout(output, upscale, resize, erase=0.4, use_dropout=False):
+    import cv2  # training-only, kept out of the model import path
+
     if len(output.shape) == 3:
         masks = (output > 0).float()
     else:
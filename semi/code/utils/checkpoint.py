@@ -0,0 +1,348 @@
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+from collections import deque
+
+import numpy as np
+import torch
+
+from semi.code.utils import distributed as dist_utils
+
+# Names of the top-k checkpoints by rank, best.pth being the one build_model loads by default
+RANK_NAMES = ('best', 'second_best', 'third_best')
+LAST = 'last'
+MANIFEST = 'topk.json'
+
+
+def rank_name(i):
+    return RANK_NAMES[i] if i < len(RANK_NAMES) else 'top{}'.format(i + 1)
+
+
+def rng_state():
+    """
+    State of every RNG training draws from: python, numpy, torch CPU and CUDA.
+    Stored as tensors and plain values so checkpoints load with ``weights_only``.
+    """
+    np_state = np.random.get_state(legacy=False)
+    # torch.save has no uint32 storage, the MT19937 key is kept as int64
+    key = torch.from_numpy(np_state['state']['key'].astype(np.int64))
+    state = {
+        'python': random.getstate(),
+        'numpy': dict(np_state, state=dict(np_state['state'], key=key)),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np_state = state['numpy']
+    np.random.set_state(dict(np_state, state=dict(np_state['state'], key=np_state['state']['key'].numpy().astype(np.uint32))))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def to_cpu(obj):
+    """
+    Deep copy of a (nested) state with every tensor copied to CPU, so training can
+    keep updating the originals while the copy is written.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    """
+    torch.save through a temporary file that replaces ``path`` only once it is
+    complete on disk, so a preempted write never leaves a truncated checkpoint.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def skip(iterator, n):
+    """
+    Advances an iterator by n items.
+    """
+    deque(itertools.islice(iterator, n), maxlen=0)
+
+
+class CheckpointManager(object):
+    """
+    Keeps the top-k checkpoints by a validation metric and a resumable ``last.pth``,
+    written on a background thread.
+
+    The top-k files (best, second_best, third_best, top4, ...) hold model weights only,
+    as before, so build_model and the export tools load them unchanged; a new entry
+    moves the lower ranks down instead of replacing them. ``topk.json`` records the
+    metric and epoch of each. ``last.pth`` additionally holds the optimizer, GradScaler,
+    the position in the schedule (epoch, steps done in it), the RNG states of every
+    rank and the ranking, which is all train / train_semi need to continue exactly
+    where it was written. The top-k files can be ahead of last.pth after a crash; on
+    resume they are brought back to its ranking (see reconcile).
+
+    Saving copies the state to CPU on the calling thread (the only part training waits
+    for) and queues the write, which is atomic (see atomic_save). Only the main process
+    writes; every rank must call ``save_last`` / ``periodic`` since the RNG states are
+    gathered from all of them.
+
+    Args:
+        directory (str): Checkpoint directory, semi/checkpoint/<ckpt_name>.
+        k (int): Number of top checkpoints kept.
+        metric (str): Validation metric ranking them (higher is better).
+        save_every (int): Steps between periodic ``last.pth`` writes, 0 writes it at
+            the end of each epoch only.
+        async_save (bool): Write on a background thread, otherwise inline.
+    """
+
+    def __init__(self, directory, k=3, metric='F1', save_every=0, async_save=True):
+        self.directory = directory
+        self.k = k
+        self.metric = metric
+        self.save_every = save_every
+        self.topk = []  # [{'name', 'metric', 'epoch'}], best first
+        self.best = 0  # best validation dice (or metric without one), printed like the notebook
+        self.error = None
+        self.queue = None
+        if async_save and dist_utils.is_main_process():
+            # One write in flight and one waiting bounds the CPU snapshots held in memory
+            self.queue = queue.Queue(maxsize=1)
+            self.thread = threading.Thread(target=self.worker, name='checkpoint-writer', daemon=True)
+            self.thread.start()
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.pth')
+
+    def worker(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    task()
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def submit(self, task):
+        if self.error is not None:
+            raise RuntimeError('Writing a checkpoint failed') from self.error
+        if self.queue is None:
+            task()
+        else:
+            self.queue.put(task)
+
+    def wait(self):
+        """
+        Blocks until every queued write is on disk.
+        """
+        if self.queue is not None:
+            self.queue.join()
+        if self.error is not None:
+            raise RuntimeError('Writing a checkpoint failed') from self.error
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        if self.error is not None:
+            raise RuntimeError('Writing a checkpoint failed') from self.error
+
+    def update(self, model, metrics, epoch):
+        """
+        Ranks the model by its validation metrics (dict name -> value) and saves it if
+        it enters the top-k. Main process only.
+        """
+        value = float(metrics[self.metric])
+        self.best = max(self.best, metrics.get('dice', value))
+        print("Best Dice:: " if 'dice' in metrics else "Best {}:: ".format(self.metric), self.best)
+
+        # Ties keep the earlier checkpoint, like the notebook's strict comparisons
+        rank = next((i for i, entry in enumerate(self.topk) if value > entry['metric']), len(self.topk))
+        if rank >= self.k:
+            return
+        # DataParallel and DistributedDataParallel share the 'module.' key layout
+        state = to_cpu(model.state_dict())
+        ranked = len(self.topk)
+        self.topk.insert(rank, {'name': None, 'metric': value, 'epoch': epoch})
+        del self.topk[self.k:]
+        for i, entry in enumerate(self.topk):
+            entry['name'] = rank_name(i)
+        manifest = [dict(entry) for entry in self.topk]
+
+        def write():
+            tmp = self.path(rank_name(rank)) + '.new'
+            atomic_save(state, tmp)
+            # Shift the lower ranks down, from the bottom, then move the new one in
+            for i in reversed(range(rank, ranked)):
+                if not os.path.exists(self.path(rank_name(i))):
+                    continue
+                if i + 1 < self.k:
+                    os.replace(self.path(rank_name(i)), self.path(rank_name(i + 1)))
+                else:
+                    os.remove(self.path(rank_name(i)))
+            os.replace(tmp, self.path(rank_name(rank)))
+            self.write_manifest(manifest)
+        self.submit(write)
+
+    def read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        tmp = os.path.join(self.directory, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'metric': self.metric, 'checkpoints': manifest}, f, indent=1)
+        os.replace(tmp, os.path.join(self.directory, MANIFEST))
+
+    def save_last(self, model, optim, scaler, epoch, step=0, epoch_rng=None):
+        """
+        Writes last.pth after ``step`` steps of ``epoch`` (step 0: before the epoch).
+
+        Args:
+            epoch_rng (dict, optional): rng_state() at the start of the epoch, from which
+                the resumed run rebuilds the epoch's data order; defaults to the
+                current state, which is only right for step 0.
+        """
+        rng = dist_utils.gather_object(rng_state())
+        epoch_rng = dist_utils.gather_object(epoch_rng) if epoch_rng is not None else rng
+        if not dist_utils.is_main_process():
+            return
+        state = to_cpu({
+            'model': model.state_dict(),
+            'optimizer': optim.state_dict(),
+            'scaler': scaler.state_dict(),
+            'epoch': epoch,
+            'step': step,
+            'rng': rng,
+            'epoch_rng': epoch_rng,
+            'best': self.best,
+            'topk': {'metric': self.metric, 'checkpoints': [dict(entry) for entry in self.topk]},
+        })
+        self.submit(lambda: atomic_save(state, self.path(LAST)))
+
+    def periodic(self, model, optim, scaler, epoch, step, total_batch, epoch_rng):
+        """
+        save_last every ``save_every`` steps inside an epoch; the end of the epoch is
+        saved after validation instead.
+        """
+        if self.save_every and step % self.save_every == 0 and step < total_batch:
+            self.save_last(model, optim, scaler, epoch, step, epoch_rng)
+
+    def resume(self, model, optim, scaler):
+        """
+        Restores model, optimizer, GradScaler and the top-k ranking from last.pth.
+
+        Returns:
+            dict or None: The epoch and step to continue from and this rank's RNG
+            states ('epoch', 'step', 'rng', 'epoch_rng'), see start_epoch; None
+            when there is no last.pth yet.
+        """
+        if not os.path.isfile(self.path(LAST)):
+            print('No {} to resume from, starting from scratch'.format(self.path(LAST)))
+            return None
+        state = torch.load(self.path(LAST), map_location='cpu', weights_only=True)
+        model.load_state_dict(state['model'])
+        optim.load_state_dict(state['optimizer'])
+        scaler.load_state_dict(state['scaler'])
+        self.best = state['best']
+        # last.pth written before it recorded the ranking: topk.json as it is
+        topk = state.get('topk') or self.read_manifest()
+        if topk is not None and topk['metric'] == self.metric:
+            self.topk = self.reconcile(topk['checkpoints'][:self.k])
+
+        rank, world_size = dist_utils.get_rank(), dist_utils.get_world_size()
+        if len(state['rng']) != world_size:
+            print('last.pth was written by {} processes, not {}: the data order and augmentations will '
+                  'differ from the interrupted run'.format(len(state['rng']), world_size))
+        print('Resuming from epoch {} step {}'.format(state['epoch'], state['step']))
+        return {'epoch': state['epoch'], 'step': state['step'],
+                'rng': state['rng'][rank % len(state['rng'])],
+                'epoch_rng': state['epoch_rng'][rank % len(state['epoch_rng'])]}
+
+    def reconcile(self, ranking):
+        """
+        Brings the top-k files and topk.json back to the ranking saved in last.pth.
+
+        After a crash between a validation and the following last.pth, the files and
+        topk.json already include that epoch, which the resumed run validates again.
+        Its file is removed and the others are renamed to their rank in ``ranking``;
+        an entry whose file is gone (pushed out of the top-k by that epoch) is
+        dropped from the ranking.
+
+        Returns:
+            list: The ranking, as kept.
+        """
+        if not dist_utils.is_main_process():
+            return ranking  # only the main process ranks and writes
+        manifest = self.read_manifest()
+        if manifest is None:
+            on_disk = {entry['epoch']: entry['name'] for entry in ranking}
+        else:
+            on_disk = {entry['epoch']: entry['name'] for entry in manifest['checkpoints']}
+        kept = [dict(entry) for entry in ranking
+                if entry['epoch'] in on_disk and os.path.isfile(self.path(on_disk[entry['epoch']]))]
+        if len(kept) < len(ranking):
+            print('{} of the top-{} checkpoints of last.pth are missing'.format(len(ranking) - len(kept), self.k))
+
+        # Through temporary names, a file may move to the rank another one leaves
+        keep = {entry['epoch'] for entry in kept}
+        for entry in kept:
+            os.replace(self.path(on_disk[entry['epoch']]), self.path(entry['name']) + '.resume')
+        for epoch, name in on_disk.items():
+            if epoch not in keep and os.path.isfile(self.path(name)):
+                os.remove(self.path(name))
+        for i, entry in enumerate(kept):
+            os.replace(self.path(entry['name']) + '.resume', self.path(rank_name(i)))
+            entry['name'] = rank_name(i)
+        self.write_manifest(kept)
+        return kept
+
+    def start_epoch(self, resume, make_batches):
+        """
+        Starts iterating an epoch's batches, fast-forwarded to the resume point.
+
+        The RNG state at the start of the epoch is restored before the DataLoader
+        iterators are created, so the sampler order, the base seed of the workers and
+        hence the worker-side augmentations are those of the interrupted run; the
+        steps already done are read and dropped (no forward), then the RNG continues
+        from the state saved with them.
+
+        Args:
+            resume (dict or None): From resume(), only for the first resumed epoch.
+            make_batches (callable): Returns the epoch's batches; DataLoader iterators
+                draw their seeds when created, so only inside start_epoch.
+
+        Returns:
+            tuple: (iterator, first step, rng_state() at the start of the epoch)
+        """
+        if resume is not None:
+            set_rng_state(resume['epoch_rng'])
+        epoch_rng = rng_state()
+        batches = iter(make_batches())
+        if resume is None:
+            return batches, 0, epoch_rng
+        skip(batches, resume['step'])
+        set_rng_state(resume['rng'])
+        return batches, resume['step'], epoch_rng
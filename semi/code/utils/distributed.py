@@ -0,0 +1,136 @@
+import os
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+
+def init_distributed(backend='gloo'):
+    """
+    Joins the process group described by the torchrun / spawn environment
+    (RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR, MASTER_PORT).
+
+    Does nothing for single-process runs (WORLD_SIZE unset or 1).
+
+    Returns:
+        tuple: (rank, world_size, local_rank)
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size == 1:
+        return 0, 1, 0
+    rank = int(os.environ['RANK'])
+    local_rank = int(os.environ.get('LOCAL_RANK', rank))
+    if not dist.is_initialized():
+        dist.init_process_group(backend, rank=rank, world_size=world_size)
+    return rank, world_size, local_rank
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def gather_object(obj):
+    """
+    Returns the list of ``obj`` from every rank (``[obj]`` in single-process runs).
+    """
+    if not is_distributed():
+        return [obj]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def build_loader(dataset, batch_size, shuffle=True, num_workers=0, pin_memory=False, seed=0, collate_fn=None):
+    """
+    DataLoader that shards the dataset over the ranks when running distributed.
+
+    Every rank gets ``batch_size // world_size`` samples per step, so the global batch
+    and the number of steps per epoch match the single-process configuration. Plain
+    BatchNorm still normalises over the local samples only, so its batches shrink with
+    the world size, which changes training; see ``sync_bn`` in wrap_model. The
+    samplers of all datasets share one seed, and the DistributedSampler pads each
+    shard to the same length so every rank runs the same number of steps.
+
+    Returns:
+        tuple: (DataLoader, DistributedSampler or None)
+    """
+    world_size = get_world_size()
+    if world_size == 1:
+        return DataLoader(dataset, batch_size, shuffle=shuffle, num_workers=num_workers, pin_memory=pin_memory,
+                          collate_fn=collate_fn), None
+    if batch_size % world_size:
+        raise ValueError("batch_size {} is not divisible by the world size {}".format(batch_size, world_size))
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=get_rank(), shuffle=shuffle, seed=seed)
+    loader = DataLoader(dataset, batch_size // world_size, sampler=sampler, num_workers=num_workers,
+                        pin_memory=pin_memory, collate_fn=collate_fn)
+    return loader, sampler
+
+
+def wrap_model(model, device, find_unused_parameters=False, sync_bn=False):
+    """
+    Wraps the model for data-parallel training.
+
+    Distributed runs use DistributedDataParallel. Buffers are not broadcast from
+    rank 0 on every forward: train_semi runs two forwards before one backward,
+    and the in-place broadcast would invalidate the BatchNorm statistics saved for
+    the first one. Running statistics are averaged with ``sync_buffers`` instead.
+    Single-process runs keep nn.DataParallel, as before.
+
+    With ``sync_bn`` the BatchNorm layers become SyncBatchNorm, which normalises over
+    the global batch like the single-process run, at the cost of one all-reduce per
+    layer and forward. PyTorch only implements it on CUDA; the state_dict keys are
+    unchanged.
+    """
+    if is_distributed():
+        if sync_bn:
+            if device.type != 'cuda':
+                raise ValueError("sync_bn needs CUDA devices, SyncBatchNorm does not run on {}".format(device.type))
+            model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
+        device_ids = [device.index] if device.type == 'cuda' else None
+        return torch.nn.parallel.DistributedDataParallel(model, device_ids=device_ids, broadcast_buffers=False,
+                                                         find_unused_parameters=find_unused_parameters)
+    return torch.nn.DataParallel(model)
+
+
+@torch.no_grad()
+def sync_buffers(model):
+    """
+    Averages the floating-point buffers (BatchNorm running statistics) over the ranks.
+    """
+    if not is_distributed():
+        return
+    buffers = [b for b in model.buffers() if b.is_floating_point()]
+    handles = [dist.all_reduce(b, async_op=True) for b in buffers]
+    for h in handles:
+        h.wait()
+    torch._foreach_div_(buffers, get_world_size())
+
+
+def unwrap(model):
+    """
+    Returns the module inside nn.DataParallel / DistributedDataParallel.
+    """
+    return model.module if hasattr(model, 'module') else model
@@ -1,67 +1,150 @@
 import os
 import torch
-from .save_img import save_img
+from .save_img import PredictionWriter
 from tqdm import tqdm
 import torch.nn.functional as F
 
-def evaluate(model, dataloader, total_batch):
+# Metric names, in the order returned by evaluate() and evaluate_batch()
+METRICS = ('recall', 'specificity', 'precision', 'F1', 'F2', 'ACC_overall', 'IoU_poly', 'IoU_bg', 'IoU_mean', 'dice')
 
+
+def evaluate(model, dataloader, total_batch, save_target='png'):
+    """
+    Evaluates the inpaint/boundary head over a dataloader of any batch size.
+
+    TP/FP/TN/FN are counted per image as integers on the model's device and the
+    metrics are reduced with a single host sync after the last batch.
+
+    Args:
+        model (torch.nn.Module): Model to evaluate (may be wrapped in DataParallel).
+        dataloader (DataLoader): Yields dicts with 'name', 'image' and 'label'.
+        total_batch (int): Number of batches, used for the progress bar.
+        save_target (str): Where predictions go, see PredictionWriter: 'png' (./result),
+            'zip', 'memmap' or 'none' to skip writing (e.g. per-epoch validation).
+
+    Returns:
+        Tuple: Per-image averaged recall, specificity, precision, F1, F2, ACC_overall,
+        IoU_poly, IoU_bg, IoU_mean, dice, followed by list_name and list_point.
+    """
     model.eval()
+    device = next(model.parameters()).device
 
-    recall = 0
-    specificity = 0
-    precision = 0
-    F1 = 0
-    F2 = 0
-    ACC_overall = 0
-    IoU_poly = 0
-    IoU_bg = 0
-    IoU_mean = 0
-    dice_sum=0
+    counts = []
     list_name=[]
     list_point=[]
-    with torch.no_grad():
+    writer = PredictionWriter(save_target, capacity=len(getattr(dataloader, 'dataset', ())) or None)
+    with writer, torch.no_grad():
         bar = tqdm(enumerate(dataloader), total=total_batch)
         for i, data in bar:
             name, img, gt = data['name'], data['image'], data['label']
-            inp = img.clone().detach()
-            target = gt.clone().detach()
-            inp = inp.cuda()
-            target = target.cuda()
-            output = model(inp)[1]
+            inp = img.to(device, non_blocking=True)
+            target = gt.to(device, non_blocking=True)
+            # Only the inpaint/boundary head is scored, skip the seg head and side outputs
+            output = model(inp, outputs=('preboud',))[0]
             output = (output > 0.5).float()
-            save_img(output, name[0])
-
-            # ====evaluate_SMS
-            IoU_mean,ACC_overall,dice_sum,recall,specificity,F1,F2,precision,IoU_poly,IoU_bg = \
-                  evaluate_SMS(output,target,IoU_mean,ACC_overall,dice_sum,recall,specificity,F1,F2,precision,IoU_poly,IoU_bg)
-    recall /= total_batch
-    specificity /= total_batch
-    precision /= total_batch
-    F1 /= total_batch
-    F2 /= total_batch
-    ACC_overall /= total_batch
-    IoU_poly /= total_batch
-    IoU_bg /= total_batch
-    IoU_mean /= total_batch
-    dice_sum /= total_batch
-    return recall, specificity, precision, F1, F2, ACC_overall, IoU_poly, IoU_bg, IoU_mean,dice_sum, list_name, list_point
-
-
-def evaluate_SMS(pred,labels,IoU_mean,ACC_overall,dice_sum,recall,specificity,F1,F2,precision,IoU_poly,IoU_bg):
-    _recall, _specificity, _precision, _F1, _F2, \
-            _ACC_overall, _IoU_poly, _IoU_bg, _IoU_mean,dice = evaluate_batch(pred, labels)
-    recall += _recall.item()
-    specificity += _specificity.item()
-    precision += _precision.item()
-    F1 += _F1.item()
-    F2 += _F2.item()
-    ACC_overall += _ACC_overall.item()
-    IoU_poly += _IoU_poly.item()
-    IoU_bg += _IoU_bg.item()
-    IoU_mean += _IoU_mean.item()
-    dice_sum+=dice.item()
-    return IoU_mean,ACC_overall,dice_sum,recall,specificity,F1,F2,precision,IoU_poly,IoU_bg
+            writer.write(output, name)
+
+            counts.append(confusion_counts(output, target))
+
+    if not counts:
+        return (0.0,) * len(METRICS) + (list_name, list_point)
+    metrics = metrics_from_counts(torch.cat(counts))
+    # One device -> host transfer for the whole split
+    means = torch.stack(metrics).double().mean(1).tolist()
+    return tuple(means) + (list_name, list_point)
+
+
+def evaluate_tiled(predictor, dataloader, total, save_target='png'):
+    """
+    Evaluates the inpaint/boundary head at native resolution with a TiledPredictor.
+
+    Same metrics and prediction outputs as evaluate(), but every image is predicted
+    as overlapping tiles at its own size and scored against its full-size mask.
+
+    Args:
+        predictor (TiledPredictor): Tiled inference engine around the model.
+        dataloader (DataLoader): Unbatched (batch_size=None) loader yielding dicts with
+            'name', a (C, H, W) 'image' and a (1, H, W) 'label' of any size.
+        total (int): Number of images, used for the progress bar.
+        save_target (str): 'png', 'zip' or 'none', see PredictionWriter ('memmap'
+            needs a single image size).
+
+    Returns:
+        Tuple: Same as evaluate().
+    """
+    predictor.model.eval()
+    labels = []
+
+    def images():
+        # Names and masks wait here until their prediction comes out of the tile stream
+        for data in dataloader:
+            labels.append((data['name'], data['label']))
+            yield data['image']
+
+    counts = []
+    writer = PredictionWriter(save_target, capacity=total)
+    with writer:
+        for output in tqdm(predictor.predict(images()), total=total):
+            name, gt = labels.pop(0)
+            output = (output[None] > 0.5).float()
+            writer.write(output, [name])
+            counts.append(confusion_counts(output, gt[None].to(output.device, non_blocking=True)))
+
+    if not counts:
+        return (0.0,) * len(METRICS) + ([], [])
+    metrics = metrics_from_counts(torch.cat(counts))
+    means = torch.stack(metrics).double().mean(1).tolist()
+    return tuple(means) + ([], [])
+
+
+def confusion_counts(output, gt):
+    """
+    Counts TP, FP, TN and FN per image without leaving the device.
+
+    Args:
+        output (torch.Tensor): Predictions of shape (B, ...), binarised at 0.5.
+        gt (torch.Tensor): Ground truth of shape (B, ...), binarised at 0.5.
+
+    Returns:
+        torch.Tensor: int64 tensor of shape (B, 4) holding TP, FP, TN, FN.
+    """
+    pred_binary = (output >= 0.5).flatten(1)
+    gt_binary = (gt >= 0.5).flatten(1)
+
+    TP = (pred_binary & gt_binary).sum(1)
+    FP = (pred_binary & ~gt_binary).sum(1)
+    FN = (~pred_binary & gt_binary).sum(1)
+    TN = pred_binary.size(1) - TP - FP - FN
+    return torch.stack([TP, FP, TN, FN], 1)
+
+
+def metrics_from_counts(counts):
+    """
+    Computes the evaluate_batch metrics from confusion counts, elementwise.
+
+    Args:
+        counts (torch.Tensor): Tensor of shape (..., 4) holding TP, FP, TN, FN.
+
+    Returns:
+        Tuple: Recall, Specificity, Precision, F1, F2, ACC_overall, IoU_poly, IoU_bg,
+        IoU_mean and dice, each of shape counts.shape[:-1].
+    """
+    TP, FP, TN, FN = counts.float().unbind(-1)
+    # Same convention as evaluate_batch: an empty intersection counts as one TP
+    TP = torch.where(TP == 0, torch.ones_like(TP), TP)
+
+    Recall = TP / (TP + FN)
+    Specificity = TN / (TN + FP)
+    Precision = TP / (TP + FP)
+    F1 = 2 * Precision * Recall / (Precision + Recall)
+    F2 = 5 * Precision * Recall / (4 * Precision + Recall)
+    ACC_overall = (TP + TN) / (TP + FP + FN + TN)
+    IoU_poly = TP / (TP + FP + FN)
+    IoU_bg = TN / (TN + FP + FN)
+    IoU_mean = (IoU_poly + IoU_bg) / 2.0
+    dice = F1
+    return Recall, Specificity, Precision, F1, F2, ACC_overall, IoU_poly, IoU_bg, IoU_mean, dice
+
 
 def evaluate_batch(output, gt):
     pred = output
@@ -75,8 +158,7 @@ def evaluate_batch(output, gt):
     TN = pred_binary_inverse.mul(gt_binary_inverse).sum()
     FN = pred_binary_inverse.mul(gt_binary).sum()
 
-    if TP.item() == 0:
-        TP = torch.Tensor([1]).cuda()
+    TP = torch.where(TP == 0, torch.ones_like(TP), TP)
     # recall
     Recall = TP / (TP + FN)
     # Specificity or true negative rate
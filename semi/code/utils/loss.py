@@ -1,5 +1,6 @@
 import torch.nn as nn
 import torch
+import torch.nn.functional as F
 
 # BCE loss
 class BCELoss(nn.Module):
@@ -22,10 +23,12 @@ class BCELoss(nn.Module):
             pred = pred[0]  # Extract the first element if pred is a tuple
         sizep = pred.size(0)
         sizet = target.size(0)
-        pred_flat = pred.view(sizep, -1)
-        target_flat = target.view(sizet, -1)
+        pred_flat = pred.view(sizep, -1).float()
+        target_flat = target.view(sizet, -1).float()
 
-        loss = self.bceloss(pred_flat, target_flat)
+        # Always computed in fp32, BCE on half-precision probabilities is unstable
+        with torch.autocast(device_type=pred_flat.device.type, enabled=False):
+            loss = self.bceloss(pred_flat, target_flat)
 
         return loss
 
@@ -51,12 +54,14 @@ class DiceLoss(nn.Module):
 
         size = target.size(0)
 
-        pred_flat = pred.view(size, -1)
-        target_flat = target.view(size, -1)
+        pred_flat = pred.view(size, -1).float()
+        target_flat = target.view(size, -1).float()
 
-        intersection = pred_flat * target_flat
-        dice_score = (2 * intersection.sum(1) + smooth) / (pred_flat.sum(1) + target_flat.sum(1) + smooth)
-        dice_loss = 1 - dice_score.sum() / size
+        # The per-image sums are reduced in fp32 under mixed precision too
+        with torch.autocast(device_type=pred_flat.device.type, enabled=False):
+            intersection = pred_flat * target_flat
+            dice_score = (2 * intersection.sum(1) + smooth) / (pred_flat.sum(1) + target_flat.sum(1) + smooth)
+            dice_loss = 1 - dice_score.sum() / size
 
         return dice_loss
 
@@ -106,4 +111,45 @@ class GlobalCosineLoss(nn.Module):
             else:
                 loss += torch.mean(1 - self.cos_loss(a[item].view(a[item].shape[0], -1),
                                                      b[item].view(b[item].shape[0], -1))) * self.weight[item]
-        return loss
\ No newline at end of file
+        return loss
+
+
+class ShapePriorLoss(nn.Module):
+    def __init__(self, netD, size=(64, 64)):
+        """
+        Adversarial shape-prior term scored by a frozen, pre-trained WGAN critic.
+
+        Args:
+            netD (nn.Module): Critic (e.g. DCGAN_D) returning the batch-mean score.
+            size (tuple): Input resolution of the critic.
+        """
+        super(ShapePriorLoss, self).__init__()
+        self.netD = netD
+        self.size = tuple(size)
+        # Gradients flow to the inputs only, never to the critic weights
+        self.netD.requires_grad_(False)
+        self.netD.eval()
+
+    def train(self, mode=True):
+        # The critic always scores with its running BatchNorm statistics
+        super(ShapePriorLoss, self).train(mode)
+        self.netD.eval()
+        return self
+
+    def forward(self, *maps):
+        """
+        Computes the mean critic score over several same-batch side outputs.
+
+        All maps are resized to the critic resolution, stacked along the batch
+        dimension and scored with a single critic forward. With the critic in eval
+        mode this equals averaging one critic call per map.
+
+        Args:
+            maps (Tensor): Side outputs of shape (B, 1, H_i, W_i).
+
+        Returns:
+            Tensor: The averaged shape-prior loss, of shape (1,).
+        """
+        shapes = [m if tuple(m.shape[-2:]) == self.size else
+                  F.interpolate(m, size=self.size, mode='bilinear', align_corners=False) for m in maps]
+        return self.netD(torch.cat(shapes, 0))
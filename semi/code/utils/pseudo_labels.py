@@ -0,0 +1,201 @@
+import json
+import math
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Subset
+
+from semi.code.utils import distributed as dist_utils
+from semi.code.utils.amp import autocast
+from semi.code.utils.mytransforms import to_float
+
+# np.packbits bit order: the first pixel is the most significant bit of its byte
+BIT_WEIGHTS = (128, 64, 32, 16, 8, 4, 2, 1)
+
+
+def pack_masks(masks):
+    """
+    Packs binary masks 8 pixels per byte, like np.packbits over each flattened mask.
+
+    Args:
+        masks (torch.Tensor): (B, ...) bool or {0, 1} tensor, on any device.
+
+    Returns:
+        torch.Tensor: (B, ceil(pixels / 8)) uint8 tensor on the same device.
+    """
+    bits = masks.reshape(masks.size(0), -1).to(torch.uint8)
+    bits = torch.nn.functional.pad(bits, (0, -bits.size(1) % 8))
+    weights = torch.tensor(BIT_WEIGHTS, dtype=torch.uint8, device=bits.device)
+    return (bits.view(bits.size(0), -1, 8) * weights).sum(-1, dtype=torch.uint8)
+
+
+def unpack_masks(packed, size):
+    """
+    Inverse of pack_masks.
+
+    Returns:
+        torch.Tensor: (B, 1, H, W) uint8 tensor in {0, 1}.
+    """
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=packed.device)
+    bits = (packed[..., None] >> shifts) & 1
+    h, w = size
+    return bits.view(packed.size(0), -1)[:, :h * w].view(packed.size(0), 1, h, w)
+
+
+class PseudoLabelBank(object):
+    """
+    Offline pseudo-labels of the unlabeled pool, one bit-packed mask per image index.
+
+    train_semi by default takes the binary pseudo-label of an unlabeled image from an
+    extra encoder / seg-decoder pass of the current model on every step. With a bank,
+    the masks are refreshed every few epochs by a batched no-grad sweep of the model in
+    eval mode over the whole pool (refresh) and the training steps read them instead.
+
+    The masks are kept at the loader resolution and bit-packed (320x320 -> 12.5 KB per
+    image), either in a shared-memory tensor or, with ``path``, in a .npy memmap that
+    survives restarts: a resumed run then reuses the masks of the interrupted one
+    instead of sweeping again with newer weights. Both are read by the DataLoader
+    workers (see PseudoLabeled) and see a refresh without being restarted. Distributed
+    runs sweep one shard per rank; with a file, the ranks must share its file system.
+
+    Args:
+        n (int): Number of unlabeled images.
+        size (tuple): (H, W) of the masks, the resolution of the unlabeled samples.
+        path (str, optional): .npy file of the bank, None keeps it in shared memory.
+    """
+
+    def __init__(self, n, size=(320, 320), path=None):
+        self.n = n
+        self.size = tuple(size)
+        self.row = math.ceil(size[0] * size[1] / 8)
+        self.path = path
+        self.epoch = -1  # epoch of the last completed refresh
+        self.packed = None
+        self.memmap = None
+        if path is None:
+            self.packed = torch.zeros(n, self.row, dtype=torch.uint8).share_memory_()
+            return
+
+        if dist_utils.is_main_process():
+            meta = self.read_meta()
+            if meta is None or meta['n'] != n or tuple(meta['size']) != self.size or not os.path.isfile(path):
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n, self.row)).flush()
+                self.write_meta(-1)
+        dist_utils.barrier()
+        self.epoch = self.read_meta()['epoch']
+
+    def meta_path(self):
+        return os.path.splitext(self.path)[0] + '.json'
+
+    def read_meta(self):
+        if not os.path.isfile(self.meta_path()):
+            return None
+        with open(self.meta_path(), 'r') as f:
+            return json.load(f)
+
+    def write_meta(self, epoch):
+        tmp = self.meta_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'n': self.n, 'size': list(self.size), 'epoch': epoch}, f)
+        os.replace(tmp, self.meta_path())
+
+    def rows(self):
+        """
+        The (n, row) uint8 storage; a file bank is mapped on first use in each process.
+        """
+        if self.packed is None:
+            self.memmap = np.load(self.path, mmap_mode='r+')
+            self.packed = torch.from_numpy(self.memmap)
+        return self.packed
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path is not None:
+            # Workers map the file themselves instead of receiving a copy of it
+            state['packed'], state['memmap'] = None, None
+        return state
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        """
+        Returns:
+            torch.Tensor: (1, H, W) uint8 mask in {0, 255}, the label format of the
+            batch_aug loaders.
+        """
+        return unpack_masks(self.rows()[index][None], self.size)[0] * 255
+
+    def due(self, epoch, every):
+        """
+        True when the masks are not those of the refresh scheduled for ``epoch``
+        (every ``every`` epochs, from epoch 0).
+        """
+        return self.epoch != epoch - epoch % every
+
+    @torch.no_grad()
+    def refresh(self, model, dataset, epoch, batch_size=16, num_workers=0, collate_fn=None, amp='off',
+                device=torch.device('cpu')):
+        """
+        Recomputes every mask with one eval-mode sweep of ``model`` over ``dataset``.
+
+        Args:
+            model (torch.nn.Module): Unwrapped MyModel.
+            dataset (Dataset): The unlabeled images, indexed like the bank.
+            epoch (int): Epoch the refresh belongs to, see due.
+            amp (str): Mixed-precision mode of the sweep.
+        """
+        rank, world_size = dist_utils.get_rank(), dist_utils.get_world_size()
+        rows = self.rows()
+        if self.path is not None and dist_utils.is_main_process():
+            # A refresh interrupted half-way must not be taken for a complete one
+            self.write_meta(-1)
+        elif self.path is None:
+            rows.zero_()  # the shards of the other ranks are summed in below
+
+        shard = list(range(rank, self.n, world_size))
+        loader = DataLoader(Subset(dataset, shard), batch_size=batch_size, shuffle=False, num_workers=num_workers,
+                            collate_fn=collate_fn)
+        was_training = model.training
+        model.eval()
+        start = 0
+        for images in loader:
+            with autocast(amp, device.type):
+                mask = model(to_float(images.to(device, non_blocking=True)), outputs=('mask',))[0]
+            index = torch.tensor(shard[start:start + len(mask)])
+            rows[index] = pack_masks(mask.float() > 0.5).cpu()
+            start += len(mask)
+        model.train(was_training)
+
+        if self.path is not None:
+            self.memmap.flush()
+            dist_utils.barrier()
+            if dist_utils.is_main_process():
+                self.write_meta(epoch)
+        elif world_size > 1:
+            # Disjoint shards on a zeroed bank: the sum is the union
+            summed = rows.to(device)
+            torch.distributed.all_reduce(summed)
+            rows.copy_(summed.cpu())
+        dist_utils.barrier()
+        self.epoch = epoch
+
+
+class PseudoLabeled(Dataset):
+    """
+    Unlabeled samples paired with their banked pseudo-label, as {'image', 'label'}
+    dicts like the labeled batch_aug samples, so the batched geometric augmentation
+    transforms image and pseudo-label together.
+    """
+
+    def __init__(self, dataset, bank):
+        self.dataset = dataset
+        self.bank = bank
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return {'image': self.dataset[index], 'label': self.bank[index]}
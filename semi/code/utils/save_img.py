@@ -1,5 +1,13 @@
+import io
+import json
 import os
-from torchvision import transforms
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
 
 def save_img(x, suffix):
     """
@@ -10,6 +18,8 @@ def save_img(x, suffix):
         suffix (str): The filename suffix.
 
     """
+    from torchvision import transforms
+
     img = x.cpu().clone()
     img = img.squeeze(0)
     img = transforms.ToPILImage()(img)
@@ -19,3 +29,207 @@ def save_img(x, suffix):
     suffix = suffix.replace('jpg', 'png')
     img.save(os.path.join(img_save_dir, suffix))
 
+
+def encode_png(mask):
+    """
+    Encodes a (H, W) uint8 array as PNG bytes.
+    """
+    buf = io.BytesIO()
+    Image.fromarray(mask, 'L').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class PngSink(object):
+    """
+    Writes every prediction as an individual PNG file, like save_img.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, mask):
+        with open(os.path.join(self.path, name.replace('jpg', 'png')), 'wb') as f:
+            f.write(encode_png(mask))
+
+    def close(self):
+        pass
+
+
+class ZipSink(object):
+    """
+    Collects every prediction as a PNG entry of a single zip archive.
+
+    PNG encoding runs in the writer threads; only the archive append is serialised.
+    Entries are stored without recompression since PNG data is already deflated.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        self.lock = threading.Lock()
+
+    def write(self, name, mask):
+        data = encode_png(mask)
+        with self.lock:
+            self.archive.writestr(name.replace('jpg', 'png'), data)
+
+    def close(self):
+        self.archive.close()
+
+
+class MemmapSink(object):
+    """
+    Stores predictions as rows of a (capacity, H, W) uint8 NumPy memmap.
+
+    Row order follows submission order; the image names are written to an index
+    file (``<path>.json``) on close so that rows can be looked up by name.
+    """
+    def __init__(self, path, capacity):
+        if capacity is None:
+            raise ValueError("MemmapSink needs the number of predictions (capacity) up front")
+        self.path = path
+        self.capacity = capacity
+        self.array = None
+        self.names = []
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def reserve(self, names, shape):
+        """
+        Assigns memmap rows to ``names`` in submission order.
+
+        Returns:
+            int: The first reserved row.
+        """
+        with self.lock:
+            if self.array is None:
+                self.array = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint8,
+                                                       shape=(self.capacity,) + tuple(shape))
+            elif tuple(shape) != self.array.shape[1:]:
+                raise ValueError("Prediction shape {} does not match memmap rows {}".format(
+                    tuple(shape), self.array.shape[1:]))
+            start = len(self.names)
+            if start + len(names) > self.capacity:
+                raise ValueError("MemmapSink capacity {} exceeded".format(self.capacity))
+            self.names.extend(names)
+        return start
+
+    def write_rows(self, start, masks):
+        self.array[start:start + len(masks)] = masks
+
+    def close(self):
+        if self.array is not None:
+            self.array.flush()
+        index = {'names': self.names, 'shape': list(self.array.shape[1:]) if self.array is not None else None}
+        with open(os.path.splitext(self.path)[0] + '.json', 'w') as f:
+            json.dump(index, f)
+
+
+class PredictionWriter(object):
+    """
+    Output sink that moves prediction writing off the evaluation thread.
+
+    Predictions are converted to uint8 on their own device, copied to the host
+    asynchronously and handed to a bounded pool of writer threads, so the model
+    never waits on PNG compression or disk I/O.
+
+    Args:
+        target (str): 'png' (one file per image), 'zip' (single archive),
+            'memmap' (indexed uint8 NumPy memmap) or 'none' (discard, for validation).
+        path (str): Output directory for 'png'; output file for 'zip'/'memmap'.
+            Defaults to './result', './result/predictions.zip' or './result/predictions.npy'.
+        capacity (int, optional): Total number of predictions, required for 'memmap'.
+        num_workers (int): Number of writer threads.
+        max_pending (int): Maximum number of batches queued before write() blocks.
+    """
+    TARGETS = ('png', 'zip', 'memmap', 'none')
+
+    def __init__(self, target='png', path=None, capacity=None, num_workers=2, max_pending=8):
+        if target not in self.TARGETS:
+            raise ValueError("Unknown prediction target '{}', expected one of {}".format(target, self.TARGETS))
+        self.target = target
+        self.sink = None
+        if target == 'png':
+            self.sink = PngSink(path or './result')
+        elif target == 'zip':
+            self.sink = ZipSink(path or './result/predictions.zip')
+        elif target == 'memmap':
+            self.sink = MemmapSink(path or './result/predictions.npy', capacity)
+
+        self.pool = ThreadPoolExecutor(max_workers=num_workers) if self.sink is not None else None
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def write(self, x, names):
+        """
+        Queues a batch of predictions for writing.
+
+        Args:
+            x (torch.Tensor): Predictions in [0, 1] of shape (B, 1, H, W) or (B, H, W).
+            names (list of str): One file name per prediction.
+        """
+        if self.sink is None:
+            return
+        if self.errors:
+            raise self.errors[0]
+
+        # Same uint8 conversion as ToPILImage, done before the copy to shrink the transfer
+        masks = x.detach().reshape(len(names), x.shape[-2], x.shape[-1]).mul(255).to(torch.uint8)
+        event = None
+        if masks.is_cuda:
+            host = torch.empty(masks.shape, dtype=torch.uint8, pin_memory=True)
+            host.copy_(masks, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+        else:
+            host = masks
+
+        start = None
+        if isinstance(self.sink, MemmapSink):
+            start = self.sink.reserve(list(names), host.shape[1:])
+
+        self.pending.acquire()
+        future = self.pool.submit(self._write, host, event, list(names), start)
+        future.add_done_callback(self._done)
+
+    def _write(self, host, event, names, start):
+        if event is not None:
+            event.synchronize()
+        masks = host.numpy()
+        if start is not None:
+            self.sink.write_rows(start, masks)
+        else:
+            for name, mask in zip(names, masks):
+                self.sink.write(name, mask)
+
+    def _done(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def close(self, raise_errors=True):
+        """
+        Waits for every queued write, then finalises the sink.
+
+        Args:
+            raise_errors (bool): Re-raise the first failed write.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+            self.sink.close()
+        if self.errors and raise_errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # Drain the pool without replacing the exception already propagating
+        try:
+            self.close(raise_errors=False)
+        except Exception:
+            pass
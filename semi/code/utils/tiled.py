@@ -0,0 +1,143 @@
+import math
+from collections import deque
+
+import torch
+import torch.nn.functional as F
+
+
+def gaussian_weights(tile_size, sigma_scale=0.125, device=None):
+    """
+    Gaussian importance map of a tile, 1 at the centre and strictly positive everywhere.
+
+    Args:
+        tile_size (tuple): (height, width) of a tile.
+        sigma_scale (float): Standard deviation as a fraction of the tile side.
+
+    Returns:
+        torch.Tensor: float32 tensor of shape (1, height, width).
+    """
+    axes = []
+    for size in tile_size:
+        coords = torch.arange(size, dtype=torch.float32, device=device) - (size - 1) / 2
+        axes.append(torch.exp(-0.5 * (coords / (size * sigma_scale)) ** 2))
+    weights = axes[0][:, None] * axes[1][None, :]
+    weights = weights / weights.max()
+    # Border pixels covered by a single tile must not divide by (almost) zero
+    return weights.clamp_min(1e-3)[None]
+
+
+def tile_starts(length, tile, stride):
+    """
+    Start offsets of tiles covering [0, length): evenly spaced, at most stride apart,
+    the first at 0 and the last flush with the end.
+    """
+    if length <= tile:
+        return [0]
+    steps = math.ceil((length - tile) / stride)
+    return [round(i * (length - tile) / steps) for i in range(steps + 1)]
+
+
+class TiledPredictor(object):
+    """
+    Sliding-window inference of MyModel at native resolution.
+
+    Images of any size are cut into overlapping tile_size tiles, the tiles of
+    consecutive images are packed into fixed batches of batch_size, and the tile
+    predictions are blended back with Gaussian weights. Only one tile batch and the
+    accumulators of the images it touches are alive at a time, so memory is bounded by
+    batch_size, not by the image size; a large image fills whole batches on its own,
+    small ones share them.
+
+    Args:
+        model (torch.nn.Module): Segmentation model accepting ``outputs=(output,)``.
+        tile_size (int or tuple): Tile height and width, multiples of 32 for MyModel.
+        overlap (float): Fraction of a tile shared with its neighbour, in [0, 1).
+        batch_size (int): Tiles per forward.
+        output (str): Head to predict, a name from semi_self.OUTPUTS.
+        sigma_scale (float): Gaussian standard deviation as a fraction of the tile side.
+        memory_format (torch.memory_format): Layout of the tile batches fed to the model.
+    """
+    def __init__(self, model, tile_size=256, overlap=0.5, batch_size=16, output='preboud', sigma_scale=0.125,
+                 memory_format=torch.contiguous_format):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1), got {}".format(overlap))
+        self.model = model
+        self.tile_size = (tile_size, tile_size) if isinstance(tile_size, int) else tuple(tile_size)
+        self.stride = tuple(max(1, int(round(t * (1 - overlap)))) for t in self.tile_size)
+        self.batch_size = batch_size
+        self.output = output
+        self.sigma_scale = sigma_scale
+        self.memory_format = memory_format
+        self.device = next(model.parameters()).device
+        self.weights = gaussian_weights(self.tile_size, sigma_scale, self.device)
+
+    def tiles(self, height, width):
+        """
+        Returns the (top, left) corner of every tile of a (height, width) image.
+        """
+        return [(top, left) for top in tile_starts(height, self.tile_size[0], self.stride[0])
+                for left in tile_starts(width, self.tile_size[1], self.stride[1])]
+
+    def __call__(self, image):
+        """
+        Predicts a single (C, H, W) image, returns (K, H, W) probabilities.
+        """
+        return next(self.predict([image]))
+
+    @torch.no_grad()
+    def predict(self, images):
+        """
+        Streams tiles of ``images`` through the model in full batches.
+
+        Args:
+            images (iterable of torch.Tensor): (C, H, W) images of any size, consumed
+                lazily as the running batch needs tiles.
+
+        Yields:
+            torch.Tensor: (K, H, W) blended prediction of each image, in input order.
+        """
+        pending = deque()  # images with tiles still in flight: [sum, weight, tiles left, (H, W)]
+        batch, targets = [], []
+        for image in images:
+            image = image.to(self.device, non_blocking=True)
+            height, width = image.shape[-2:]
+            # Frames smaller than a tile are padded, the padding is cropped from the output
+            pad_h, pad_w = max(0, self.tile_size[0] - height), max(0, self.tile_size[1] - width)
+            if pad_h or pad_w:
+                image = F.pad(image, (0, pad_w, 0, pad_h))
+            corners = self.tiles(image.size(-2), image.size(-1))
+            state = [None, torch.zeros((1,) + image.shape[-2:], device=self.device), len(corners), (height, width)]
+            pending.append(state)
+            for top, left in corners:
+                batch.append(image[:, top:top + self.tile_size[0], left:left + self.tile_size[1]])
+                targets.append((state, top, left))
+                if len(batch) == self.batch_size:
+                    self.run_batch(batch, targets)
+                    batch, targets = [], []
+                    yield from self.finished(pending)
+        if batch:
+            self.run_batch(batch, targets)
+        yield from self.finished(pending)
+
+    def run_batch(self, batch, targets):
+        """
+        One forward over a batch of tiles, accumulated into the images' sum and weight maps.
+        """
+        x = torch.stack(batch).contiguous(memory_format=self.memory_format)
+        out = self.model(x, outputs=(self.output,))[0].float() * self.weights
+        th, tw = self.tile_size
+        for pred, (state, top, left) in zip(out, targets):
+            if state[0] is None:
+                state[0] = pred.new_zeros((pred.size(0),) + state[1].shape[-2:])
+            state[0][:, top:top + th, left:left + tw] += pred
+            state[1][:, top:top + th, left:left + tw] += self.weights
+            state[2] -= 1
+
+    @staticmethod
+    def finished(pending):
+        """
+        Pops and yields the leading images whose tiles have all been predicted.
+        """
+        while pending and pending[0][2] == 0:
+            total, weight, _, (height, width) = pending.popleft()
+            yield (total / weight)[:, :height, :width]
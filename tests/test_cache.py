@@ -0,0 +1,107 @@
+"""
+Samples read from the decoded-image cache must equal freshly decoded ones.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+import GAN.data.tn3k as gan_tn3k
+import semi.code.data.tn3k as semi_tn3k
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS = [semi_tn3k.tn3kDataSet, gan_tn3k.tn3kDataSet]
+# Frames larger and smaller than the 320x320 working resolution
+SIZES = [(400, 300), (250, 330), (320, 320), (180, 200)]
+
+
+@pytest.fixture(scope='module')
+def root(tmp_path_factory):
+    """
+    A tn3k tree of synthetic JPEG frames and PNG masks, split like expID 3.
+    """
+    root = tmp_path_factory.mktemp('tn3k')
+    rng = np.random.default_rng(0)
+    for split in ('trainval', 'test'):
+        os.makedirs(root / 'tn3k' / (split + '-image'))
+        os.makedirs(root / 'tn3k' / (split + '-mask'))
+    names = []
+    for i, (w, h) in enumerate(SIZES * 2):
+        name = '%04d.jpg' % i
+        split = 'test' if i >= len(SIZES) else 'trainval'
+        image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        mask = (rng.random((h, w)) > 0.5).astype(np.uint8) * 255
+        Image.fromarray(image).save(root / 'tn3k' / (split + '-image') / name)
+        Image.fromarray(mask).save(root / 'tn3k' / (split + '-mask') / name)
+        names.append(name)
+    os.makedirs(root / 'data/splits/tn3k/1289')
+    for path, split in (('1289/labeled.txt', names[:2]), ('1289/unlabeled.txt', names[2:4]), ('val.txt', names[:4])):
+        with open(root / 'data/splits/tn3k' / path, 'w') as f:
+            f.write('\n'.join(split))
+    return str(root)
+
+
+def pairs(dataset, root, tmp_path, **kwargs):
+    fresh = dataset(root, 3, **kwargs)
+    cached = dataset(root, 3, cache_dir=str(tmp_path / 'cache'), **kwargs)
+    assert cached.cache is not None
+    return fresh, cached
+
+
+def assert_same(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_same(a[key], b[key])
+    elif torch.is_tensor(a):
+        assert a.dtype == b.dtype and torch.equal(a, b)
+    else:
+        assert a == b
+
+
+@pytest.mark.parametrize('dataset', DATASETS)
+@pytest.mark.parametrize('mode', ['valid', 'test'])
+def test_pil_path(dataset, mode, root, tmp_path):
+    fresh, cached = pairs(dataset, root, tmp_path, mode=mode)
+    assert len(fresh) == len(cached) == len(SIZES)
+    for i in range(len(fresh)):
+        assert_same(fresh[i], cached[i])
+
+
+@pytest.mark.parametrize('dataset', DATASETS)
+def test_pil_training_chain(dataset, root, tmp_path):
+    # The random labeled chain starts with the Resize the cache stores
+    fresh, cached = pairs(dataset, root, tmp_path, mode='train', sign='label')
+    for i in range(len(fresh)):
+        random.seed(i)
+        a = fresh[i]
+        random.seed(i)
+        assert_same(a, cached[i])
+
+
+@pytest.mark.parametrize('dataset', DATASETS)
+@pytest.mark.parametrize('sign', ['label', 'unlabel'])
+def test_batch_aug_uint8_path(dataset, sign, root, tmp_path):
+    mytransforms = semi_tn3k if dataset is semi_tn3k.tn3kDataSet else gan_tn3k
+    if sign == 'label':
+        transform = transforms.Compose([mytransforms.Resize((320, 320)), mytransforms.ToUint8Tensor()])
+    else:
+        transform = transforms.Compose([transforms.Resize((320, 320)), mytransforms.ToUint8Tensor()])
+    fresh, cached = pairs(dataset, root, tmp_path, mode='train', sign=sign, transform=transform, uint8=True)
+    for i in range(len(fresh)):
+        assert_same(fresh[i], cached[i])
+
+
+def test_cache_modules_in_sync():
+    def source(path):
+        with open(os.path.join(ROOT, path)) as f:
+            return [line for line in f if 'import tn3kDataSet' not in line and 'holds a copy' not in line]
+
+    assert source('semi/code/data/cache.py') == source('GAN/data/utils/cache.py')
@@ -0,0 +1,120 @@
+"""
+Top-k ranking, file shifting and resume of the CheckpointManager.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import json
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from semi.code.utils.amp import grad_scaler
+from semi.code.utils.checkpoint import CheckpointManager
+
+
+def model_of(epoch):
+    """
+    A model whose weights identify the epoch it was saved at.
+    """
+    model = nn.Linear(2, 1)
+    with torch.no_grad():
+        model.weight.fill_(epoch)
+        model.bias.fill_(epoch)
+    return model
+
+
+def saved_epoch(directory, name):
+    return torch.load(os.path.join(directory, name + '.pth'), weights_only=True)['bias'].item()
+
+
+def manifest(directory):
+    with open(os.path.join(directory, 'topk.json')) as f:
+        return [(entry['name'], entry['epoch']) for entry in json.load(f)['checkpoints']]
+
+
+def fit(directory, scores, metric='F1', manager=None, last_after=None):
+    """
+    Validates one model per epoch with the given metric values; writes last.pth
+    after the epochs listed in ``last_after``.
+    """
+    ckpt = manager or CheckpointManager(str(directory), k=3, metric=metric, async_save=False)
+    for epoch, score in scores:
+        model = model_of(epoch)
+        ckpt.update(model, {metric: score}, epoch)
+        if last_after is not None and epoch in last_after:
+            optim = torch.optim.SGD(model.parameters(), lr=0.1)
+            ckpt.save_last(model, optim, grad_scaler('off', 'cpu'), epoch + 1)
+    return ckpt
+
+
+@pytest.mark.parametrize('async_save', [False, True])
+def test_topk_shifts_lower_ranks(tmp_path, async_save):
+    ckpt = CheckpointManager(str(tmp_path), k=3, async_save=async_save)
+    fit(tmp_path, [(0, 0.5), (1, 0.7), (2, 0.6), (3, 0.8), (4, 0.1), (5, 0.7)], manager=ckpt)
+    ckpt.close()
+    # 0.7 ties keep the earlier epoch, 0.5 falls out of the top 3
+    expected = [('best', 3), ('second_best', 1), ('third_best', 5)]
+    assert manifest(tmp_path) == expected
+    for name, epoch in expected:
+        assert saved_epoch(tmp_path, name) == epoch
+    assert not os.path.exists(tmp_path / 'top4.pth')
+
+
+def test_metric_without_dice(tmp_path):
+    ckpt = fit(tmp_path, [(0, 0.2), (1, 0.4)], metric='IoU_mean')
+    assert ckpt.best == 0.4
+    assert manifest(tmp_path) == [('best', 1), ('second_best', 0)]
+
+
+def test_resume_restores_state_and_ranking(tmp_path):
+    fit(tmp_path, [(0, 0.5), (1, 0.7), (2, 0.6)], last_after={2})
+
+    ckpt = CheckpointManager(str(tmp_path), k=3, async_save=False)
+    model = model_of(-1)
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    state = ckpt.resume(model, optim, grad_scaler('off', 'cpu'))
+    assert (state['epoch'], state['step']) == (3, 0)
+    assert model.bias.item() == 2
+    assert [(e['name'], e['epoch']) for e in ckpt.topk] == [('best', 1), ('second_best', 2), ('third_best', 0)]
+
+
+def resume(directory):
+    ckpt = CheckpointManager(str(directory), k=3, async_save=False)
+    model = model_of(-1)
+    ckpt.resume(model, torch.optim.SGD(model.parameters(), lr=0.1), grad_scaler('off', 'cpu'))
+    return ckpt
+
+
+def test_resume_renames_checkpoints_ahead_of_last(tmp_path):
+    # Epoch 2 was validated and ranked second, then the run died before its last.pth
+    fit(tmp_path, [(0, 0.5), (1, 0.7), (2, 0.6)], last_after={1})
+    assert manifest(tmp_path) == [('best', 1), ('second_best', 2), ('third_best', 0)]
+
+    resume(tmp_path)
+    expected = [('best', 1), ('second_best', 0)]
+    assert manifest(tmp_path) == expected
+    for name, epoch in expected:
+        assert saved_epoch(tmp_path, name) == epoch
+    assert not os.path.exists(tmp_path / 'third_best.pth')
+
+
+def test_resume_rolls_back_checkpoints_ahead_of_last(tmp_path):
+    # Epoch 3 was validated and ranked first, then the run died before its last.pth
+    fit(tmp_path, [(0, 0.5), (1, 0.7), (2, 0.6), (3, 0.9)], last_after={2})
+    assert manifest(tmp_path)[0] == ('best', 3)
+
+    ckpt = resume(tmp_path)
+    # Epoch 0 was pushed out by epoch 3 and is gone
+    expected = [('best', 1), ('second_best', 2)]
+    assert manifest(tmp_path) == expected
+    for name, epoch in expected:
+        assert saved_epoch(tmp_path, name) == epoch
+    assert not os.path.exists(tmp_path / 'third_best.pth')
+
+    # Validating epoch 3 again ranks it exactly once
+    fit(tmp_path, [(3, 0.9)], manager=ckpt)
+    assert manifest(tmp_path) == [('best', 3), ('second_best', 1), ('third_best', 2)]
+    assert [saved_epoch(tmp_path, name) for name, _ in manifest(tmp_path)] == [3, 1, 2]
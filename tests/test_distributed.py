@@ -0,0 +1,88 @@
+"""
+Smoke test of the distributed helpers on 2 CPU processes with the gloo backend.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import os
+import socket
+
+import pytest
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from semi.code.utils import distributed as dist_utils
+
+WORLD_SIZE = 2
+BATCH_SIZE = 4
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_model():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Conv2d(3, 4, 3, padding=1), nn.ReLU(), nn.Conv2d(4, 1, 1))
+
+
+def make_data():
+    g = torch.Generator().manual_seed(1)
+    return torch.rand(2 * BATCH_SIZE, 3, 8, 8, generator=g)
+
+
+def sgd_step(model, x):
+    optim = torch.optim.SGD(model.parameters(), lr=0.1)
+    model(x).mean().backward()
+    optim.step()
+
+
+def worker(rank, port, directory):
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(WORLD_SIZE),
+                      MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    assert dist_utils.init_distributed('gloo') == (rank, WORLD_SIZE, rank)
+    try:
+        data = make_data()
+        device = torch.device('cpu')
+
+        # Disjoint shards of batch_size // world_size samples, covering the dataset
+        loader, sampler = dist_utils.build_loader(list(range(len(data))), BATCH_SIZE, seed=3)
+        sampler.set_epoch(0)
+        indices = [i for batch in loader for i in batch.tolist()]
+        assert all(len(batch) == BATCH_SIZE // WORLD_SIZE for batch in loader)
+        shards = dist_utils.gather_object(indices)
+        assert sorted(shards[0] + shards[1]) == list(range(len(data)))
+
+        # One DDP step on the local shard equals one step on the global batch
+        model = dist_utils.wrap_model(make_model(), device)
+        batch = torch.as_tensor(indices[:BATCH_SIZE // WORLD_SIZE])
+        sgd_step(model, data[batch])
+        if rank == 0:
+            torch.save({'weights': dist_utils.unwrap(model).state_dict(),
+                        'batch': torch.cat([torch.as_tensor(s[:BATCH_SIZE // WORLD_SIZE]) for s in shards])},
+                       os.path.join(directory, 'ddp.pth'))
+
+        # Running statistics are averaged over the ranks
+        bn = nn.BatchNorm2d(3)
+        bn(data[batch])
+        stats = dist_utils.gather_object(bn.running_mean.clone())
+        dist_utils.sync_buffers(bn)
+        assert torch.allclose(bn.running_mean, (stats[0] + stats[1]) / 2)
+
+        with pytest.raises(ValueError, match='sync_bn'):
+            dist_utils.wrap_model(nn.Sequential(nn.Conv2d(3, 3, 1), nn.BatchNorm2d(3)), device, sync_bn=True)
+    finally:
+        dist_utils.cleanup()
+
+
+def test_gloo_two_processes(tmp_path):
+    mp.spawn(worker, args=(free_port(), str(tmp_path)), nprocs=WORLD_SIZE)
+
+    saved = torch.load(os.path.join(tmp_path, 'ddp.pth'), weights_only=True)
+    model = make_model()
+    sgd_step(model, make_data()[saved['batch']])
+    for name, value in model.state_dict().items():
+        assert torch.allclose(saved['weights'][name], value, atol=1e-6), name
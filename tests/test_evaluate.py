@@ -0,0 +1,54 @@
+"""
+The batched evaluator must give the numbers of the per-image evaluate_batch.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from semi.code.utils.evaluate import METRICS, confusion_counts, evaluate, evaluate_batch, metrics_from_counts
+
+
+def masks(batch_size=5, size=32):
+    g = torch.Generator().manual_seed(0)
+    pred = (torch.rand(batch_size, 1, size, size, generator=g) > 0.6).float()
+    gt = (torch.rand(batch_size, 1, size, size, generator=g) > 0.7).float()
+    pred[0], gt[0] = 0, 0  # all empty: TP == 0
+    pred[1] = 0  # nothing predicted on a positive mask: TP == 0
+    gt[2] = 1 - pred[2]  # disjoint: TP == 0
+    return pred, gt
+
+
+def test_counts_match_evaluate_batch():
+    pred, gt = masks()
+    batched = metrics_from_counts(confusion_counts(pred, gt))
+    for i in range(len(pred)):
+        ref = evaluate_batch(pred[i:i + 1], gt[i:i + 1])
+        for name, a, b in zip(METRICS, batched, ref):
+            assert torch.allclose(a[i], b), '{} of image {}: {} != {}'.format(name, i, a[i].item(), b.item())
+
+
+class Replay(nn.Module):
+    """
+    Stands in for MyModel: returns the image (the prediction to score) as its head.
+    """
+    def __init__(self):
+        super(Replay, self).__init__()
+        self.weight = nn.Parameter(torch.zeros(1))
+
+    def forward(self, x, outputs=('preboud',)):
+        return (x,)
+
+
+def test_evaluate_matches_per_image_means():
+    pred, gt = masks()
+    samples = [{'name': '%d.png' % i, 'image': p, 'label': t} for i, (p, t) in enumerate(zip(pred, gt))]
+    loader = DataLoader(samples, batch_size=2)
+    out = evaluate(Replay(), loader, len(loader), save_target='none')
+
+    per_image = [evaluate_batch(p[None], t[None]) for p, t in zip(pred, gt)]
+    for k, name in enumerate(METRICS):
+        ref = sum(m[k].item() for m in per_image) / len(per_image)
+        assert abs(out[k] - ref) < 1e-6, '{}: {} != {}'.format(name, out[k], ref)
@@ -0,0 +1,90 @@
+"""
+fuse_geometric must reproduce the per-step transform chains for the same RNG draw.
+
+The rotation and zoom ranges are pinned to 90 degrees and 1x so that every drawn
+step maps pixel centres onto pixel centres: the single fused resample and the
+step-by-step chain then agree exactly, whatever the interpolation.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import random
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from semi.code.utils.mytransforms import (FusedGeometric, RandomCrop, RandomHorizontalFlip, RandomRotation,
+                                          RandomVerticalFlip, RandomZoom, Resize, ToTensor, fuse_geometric)
+
+
+def sample(size=320):
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), 'RGB')
+    label = Image.fromarray((rng.random((size, size)) > 0.5).astype(np.uint8) * 255, 'L')
+    return {'image': image, 'label': label}
+
+
+def labeled_chain():
+    return transforms.Compose([
+        Resize((320, 320)),
+        RandomHorizontalFlip(),
+        RandomVerticalFlip(),
+        RandomRotation((90, 90)),
+        RandomZoom((1, 1)),
+        RandomCrop((256, 256)),
+        ToTensor()
+    ])
+
+
+def unlabeled_chain():
+    return transforms.Compose([
+        transforms.Resize((320, 320)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomVerticalFlip(),
+        transforms.RandomRotation((90, 90)),
+        transforms.RandomCrop((256, 256)),
+        transforms.ToTensor()
+    ])
+
+
+def test_resize_is_not_fused():
+    fused = fuse_geometric(labeled_chain()).transforms
+    assert isinstance(fused[0], Resize)
+    assert isinstance(fused[1], FusedGeometric) and len(fused[1].transforms) == 5
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_labeled_chain_matches(seed):
+    # A 320x320 input, like a cached frame: the Resize does nothing
+    data = sample()
+    random.seed(seed)
+    ref = labeled_chain()(data)
+    random.seed(seed)
+    out = fuse_geometric(labeled_chain())(data)
+    assert torch.equal(ref['image'], out['image'])
+    assert torch.equal(ref['label'], out['label'])
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_unlabeled_chain_matches(seed):
+    image = sample()['image']
+    torch.manual_seed(seed)
+    ref = unlabeled_chain()(image)
+    torch.manual_seed(seed)
+    out = fuse_geometric(unlabeled_chain())(image)
+    assert torch.equal(ref, out)
+
+
+def test_large_frames_are_resized_with_antialiasing():
+    # Uncached frames are bigger than 320: the fused chain must see the F.resize output
+    data = sample(size=640)
+    resized = Resize((320, 320))(data)
+    random.seed(0)
+    out = fuse_geometric(labeled_chain())(data)
+    random.seed(0)
+    ref = fuse_geometric(labeled_chain())(resized)
+    assert torch.equal(ref['image'], out['image'])
+    assert torch.equal(ref['label'], out['label'])
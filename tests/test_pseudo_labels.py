@@ -0,0 +1,69 @@
+"""
+Bit-packing of the pseudo-label bank and its .npy / .json store.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import json
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from semi.code.utils.pseudo_labels import PseudoLabelBank, pack_masks, unpack_masks
+
+
+def random_masks(shape, seed=0):
+    return torch.rand(shape, generator=torch.Generator().manual_seed(seed)) > 0.5
+
+
+@pytest.mark.parametrize('size', [(13, 11), (8, 8), (1, 1), (3, 7), (320, 320)])
+def test_pack_round_trip(size):
+    masks = random_masks((3, 1) + size)
+    packed = pack_masks(masks)
+    assert packed.dtype == torch.uint8
+    assert packed.shape == (3, (size[0] * size[1] + 7) // 8)
+    assert torch.equal(unpack_masks(packed, size), masks.to(torch.uint8))
+
+
+def test_pack_matches_numpy_packbits():
+    masks = random_masks((2, 1, 13, 11))
+    expected = np.packbits(masks.reshape(2, -1).numpy(), axis=1)
+    assert np.array_equal(pack_masks(masks).numpy(), expected)
+
+
+class Threshold(nn.Module):
+    """
+    Stands in for MyModel: the seg head is the first image channel.
+    """
+    def __init__(self):
+        super(Threshold, self).__init__()
+        self.weight = nn.Parameter(torch.zeros(1))
+
+    def forward(self, x, outputs=('mask',)):
+        return (x[:, :1],)
+
+
+def test_disk_bank_store_and_reload(tmp_path):
+    size = (13, 11)
+    images = torch.randint(0, 256, (5, 3) + size, dtype=torch.uint8, generator=torch.Generator().manual_seed(1))
+    expected = (images[:, :1] > 127).to(torch.uint8) * 255
+    path = str(tmp_path / 'pseudo_labels.npy')
+
+    bank = PseudoLabelBank(len(images), size, path=path)
+    assert bank.epoch == -1 and bank.due(0, every=2)
+    bank.refresh(Threshold(), images, epoch=4, batch_size=2)
+    assert torch.equal(torch.stack([bank[i] for i in range(len(images))]), expected)
+    with open(tmp_path / 'pseudo_labels.json') as f:
+        assert json.load(f) == {'n': 5, 'size': list(size), 'epoch': 4}
+
+    # A new bank on the same file (a resumed run) maps the stored masks
+    reloaded = PseudoLabelBank(len(images), size, path=path)
+    assert reloaded.epoch == 4 and not reloaded.due(5, every=2)
+    assert torch.equal(torch.stack([reloaded[i] for i in range(len(images))]), expected)
+
+    # A bank of another shape starts over
+    other = PseudoLabelBank(len(images), (8, 8), path=path)
+    assert other.epoch == -1
+    assert not other.rows().any()
@@ -0,0 +1,27 @@
+"""
+The single-pass MyModel forward must reproduce the two-pass outputs in eval mode.
+
+Run from the repository root:
+    python -m pytest -q tests
+"""
+import pytest
+import torch
+
+from semi.code.benchmarks.single_pass import check_equivalence
+from semi.code.models.semi_self import MyModel, OUTPUTS
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    return MyModel(pretrained=False)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2])
+def test_single_pass_matches_two_pass(model, batch_size):
+    x = torch.rand(batch_size, 3, 64, 64, generator=torch.Generator().manual_seed(batch_size))
+    diffs = check_equivalence(model, x)
+    assert set(diffs) == set(OUTPUTS)
+    for name, diff in diffs.items():
+        assert diff <= 1e-5, '{} differs by {:.3e}'.format(name, diff)
+